@@ -1,7 +1,7 @@
 # main.py
 import sys
 import numexpr as ne
-ne.set_num_threads(32)   # or any number ≤ cores
+ne.set_num_threads(ne.detect_number_of_cores())   # one numexpr thread per core
 
 
 from PySide6.QtWidgets import QApplication
@@ -1,4 +1,5 @@
 #src/core/Export_Selected.py
+import os
 from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, 
                                QLineEdit, QPushButton, QComboBox, QGroupBox, 
                                QRadioButton, QListWidget, QDialogButtonBox, 
@@ -6,12 +7,12 @@ from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QFormLayout,
 # from datetime import datetime
 
 class TiffExportDialog(QDialog):
-    """Simplified export dialog for GeoTIFF format"""
+    """Simplified export dialog for GeoTIFF, ENVI and Zarr formats"""
     
     def __init__(self, layer, parent=None):
         super().__init__(parent)
         self.layer = layer
-        self.setWindowTitle(f"Export to GeoTIFF: {layer['name']}")
+        self.setWindowTitle(f"Export Layer: {layer['name']}")
         self.setMinimumSize(450, 500)
         self.setup_ui()
         
@@ -37,6 +38,12 @@ class TiffExportDialog(QDialog):
         options_group = QGroupBox("Export Options")
         options_layout = QFormLayout(options_group)
         
+        # Format
+        self.format_combo = QComboBox()
+        self.format_combo.addItems(['GeoTIFF', 'ENVI (BSQ)', 'ENVI (BIL)', 'Zarr'])
+        self.format_combo.currentTextChanged.connect(self.on_format_changed)
+        options_layout.addRow("Format:", self.format_combo)
+        
         # Extent
         self.extent_combo = QComboBox()
         self.extent_combo.addItems(['Full extent', 'Current view'])
@@ -54,6 +61,10 @@ class TiffExportDialog(QDialog):
         self.compression_combo.setCurrentText('LZW')
         options_layout.addRow("Compression:", self.compression_combo)
         
+        # Cloud-Optimized GeoTIFF (internal overviews, COG layout)
+        self.cog_check = QCheckBox("Cloud-Optimized GeoTIFF (with overviews)")
+        options_layout.addRow("", self.cog_check)
+        
         layout.addWidget(options_group)
         
         # Band selection
@@ -114,16 +125,33 @@ class TiffExportDialog(QDialog):
     def browse_file(self):
         from PySide6.QtWidgets import QFileDialog
         
+        file_filter = {
+            'GeoTIFF': "GeoTIFF Files (*.tif *.tiff)",
+            'ENVI (BSQ)': "ENVI Files (*.hdr)",
+            'ENVI (BIL)': "ENVI Files (*.hdr)",
+            'Zarr': "Zarr Stores (*.zarr)",
+        }[self.format_combo.currentText()]
         file_path, _ = QFileDialog.getSaveFileName(
             self, 
-            "Export GeoTIFF", 
-            f"{self.layer['name']}_export.tif",
-            "GeoTIFF Files (*.tif *.tiff);;All Files (*.*)"
+            "Export Layer", 
+            os.path.basename(self.file_path_edit.text()),
+            f"{file_filter};;All Files (*.*)"
         )
         
         if file_path:
             self.file_path_edit.setText(file_path)
     
+    def on_format_changed(self, format_name):
+        """Update the file extension and the GeoTIFF-only options for the chosen format"""
+        is_tiff = format_name == 'GeoTIFF'
+        self.compression_combo.setEnabled(is_tiff)
+        self.cog_check.setEnabled(is_tiff)
+        
+        extension = {'GeoTIFF': '.tif', 'ENVI (BSQ)': '.hdr', 'ENVI (BIL)': '.hdr', 'Zarr': '.zarr'}[format_name]
+        path = self.file_path_edit.text()
+        if path:
+            self.file_path_edit.setText(os.path.splitext(path)[0] + extension)
+    
     def get_export_options(self):
         """Get all export options from the dialog"""
         selected_bands = 'all'
@@ -143,5 +171,7 @@ class TiffExportDialog(QDialog):
             'extent': extent,
             'data_type': self.data_type_combo.currentText(),
             'compression': self.compression_combo.currentText(),
-            'selected_bands': selected_bands
+            'selected_bands': selected_bands,
+            'cog': self.cog_check.isChecked(),
+            'interleave': 'bil' if self.format_combo.currentText() == 'ENVI (BIL)' else 'bsq'
         }
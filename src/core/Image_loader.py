@@ -12,6 +12,8 @@ from PySide6.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayo
                                QDialogButtonBox, QAbstractItemView)
 from typing import Optional, Tuple, List, Dict
 
+from src.core.band_statistics import request_band_statistics
+
 
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -75,6 +77,7 @@ class HyperspectralImageLoader:
         self.metadata = {}
         self.band_names = []
         self.wavelengths = []
+        self.fwhm = []
         self.wavelength_units = "Unknown"
         self.geotransform = None
         self.projection = ""
@@ -243,17 +246,6 @@ class HyperspectralImageLoader:
 
             end = time.time()
             logger.info(f"Image data read from GDAL in {end - start:.2f} seconds.")
-             # Count problematic values
-            zero_count = np.sum(image_data_gdal == 0)
-            negative_count = np.sum(image_data_gdal < 0)
-            nan_count = np.sum(np.isnan(image_data_gdal))
-            total_pixels = image_data_gdal.size
-            
-            print(f"Data quality assessment:")
-            print(f"  Total pixels: {total_pixels}")
-            print(f"  Zero values: {zero_count} ({zero_count/total_pixels*100:.2f}%)")
-            print(f"  Negative values: {negative_count} ({negative_count/total_pixels*100:.2f}%)")
-            print(f"  NaN values: {nan_count} ({nan_count/total_pixels*100:.2f}%)")
         
             if image_data_gdal.ndim == 3:
                 self.image_data = np.moveaxis(image_data_gdal, 0, -1)
@@ -261,6 +253,10 @@ class HyperspectralImageLoader:
                 self.image_data = image_data_gdal[:, :, np.newaxis]
             else:
                 raise ValueError(f"Unsupported image dimension: {image_data_gdal.ndim}")
+
+            # Count problematic values with the shared statistics pass, in the background;
+            # the statistics are cached for every other view of this data
+            request_band_statistics(self.image_data).add_done_callback(self._report_data_quality)
         end = time.time()
         logger.info(f"Image data read in {end - start:.2f} seconds.")
 
@@ -282,6 +278,22 @@ class HyperspectralImageLoader:
         return self.image_data[::factor, ::factor, :]
     
 
+    @staticmethod
+    def _report_data_quality(future):
+        if future.exception() is not None:
+            logger.warning(f"Data quality assessment failed: {future.exception()}")
+            return
+        stats = future.result()
+        total_pixels = stats.num_pixels * stats.num_bands
+        zero_count = int(stats.zeros.sum())
+        negative_count = int(stats.negatives.sum())
+        nan_count = int(stats.invalid.sum())
+        print(f"Data quality assessment:")
+        print(f"  Total pixels: {total_pixels}")
+        print(f"  Zero values: {zero_count} ({zero_count/total_pixels*100:.2f}%)")
+        print(f"  Negative values: {negative_count} ({negative_count/total_pixels*100:.2f}%)")
+        print(f"  NaN/Inf values: {nan_count} ({nan_count/total_pixels*100:.2f}%)")
+
     def fast_percentile_normalization(self, band_data: np.ndarray, sample_size: int = 10000) -> tuple:
         """Fast percentile calculation using sampling for large arrays"""
         if band_data.size <= sample_size:
@@ -317,6 +329,13 @@ class HyperspectralImageLoader:
                         print("Total bands:", len(self.wavelengths))
                     else:
                         print("No wavelength found")
+                    # Band widths, used to build spectral response functions for resampling
+                    match = re.search(r"\bfwhm\s*=\s*{([^}]*)}", text, re.IGNORECASE | re.DOTALL)
+                    if match:
+                        self.fwhm = [float(w) for w in match.group(1).replace(",", " ").split()]
+                    match = re.search(r"wavelength units\s*=\s*([^\n]+)", text, re.IGNORECASE)
+                    if match:
+                        self.wavelength_units = match.group(1).strip()
         except Exception as e:
             print(f"Error reading header file for wavelengths: {e}")
 
@@ -328,6 +347,9 @@ class HyperspectralImageLoader:
         if "Wavelengths" not in self.metadata:
             self.metadata["Wavelengths"] = self.wavelengths
 
+        if "FWHM" not in self.metadata and self.fwhm:
+            self.metadata["FWHM"] = self.fwhm
+
         if "RasterYSize" not in self.metadata:
             self.metadata["RasterYSize"] = self._dataset.RasterYSize
 
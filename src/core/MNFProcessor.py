@@ -7,11 +7,20 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QSlider, QSpinBox, QLabel, QMessageBox
+    QPushButton, QSlider, QSpinBox, QLabel, QMessageBox,
+    QDialog, QDialogButtonBox, QFormLayout, QGroupBox, QComboBox, QDoubleSpinBox, QCheckBox, QFileDialog
 )
 from PySide6.QtCore import Qt, QTimer
 import  logging 
 
+from src.core.component_transform import forward_transform
+from src.core.raster_export import ArraySource, create_exporter
+from src.core.transform_stats import TRANSFORM_STATS_EXTENSION, TransformStatistics
+from src.core.covariance import (
+    DEFAULT_SAMPLE_FRACTION, SAMPLING_MODES, SamplingDiagnostics, compute_covariance,
+    compute_sampled_covariance, mnf_decomposition, pca_decomposition
+)
+
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,16 +30,19 @@ class MNFViewerWindow(QMainWindow):
     An interactive window to view MNF components with navigation, animation,
     and an option to add the result as a new layer.
     """
-    def __init__(self, mnf_components, eigenvalues, layer_name, parent_viewer=None):
+    def __init__(self, mnf_components, eigenvalues, layer_name, parent_viewer=None, method="MNF", diagnostics=None,
+                 statistics=None):
         super().__init__()
         self.mnf_components = mnf_components
         self.eigenvalues = eigenvalues
+        self.method = method
+        self.statistics = statistics
         # store an optional source layer name for descriptive exports
         self.layer_name = layer_name if layer_name is not None else "MNF"
         self.num_components = mnf_components.shape[2]
         self.current_component = 0
         self.parent_viewer = parent_viewer  # Reference to the main ImageViewerWindow
-        self.setWindowTitle("Interactive MNF Viewer")
+        self.setWindowTitle(f"Interactive {method} Viewer")
         self.setGeometry(150, 150, 800, 700)
 
         # --- Main Layout ---
@@ -42,6 +54,11 @@ class MNFViewerWindow(QMainWindow):
         self.figure, self.ax = plt.subplots()
         self.canvas = FigureCanvas(self.figure)
         self.layout.addWidget(self.canvas)
+        if diagnostics:
+            # Accuracy of statistics estimated from a pixel sample
+            diagnostics_label = QLabel(diagnostics)
+            diagnostics_label.setWordWrap(True)
+            self.layout.addWidget(diagnostics_label)
         self.toolbar = NavigationToolbar2QT(self.canvas, self)
         self.addToolBar(self.toolbar)
 
@@ -100,11 +117,20 @@ class MNFViewerWindow(QMainWindow):
         
         # --- Add to Layers Button ---
         if self.parent_viewer:
-            self.add_layer_button = QPushButton("Add MNF Components to Viewer")
+            self.add_layer_button = QPushButton(f"Add {method} Components to Viewer")
             self.add_layer_button.setStyleSheet("background-color: #4CAF50; color: white;")
             self.add_layer_button.clicked.connect(self.add_as_layer)
             self.layout.addWidget(self.add_layer_button)
 
+        self.save_button = QPushButton(f"Save {method} Components to File...")
+        self.save_button.clicked.connect(self.save_to_file)
+        self.layout.addWidget(self.save_button)
+
+        if self.statistics is not None:
+            self.save_stats_button = QPushButton(f"Save {method} Statistics...")
+            self.save_stats_button.clicked.connect(self.save_statistics)
+            self.layout.addWidget(self.save_stats_button)
+
         # --- Timer for Animation ---
         self.animation_timer = QTimer(self)
         self.animation_timer.timeout.connect(self.animate_frame)
@@ -126,29 +152,56 @@ class MNFViewerWindow(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please select at least 1 component to export.")
             return
 
-        # Do not mutate the original mnf_components in the viewer; slice into a new array
-        try:
-            export_cube = self.mnf_components[:, :, :comp_index].copy()
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Could not prepare MNF components for export: {e}")
-            return
-
-        # Ensure float32 dtype for downstream display/storage
-        try:
-            export_cube = export_cube.astype(np.float32)
-        except Exception:
-            pass
-        
+        # The components are already float32: the layer shares them (a view of the
+        # leading components), the viewer closes once they are added
+        export_cube = self.mnf_components[:, :, :comp_index]
 
         # Add to parent viewer as a new layer with a descriptive name
         self.parent_viewer.add_layer(
             image_data=export_cube,
-            name=f"{self.layer_name} (MNF {comp_index})"
+            name=f"{self.layer_name} ({self.method} {comp_index})"
         )
 
-        QMessageBox.information(self, "Success", "MNF components added as a new layer.")
+        QMessageBox.information(self, "Success", f"{self.method} components added as a new layer.")
         self.close()  # Close the viewer after adding the layer
 
+    def save_to_file(self):
+        """Writes the selected number of leading components to a GeoTIFF, ENVI or Zarr file."""
+        comp_index = int(self.selected_component.value())
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, f"Save {self.method} Components", f"{self.layer_name}_{self.method.lower()}{comp_index}.tif",
+            "GeoTIFF (*.tif *.tiff);;ENVI (*.img *.dat);;Zarr (*.zarr)"
+        )
+        if not file_path:
+            return
+        # Georeference like the source layer when the main viewer still has it
+        layers = getattr(self.parent_viewer, 'layers', None) or []
+        source_layer = next((layer for layer in layers if layer.get('name') == self.layer_name), {})
+        try:
+            create_exporter(file_path, data_type='Float32').export(
+                ArraySource(self.mnf_components, bands=range(comp_index)),
+                geotransform=source_layer.get('geotransform'),
+                projection=source_layer.get('projection'),
+                band_names=[f"{self.method} {i + 1}" for i in range(comp_index)],
+            )
+            QMessageBox.information(self, "File Saved", f"{comp_index} {self.method} components saved to {file_path}")
+        except Exception as e:
+            QMessageBox.warning(self, "Save Error", f"Could not save file: {e}")
+
+    def save_statistics(self):
+        """Writes the transform statistics, to apply the same transform to other scenes."""
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, f"Save {self.method} Statistics", f"{self.layer_name}_{self.method.lower()}{TRANSFORM_STATS_EXTENSION}",
+            f"Transform statistics (*{TRANSFORM_STATS_EXTENSION})"
+        )
+        if not file_path:
+            return
+        try:
+            file_path = self.statistics.save(file_path)
+            QMessageBox.information(self, "File Saved", f"{self.method} statistics saved to {file_path}")
+        except Exception as e:
+            QMessageBox.warning(self, "Save Error", f"Could not save file: {e}")
+
     def show_component(self):
         xlim, ylim = None, None
         if self.ax.images:
@@ -159,7 +212,7 @@ class MNFViewerWindow(QMainWindow):
         self.ax.imshow(self.mnf_components[:, :, self.current_component], cmap='gray')
 
 
-        self.ax.set_title(f'MNF Component {self.current_component + 1} / {self.num_components}')
+        self.ax.set_title(f'{self.method} Component {self.current_component + 1} / {self.num_components}')
         self.ax.axis('off')
 
         if xlim and ylim:
@@ -227,97 +280,210 @@ class MNFViewerWindow(QMainWindow):
 
 
 
+class MNFOptionsDialog(QDialog):
+    """Statistics options of an MNF or PCA run: all pixels or a spatial sample."""
+
+    def __init__(self, method="MNF", num_pixels=None, num_bands=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"{method} Options")
+        layout = QVBoxLayout(self)
+
+        # Only the leading components are transformed: time and memory scale with their number
+        transform_group = QGroupBox("Transform")
+        transform_form = QFormLayout(transform_group)
+        self.components_spin = QSpinBox()
+        self.components_spin.setRange(1, num_bands or 1000)
+        self.components_spin.setValue(min(num_bands or MNFProcessor.DEFAULT_COMPONENTS, MNFProcessor.DEFAULT_COMPONENTS))
+        transform_form.addRow("Components:", self.components_spin)
+        layout.addWidget(transform_group)
+
+        group = QGroupBox("Statistics")
+        form = QFormLayout(group)
+        self.pixels_combo = QComboBox()
+        self.pixels_combo.addItems(["All pixels", "Sample of the pixels"])
+        self.pixels_combo.currentIndexChanged.connect(self._update_enabled)
+        form.addRow("Estimate from:", self.pixels_combo)
+
+        self.mode_combo = QComboBox()
+        for mode, description in SAMPLING_MODES.items():
+            self.mode_combo.addItem(description, mode)
+        form.addRow("Sampling:", self.mode_combo)
+
+        self.fraction_spin = QDoubleSpinBox()
+        self.fraction_spin.setRange(0.1, 100.0)
+        self.fraction_spin.setDecimals(1)
+        self.fraction_spin.setSuffix(" %")
+        self.fraction_spin.setValue(DEFAULT_SAMPLE_FRACTION * 100)
+        form.addRow("Fraction:", self.fraction_spin)
+
+        self.seed_spin = QSpinBox()
+        self.seed_spin.setRange(0, 2 ** 31 - 1)
+        form.addRow("Seed:", self.seed_spin)
+
+        self.stability_check = QCheckBox(f"Check stability against a {MNFProcessor.REFERENCE_FACTOR}x larger sample")
+        self.stability_check.setChecked(True)
+        form.addRow("", self.stability_check)
+        layout.addWidget(group)
+
+        if num_pixels:
+            layout.addWidget(QLabel(f"{num_pixels:,} pixels. A few percent usually gives near-identical components; "
+                                    f"the transform is always applied to every pixel."))
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self._update_enabled()
+
+    def _update_enabled(self):
+        sampled = self.pixels_combo.currentIndex() == 1
+        for widget in (self.mode_combo, self.fraction_spin, self.seed_spin, self.stability_check):
+            widget.setEnabled(sampled)
+
+    def options(self):
+        """Keyword arguments of `MNFProcessor` for the chosen options."""
+        if self.pixels_combo.currentIndex() == 0:
+            return {'sample_fraction': 1.0, 'num_components': self.components_spin.value()}
+        return {
+            'num_components': self.components_spin.value(),
+            'sample_fraction': self.fraction_spin.value() / 100.0,
+            'sampling_mode': self.mode_combo.currentData(),
+            'seed': self.seed_spin.value(),
+            'check_stability': self.stability_check.isChecked(),
+        }
+
 
 class MNFProcessor:
-    def __init__(self, data, layer_name=None):
+    """
+    MNF (or PCA, with method='pca') of a (height, width, bands) cube.
+
+    The statistics come from every pixel by default. With `sample_fraction`
+    below 1 they are estimated from a spatial sample (see
+    `compute_sampled_covariance`), which is much faster on large scenes; the
+    transform is still applied to every pixel. With `check_stability`, the
+    components are also estimated from a sample `REFERENCE_FACTOR` times larger
+    (or all pixels) and `diagnostics` reports how well they agree.
+
+    Only the first `num_components` columns of the transform are applied (all
+    by default), tile by tile in float32.
+
+    With `statistics` (a `TransformStatistics`, e.g. saved from another scene
+    of the same sensor), nothing is estimated: the saved transform is applied
+    as is. `statistics()` returns the statistics of a run for saving.
+    """
+    REFERENCE_FACTOR = 4
+    DEFAULT_COMPONENTS = 30
+
+    def __init__(self, data, layer_name=None, method='mnf', sample_fraction=1.0, sampling_mode='grid',
+                 seed=0, check_stability=False, num_components=None, statistics=None, wavelengths=None,
+                 file_path=None):
         if not isinstance(data, np.ndarray) or data.ndim != 3:
              raise ValueError("Data must be a 3D numpy array (height, width, bands)")
+        if method not in ('mnf', 'pca'):
+            raise ValueError(f"Unknown method '{method}'. Use 'mnf' or 'pca'.")
+        if statistics is not None:
+            statistics.check_compatible(data.shape[2], wavelengths)
         self.data = data
+        self.method = method
+        self.sample_fraction = sample_fraction
+        self.sampling_mode = sampling_mode
+        self.seed = seed
+        self.check_stability = check_stability
+        self.num_components = num_components
+        self.wavelengths = wavelengths
+        self.file_path = file_path
+        self.saved_statistics = statistics
+        self.diagnostics = None
         # layer_name is optional for backwards compatibility
         self.layer_name = layer_name if layer_name is not None else "MNF Components"
         self.mnf_components = None
         self.eigenvalues = None
         self.noise_stats = None
         self.eigenvectors = None
+        self.mean = None
+        self.signal_cov = None
+        self.noise_cov = None
+        self.transform = None
         self.mnf_viewer_window = None
     @staticmethod
     def estimate_noise_cov(cube: np.ndarray) -> np.ndarray:
-        print("code updated")
         """Noise covariance via first differences along rows."""
-        diff = cube[1:, :, :].astype(np.float64) - cube[:-1, :, :].astype(np.float64)
-        Xn = diff.reshape(-1, diff.shape[-1])
-        Xn = Xn[~np.isnan(Xn).any(axis=1)]
-        if Xn.size == 0:
-            raise ValueError("Noise estimation failed (NaNs everywhere after diff).")
-        Xn = Xn - Xn.mean(axis=0, keepdims=True)
-        Cn = (Xn.T @ Xn) / max(1, Xn.shape[0] - 1)
-        return Cn
+        _, noise = compute_covariance(cube, noise=True)
+        return noise.covariance()
+
 
+    def _statistics(self, fraction, seed):
+        """Signal and noise statistics and the decomposition from `fraction` of the pixels."""
+        noise = self.method == 'mnf'
+        signal, shift = compute_sampled_covariance(self.data, fraction, self.sampling_mode, seed, noise=noise)
+        if noise:
+            eigenvalues, transform = mnf_decomposition(signal.covariance(), shift.covariance())
+        else:
+            eigenvalues, transform = pca_decomposition(signal.covariance())
+        return signal, shift, eigenvalues, transform
 
     def apply_mnf(self):
         #applying check whether image is loaded or not
         if self.data is None:
             raise ValueError("No data loaded. Please load an image before applying MNF.")
-        print(f"From MNF calculator {self.data.shape}")
-
-        print(f"Zero {np.sum(self.data ==0)}")
-        print(f"Nan {np.sum(np.isnan(self.data))}")
-        print(f"Negative {np.sum(self.data < 0)}")
-
-        print(f"Infinite values in data: {np.isinf(self.data).any()}")
-        print(f"Data range: {self.data.min()} to {self.data.max()}")
-
+        logger.info(f"{self.method.upper()} of {self.data.shape} ({self.data.dtype})")
+
+        if self.saved_statistics is not None:
+            # Statistics of another scene: a single streaming matrix multiply, no re-estimation
+            stats = self.saved_statistics
+            self.mean, self.signal_cov, self.noise_cov = stats.mean, stats.signal_cov, stats.noise_cov
+            self.eigen_values, self.transform = stats.eigenvalues, stats.forward
+            self.mnf_components = stats.apply(self.data, self.num_components)
+            logger.info(f"Applied saved {stats.method.upper()} transform of "
+                        f"'{stats.provenance.get('layer_name', 'unknown')}': {self.mnf_components.shape}")
+            return self.mnf_components, self.eigen_values
+
+        # Mean, signal and noise covariance in one streaming pass (over all pixels or a sample)
         height, width, bands = self.data.shape
-        data_2d = self.data.reshape(-1, bands)
-        X = np.nan_to_num(data_2d, nan=0.0)
-        Cn = self.estimate_noise_cov(self.data)
-        mu = X.mean(axis=0, keepdims=True)
-        Xc = X - mu
-        N = Xc.shape[0]
-        Cd = (Xc.T @ Xc) / max(1, N - 1)
-
-        ew, Ev = np.linalg.eigh(Cn)
-        eps = 1e-8
-        ew = np.clip(ew, eps, None)
-        Cn_inv_sqrt = Ev @ np.diag(1.0/np.sqrt(ew)) @ Ev.T
-
-        A = Cn_inv_sqrt @ Cd @ Cn_inv_sqrt.T
-        lam, E = np.linalg.eigh(A)
-        idx = np.argsort(lam)[::-1]
-        self.eigen_values = lam[idx]
-        E = E[:, idx]
-
-        P = Cn_inv_sqrt.T @ E  # (bands, bands)
-        Y = Xc @ P
-        self.mnf_components = Y.reshape(height, width, bands)
-        print(f"mnf_component shape:  {self.mnf_components.shape}")
+        signal, noise, lam, P = self._statistics(self.sample_fraction, self.seed)
+        self.mean, self.signal_cov = signal.mean, signal.covariance()
+        self.noise_cov = noise.covariance() if noise is not None else None
+        self.eigen_values = lam
+        self.transform = P  # (bands, bands)
+        self.pixels_used = signal.count
+
+        if self.check_stability and self.sample_fraction < 1:
+            reference_fraction = min(1.0, self.REFERENCE_FACTOR * self.sample_fraction)
+            reference, _, reference_lam, reference_P = self._statistics(reference_fraction, self.seed + 1)
+            num_pixels = height * width
+            self.diagnostics = SamplingDiagnostics(lam, P, reference_lam, reference_P,
+                                                   signal.count / num_pixels, reference.count / num_pixels)
+            logger.info(f"{self.method.upper()} sampling stability: {self.diagnostics.summary()}")
+
+        # Only the kept components, fused and tiled in float32
+        self.mnf_components = forward_transform(self.data, self.mean, P, self.num_components)
+        logger.info(f"mnf_component shape:  {self.mnf_components.shape}")
 
         return self.mnf_components, self.eigen_values
 
-
-        # height, width, bands = self.data.shape
-        # data_2d = self.data.reshape(-1, bands)
-        # logger.info(f"Data reshaped to 2D: {data_2d.shape}")
-
-
-        # self.noise_stats = self.estimate_noise_cov(self.data)
-
-        # signal_cov = np.cov(data_2d, rowvar=False)
-
-        # logger.info("Signal covariance matrix computed.")
-
-        # C = self.noise_stats.sqrt_inv_cov.dot(signal_cov).dot(self.noise_stats.sqrt_inv_cov)
-        # logger.info("MNF transformation matrix computed.")
-        # eigenvalues, eigenvectors = np.linalg.eig(C)
-        # logger.info("Eigen decomposition completed.")
-        # idx = np.argsort(eigenvalues)[::-1]
-        # self.eigenvalues = eigenvalues[idx]
-        # self.eigenvectors = eigenvectors[:, idx]
-
-        # mnf_components_2d = data_2d.dot(self.noise_stats.sqrt_inv_cov).dot(self.eigenvectors)
-        # self.mnf_components = mnf_components_2d.reshape(height, width, bands)
-
-        # return self.mnf_components, self.eigenvalues
+    def statistics(self):
+        """
+        The `TransformStatistics` of the last run: means, covariances, eigenvalues,
+        forward and inverse transform, and provenance (source layer and file,
+        sampling, creation time).
+        """
+        if self.transform is None:
+            raise ValueError("Run apply_mnf() first.")
+        if self.saved_statistics is not None:
+            return self.saved_statistics
+        height, width, bands = self.data.shape
+        provenance = {
+            'layer_name': self.layer_name,
+            'file_path': self.file_path,
+            'shape': [height, width, bands],
+            'dtype': str(self.data.dtype),
+            'sample_fraction': self.sample_fraction,
+            'sampling_mode': self.sampling_mode,
+            'seed': self.seed,
+            'pixels_used': int(self.pixels_used),
+        }
+        return TransformStatistics(self.method, self.mean, self.transform, self.eigen_values, self.signal_cov,
+                                   noise_cov=self.noise_cov, wavelengths=self.wavelengths, provenance=provenance)
 
     def display_interactive_mnf(self, parent_viewer=None):
         if self.mnf_components is None:
@@ -327,28 +493,17 @@ class MNFProcessor:
             self.mnf_viewer_window.activateWindow()
             return
         print(f"MNF component from display_interactive_mnf function: {self.mnf_components.shape}")
-        self.mnf_viewer_window = MNFViewerWindow(self.mnf_components, self.eigen_values, self.layer_name, parent_viewer )
+        self.mnf_viewer_window = MNFViewerWindow(
+            self.mnf_components, self.eigen_values, self.layer_name, parent_viewer,
+            method=self.method.upper(), diagnostics=self.diagnostics.summary() if self.diagnostics else None,
+            statistics=self.statistics()
+        )
         self.mnf_viewer_window.show()
 
 
     def inverse_mnf(self, selected_components):
+        """Data rebuilt from the selected components only (e.g. the high-SNR ones, to denoise)."""
         if self.mnf_components is None:
             raise ValueError("Run apply_mnf() first.")
-        
-        # This is the forward transform matrix
-        forward_transform = self.noise_stats.sqrt_inv_cov.dot(self.eigenvectors)
-        
-        # The inverse transform is the pseudoinverse of the forward transform
-        inverse_transform = np.linalg.pinv(forward_transform)
-        
-        # Get the 2D MNF data
-        mnf_2d = self.mnf_components.reshape(-1, self.data.shape[2])
-        
-        # Create a copy and zero out the components we don't want to keep
-        denoised_mnf_2d = np.zeros_like(mnf_2d)
-        denoised_mnf_2d[:, selected_components] = mnf_2d[:, selected_components]
-
-        # Apply the inverse transform
-        reconstructed_2d = denoised_mnf_2d.dot(inverse_transform)
-        
-        return reconstructed_2d.reshape(self.data.shape)
\ No newline at end of file
+        # Inverse transform and band means of the statistics; components not selected count as 0
+        return self.statistics().reconstruct(self.mnf_components, selected_components)
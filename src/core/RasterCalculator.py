@@ -1,9 +1,16 @@
 from osgeo import gdal
 import numpy as np
 import numexpr as ne
+import os
 import re
+import time
+import uuid
 import logging
-from typing import Dict, Set
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from src.core.raster_export import GdalFileSource
 
 # --- Configure logging for clear feedback ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -11,6 +18,10 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # --- Use GDAL exceptions for error handling ---
 gdal.UseExceptions()
 
+# --- Pipeline defaults ---
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024  # Bytes held by all in-flight blocks together
+DEFAULT_INPUT_NAME = 'input'  # Name given to a single input passed as a plain path
+
 class RasterCalculator:
     """
     A robust, memory-efficient raster calculator using GDAL for backend processing.
@@ -22,6 +33,20 @@ class RasterCalculator:
     It is implemented as a context manager to ensure that GDAL dataset handles
     are properly managed.
 
+    Inputs are either a single raster path or a mapping of names to raster paths
+    (any GDAL-readable file, including VRTs). Bands of a named input are written
+    '<name>_B<n>', e.g. 'pre_B4'; a bare 'B<n>' refers to the first input. Inputs
+    whose grid differs from the first one are warped onto it through an in-memory
+    VRT, so every expression sees pixel-aligned blocks.
+
+    Processing is pipelined: a pool of reader threads fetches full-width row
+    blocks of all required bands with one dataset-level read each, a pool of
+    compute threads evaluates the expressions, and a single writer thread writes
+    the results in row order. Blocks are sized so that all blocks in flight fit
+    in `memory_budget` bytes, rather than following the (often tiny) GDAL block
+    size of the source. Several output expressions are computed in the same
+    pass, so each input is read exactly once however many outputs there are.
+
     Example Usage:
         ndvi_expression = '(B5 - B4) / (B5 + B4)'
         input_raster = 'path/to/your/landsat_image.tif'
@@ -33,136 +58,317 @@ class RasterCalculator:
             logging.info(f"Successfully created NDVI image at {output_raster}")
         except Exception as e:
             logging.error(f"An error occurred: {e}")
+
+        # Change detection over two acquisitions, two outputs in one pass
+        with RasterCalculator({'pre': 'pre.tif', 'post': 'post.vrt'}) as calc:
+            calc.calculate_and_save(
+                {'dNDVI': '(post_B5 - post_B4) / (post_B5 + post_B4) - (pre_B5 - pre_B4) / (pre_B5 + pre_B4)',
+                 'dNIR': 'post_B5 - pre_B5'},
+                'change.tif'
+            )
     """
 
-    def __init__(self, input_raster_path: str):
+    def __init__(self, input_raster_path: Union[str, Mapping[str, str]],
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 num_workers: Optional[int] = None, num_readers: int = 2):
         """
-        Initializes the RasterCalculator with the path to the input raster.
+        Initializes the RasterCalculator with the input raster(s).
 
         Args:
-            input_raster_path (str): The file path for the source raster image.
+            input_raster_path (Union[str, Mapping[str, str]]): The file path of the
+                source raster, or a mapping of input names to file paths. Names
+                must be valid identifiers.
+            memory_budget (int): Approximate bytes used by all blocks in flight.
+            num_workers (Optional[int]): Compute threads (default: one per core).
+            num_readers (int): Reader threads, each with its own GDAL handles.
         """
         if not input_raster_path:
             raise ValueError("Input raster path cannot be empty.")
-        self.input_raster_path = input_raster_path
+        if isinstance(input_raster_path, str):
+            inputs = {DEFAULT_INPUT_NAME: input_raster_path}
+        else:
+            inputs = dict(input_raster_path)
+        for name, path in inputs.items():
+            if not name.isidentifier():
+                raise ValueError(f"Input name '{name}' is not a valid identifier.")
+            if not path:
+                raise ValueError(f"Input raster path for '{name}' cannot be empty.")
+        self.inputs: Dict[str, str] = inputs
+        self.default_input = next(iter(inputs))
+        self.input_raster_path = inputs[self.default_input]
+        self.memory_budget = int(memory_budget)
+        self.num_workers = max(1, num_workers or os.cpu_count() or 1)
+        self.num_readers = max(1, int(num_readers))
         self.src_dataset = None
+        self.src_datasets: Dict[str, object] = {}
+        self._read_paths: Dict[str, str] = {}
+        self._warped_paths: List[str] = []
 
     def __enter__(self):
-        """Opens the source raster file for reading."""
+        """Opens the source raster files for reading and aligns them to the first one."""
         try:
-            self.src_dataset = gdal.Open(self.input_raster_path, gdal.GA_ReadOnly)
-            logging.info(f"Successfully opened {self.input_raster_path}")
-            return self
+            for name, path in self.inputs.items():
+                self.src_datasets[name] = gdal.Open(path, gdal.GA_ReadOnly)
+                logging.info(f"Successfully opened {path}")
         except RuntimeError as e:
-            logging.error(f"Failed to open raster file with GDAL: {self.input_raster_path}")
+            logging.error(f"Failed to open raster file with GDAL: {path}")
+            self.__exit__(None, None, None)
             raise IOError(f"GDAL Error: {e}")
+        self.src_dataset = self.src_datasets[self.default_input]
+        try:
+            for name, dataset in self.src_datasets.items():
+                self._read_paths[name] = self._aligned_path(name, dataset)
+        except Exception:
+            # Closes the inputs and drops the VRTs warped so far
+            self.__exit__(None, None, None)
+            raise
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Closes the source raster file by dereferencing the dataset."""
-        if self.src_dataset:
-            self.src_dataset = None
-            logging.info(f"Closed {self.input_raster_path}")
+        """Closes the source raster files and drops any warped VRTs."""
+        self.src_dataset = None
+        for path in self.inputs.values():
+            logging.info(f"Closed {path}")
+        self.src_datasets.clear()
+        self._read_paths.clear()
+        for path in self._warped_paths:
+            gdal.Unlink(path)
+        self._warped_paths.clear()
+
+    def _aligned_path(self, name: str, dataset) -> str:
+        """
+        Path to read input `name` from: the file itself when it shares the grid of
+        the first input, otherwise a nearest-neighbour warped VRT onto that grid.
+        """
+        ref = self.src_dataset
+        same_grid = (
+            dataset.RasterXSize == ref.RasterXSize and dataset.RasterYSize == ref.RasterYSize
+            and np.allclose(dataset.GetGeoTransform(), ref.GetGeoTransform())
+            and (dataset.GetProjectionRef() or '') == (ref.GetProjectionRef() or '')
+        )
+        if same_grid:
+            return self.inputs[name]
 
-    @staticmethod
-    def _parse_expression(expression: str) -> Set[int]:
+        gt, xsize, ysize = ref.GetGeoTransform(), ref.RasterXSize, ref.RasterYSize
+        bounds = (gt[0], gt[3] + gt[5] * ysize, gt[0] + gt[1] * xsize, gt[3])
+        path = f"/vsimem/raster_calculator_{uuid.uuid4().hex}.vrt"
+        try:
+            warped = gdal.Warp(path, dataset, format='VRT', outputBounds=bounds, width=xsize, height=ysize,
+                               dstSRS=ref.GetProjectionRef() or None, resampleAlg='near')
+            if warped is None:
+                raise IOError(f"Could not warp input '{name}' onto the grid of '{self.default_input}'.")
+            warped = None  # Closing writes the VRT
+        except Exception:
+            warped = None
+            # Drop the partly written VRT
+            if gdal.VSIStatL(path) is not None:
+                gdal.Unlink(path)
+            raise
+        self._warped_paths.append(path)
+        logging.info(f"Input '{name}' is on a different grid; warping it onto '{self.default_input}'.")
+        return path
+
+    def _parse_references(self, expression: str) -> Dict[str, Tuple[str, int]]:
         """
-        Parses the mathematical expression to identify required band numbers.
-        Band variables should be in the format 'B{number}', e.g., 'B1', 'B4', 'B12'.
+        Maps every band variable of `expression` ('B4', 'pre_B4') to its
+        (input name, band number).
 
         Args:
             expression (str): The mathematical formula string.
 
         Returns:
-            Set[int]: A set of unique band numbers required for the calculation.
+            Dict[str, Tuple[str, int]]: Variable name -> (input name, band number).
         """
-        band_matches = re.findall(r'B(\d+)', expression, re.IGNORECASE)
-        if not band_matches:
-            raise ValueError("Expression does not contain any valid band identifiers (e.g., 'B1', 'B2').")
-        
-        band_numbers = {int(b) for b in band_matches}
-        logging.info(f"Parsed expression. Required bands: {sorted(list(band_numbers))}")
-        return band_numbers
-
-    def calculate_and_save(self, expression: str, output_raster_path: str):
+        names = '|'.join(re.escape(name) for name in self.inputs)
+        pattern = re.compile(rf'\b(?:({names})_)?B(\d+)\b')
+        references = {}
+        for match in pattern.finditer(expression):
+            references[match.group(0)] = (match.group(1) or self.default_input, int(match.group(2)))
+        if not references:
+            raise ValueError(f"Expression '{expression}' does not contain any valid band identifiers "
+                             f"(e.g., 'B1' or '<input>_B1').")
+        return references
+
+    def _block_rows(self, xsize: int, ysize: int, block_ysize: int, bytes_per_pixel: int,
+                    max_in_flight: int) -> int:
         """
-        Calculates a new raster based on the provided expression and saves it to a file.
-        This method processes the raster in chunks to handle large files efficiently.
+        Rows per full-width block so that `max_in_flight` blocks fit in the memory
+        budget, given the bytes each pixel needs across raw inputs, their float32
+        copies and the outputs. Rounded down to whole GDAL block rows when possible,
+        so reads stay aligned.
+        """
+        rows = max(1, self.memory_budget // max(xsize * bytes_per_pixel * max_in_flight, 1))
+        if block_ysize and rows > block_ysize:
+            rows -= rows % block_ysize
+        return min(rows, ysize)
+
+    def _create_outputs(self, output_paths: Sequence[str], bands_per_file: int,
+                        band_names: Sequence[str], nodata_val: float) -> List[Tuple[object, List[object]]]:
+        """Creates the Float32 GeoTIFF outputs; returns (dataset, [bands]) per file."""
+        driver = gdal.GetDriverByName('GTiff')
+        outputs = []
+        for file_index, path in enumerate(output_paths):
+            dst_dataset = driver.Create(
+                path,
+                self.src_dataset.RasterXSize,
+                self.src_dataset.RasterYSize,
+                bands_per_file,
+                gdal.GDT_Float32, # Calculations often result in floats
+                options=['COMPRESS=LZW'] # A good default compression
+            )
+            dst_dataset.SetGeoTransform(self.src_dataset.GetGeoTransform())
+            dst_dataset.SetProjection(self.src_dataset.GetProjectionRef())
+            dst_bands = []
+            for b in range(bands_per_file):
+                dst_band = dst_dataset.GetRasterBand(b + 1)
+                dst_band.SetNoDataValue(nodata_val)
+                dst_band.SetDescription(band_names[file_index * bands_per_file + b])
+                dst_bands.append(dst_band)
+            outputs.append((dst_dataset, dst_bands))
+        return outputs
+
+    def calculate_and_save(self, expression: Union[str, Sequence[str], Mapping[str, str]],
+                           output_raster_path: Union[str, Sequence[str]]):
+        """
+        Calculates new rasters based on the provided expression(s) and saves them.
+        This method processes the inputs in chunks to handle large files efficiently,
+        and computes every expression in one pass over them.
 
         Args:
-            expression (str): The mathematical formula to apply. Bands must be
-                              referenced as 'B1', 'B2', etc.
-            output_raster_path (str): The file path to save the resulting raster.
+            expression: The mathematical formula to apply, a list of formulas, or a
+                mapping of output band names to formulas. Bands are referenced as
+                'B1', 'B2', etc. (first input) or '<input>_B1' (named input).
+            output_raster_path: The file path to save the result to, with one band
+                per expression, or a list with one single-band file per expression.
         """
         if self.src_dataset is None:
             raise RuntimeError("RasterCalculator must be used within a 'with' statement.")
 
-        band_numbers = self._parse_expression(expression)
-
-        # --- Validate that all required bands exist in the source dataset ---
-        max_required_band = max(band_numbers)
-        if max_required_band > self.src_dataset.RasterCount:
-            raise ValueError(
-                f"Expression requires band {max_required_band}, but the input "
-                f"raster only has {self.src_dataset.RasterCount} bands."
-            )
-
-        # --- Prepare the output raster file ---
-        driver = gdal.GetDriverByName('GTiff')
-        dst_dataset = driver.Create(
-            output_raster_path,
-            self.src_dataset.RasterXSize,
-            self.src_dataset.RasterYSize,
-            1,
-            gdal.GDT_Float32, # Calculations often result in floats
-            options=['COMPRESS=LZW'] # A good default compression
-        )
-        dst_dataset.SetGeoTransform(self.src_dataset.GetGeoTransform())
-        dst_dataset.SetProjection(self.src_dataset.GetProjectionRef())
-        
-        dst_band = dst_dataset.GetRasterBand(1)
+        if isinstance(expression, str):
+            expressions = OrderedDict([('Result', expression)])
+        elif isinstance(expression, Mapping):
+            expressions = OrderedDict(expression)
+        else:
+            expressions = OrderedDict((f'Result {i + 1}', e) for i, e in enumerate(expression))
+        if not expressions:
+            raise ValueError("At least one expression is required.")
+        if isinstance(output_raster_path, str):
+            output_paths, bands_per_file = [output_raster_path], len(expressions)
+        else:
+            output_paths, bands_per_file = list(output_raster_path), 1
+            if len(output_paths) != len(expressions):
+                raise ValueError(f"Got {len(expressions)} expressions but {len(output_paths)} output paths.")
+
+        # --- Resolve band variables and validate that all bands exist ---
+        references: Dict[str, Tuple[str, int]] = {}
+        for text in expressions.values():
+            references.update(self._parse_references(text))
+        required: Dict[str, List[int]] = {}
+        for input_name, band in references.values():
+            count = self.src_datasets[input_name].RasterCount
+            if band < 1 or band > count:
+                raise ValueError(
+                    f"Expression requires band {band} of '{input_name}', but that input "
+                    f"raster only has {count} bands."
+                )
+            required.setdefault(input_name, [])
+            if band not in required[input_name]:
+                required[input_name].append(band)
+        for bands in required.values():
+            bands.sort()
+        logging.info(f"Parsed {len(expressions)} expression(s). Required bands: "
+                     + ', '.join(f"{name} {bands}" for name, bands in required.items()))
+
+        # --- Prepare the output raster files ---
         nodata_val = -9999.0 # A common nodata value for float rasters
-        dst_band.SetNoDataValue(nodata_val)
+        outputs = self._create_outputs(output_paths, bands_per_file, list(expressions), nodata_val)
+        dst_bands = [band for _, bands in outputs for band in bands]
 
-        # --- Process the raster in blocks ---
-        # Get block size from the first band (it's usually the same for all)
-        src_band_one = self.src_dataset.GetRasterBand(1)
-        block_xsize, block_ysize = src_band_one.GetBlockSize()
+        # --- Process the rasters in pipelined row blocks ---
         xsize = self.src_dataset.RasterXSize
         ysize = self.src_dataset.RasterYSize
-
-        logging.info(f"Starting calculation with block size {block_xsize}x{block_ysize}.")
-
-        for y in range(0, ysize, block_ysize):
-            # Determine the vertical block size (may be smaller at the edge)
-            win_ysize = min(block_ysize, ysize - y)
-            for x in range(0, xsize, block_xsize):
-                logging.info(f"Processing block at offset ({x}, {y})...")
-                # Determine the horizontal block size
-                win_xsize = min(block_xsize, xsize - x)
-
-                # Read data for the current block from all required bands
-                bands_data: Dict[str, np.ndarray] = {}
-                for b_num in band_numbers:
-                    src_band = self.src_dataset.GetRasterBand(b_num)
-                    band_array = src_band.ReadAsArray(x, y, win_xsize, win_ysize)
-                    bands_data[f'B{b_num}'] = band_array.astype(np.float32)
-                
-                # Perform the calculation safely
+        sources = {
+            name: GdalFileSource(self._read_paths[name], bands=[b - 1 for b in bands])
+            for name, bands in required.items()
+        }
+        # Position of each variable inside its input's block
+        slots = {var: (name, required[name].index(band)) for var, (name, band) in references.items()}
+        variables = {text: list(self._parse_references(text)) for text in expressions.values()}
+        block_ysize = self.src_dataset.GetRasterBand(1).GetBlockSize()[1]
+        bytes_per_pixel = (sum(s.num_bands * (s.dtype.itemsize + 4) for s in sources.values())
+                           + 4 * len(expressions))
+        max_in_flight = self.num_readers + self.num_workers + 2
+        rows = self._block_rows(xsize, ysize, block_ysize, bytes_per_pixel, max_in_flight)
+        blocks = [(y, min(rows, ysize - y)) for y in range(0, ysize, rows)]
+
+        logging.info(f"Starting calculation: {len(blocks)} blocks of {xsize}x{rows}, "
+                     f"{len(sources)} input(s), {len(expressions)} output(s), "
+                     f"{self.num_readers} readers, {self.num_workers} compute threads.")
+        start = time.time()
+
+        def compute(read_futures: Dict[str, object], y: int) -> Tuple[int, List[np.ndarray]]:
+            # (rows, cols, bands) views of (bands, rows, cols) reads: each band slice is contiguous
+            data = {name: future.result() for name, future in read_futures.items()}
+            bands_data: Dict[str, np.ndarray] = {
+                var: data[name][:, :, i].astype(np.float32, copy=False) for var, (name, i) in slots.items()
+            }
+            shape = next(iter(bands_data.values())).shape
+            results = []
+            for text in expressions.values():
+                result = np.empty(shape, dtype=np.float32)
+                local_dict = {var: bands_data[var] for var in variables[text]}
                 with np.errstate(divide='ignore', invalid='ignore'):
-                    result = ne.evaluate(expression, local_dict=bands_data)
-
-                # Set the output data type and fill NaNs
-                result = result.astype(np.float32)
+                    ne.evaluate(text, local_dict=local_dict, out=result, casting='unsafe')
                 np.nan_to_num(result, nan=nodata_val, copy=False)
-                
-                # Write the resulting block to the destination raster
-                dst_band.WriteArray(result, x, y)
-        
-        # Flush the cache to ensure all data is written to the file
-        dst_band.FlushCache()
-        dst_dataset = None # Dereference to close the file
-        
-        logging.info(f"Calculation complete. Result saved to {output_raster_path}")
+                results.append(result)
+            logging.debug(f"Computed block at row {y}")
+            return y, results
+
+        def write(y: int, results: List[np.ndarray]):
+            for dst_band, result in zip(dst_bands, results):
+                dst_band.WriteArray(result, 0, y)
+
+        pending: deque = deque()
+        writes: deque = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=self.num_readers) as readers, \
+                    ThreadPoolExecutor(max_workers=self.num_workers) as computers, \
+                    ThreadPoolExecutor(max_workers=1) as writer:
+
+                def drain_one():
+                    # The writer runs tasks in submission order, so blocks land in row order
+                    writes.append(writer.submit(write, *pending.popleft().result()))
+                    while len(writes) > 2:
+                        writes.popleft().result()
+
+                for y, win_ysize in blocks:
+                    while len(pending) >= max_in_flight:
+                        drain_one()
+                    read_futures = {name: readers.submit(source.read, 0, y, xsize, win_ysize)
+                                    for name, source in sources.items()}
+                    pending.append(computers.submit(compute, read_futures, y))
+                while pending:
+                    drain_one()
+                while writes:
+                    writes.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            for source in sources.values():
+                source.close()
+
+        elapsed = time.time() - start
+        megabytes = xsize * ysize * sum(s.num_bands * s.dtype.itemsize for s in sources.values()) / 1e6
+        logging.info(f"Processed {megabytes:.0f} MB of input in {elapsed:.2f}s "
+                     f"({megabytes / max(elapsed, 1e-9):.0f} MB/s).")
+
+        # Flush the cache to ensure all data is written to the files
+        for dst_dataset, bands in outputs:
+            for dst_band in bands:
+                dst_band.FlushCache()
+        outputs = dst_bands = None # Dereference to close the files
+
+        logging.info(f"Calculation complete. Result saved to {', '.join(output_paths)}")
 
 
 # # --- Example of how to integrate and use the class ---
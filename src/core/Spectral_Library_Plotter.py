@@ -1,23 +1,270 @@
 #src/core/Spectral_Library_Plotter.py
 import os
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QFileDialog, QMainWindow, QVBoxLayout, QWidget, QLabel
 import numpy as np
-from osgeo import gdal
-import h5py
-import netCDF4
-from PySide6.QtWidgets import QFileDialog, QMainWindow, QVBoxLayout, QWidget
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
 import logging
-from io import StringIO
+
+from src.core.spectral_library import FILE_FILTER, SpectralLibrary, load_spectral_library
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Libraries up to this size get a legend; larger ones are identified by hovering
+MAX_LEGEND_ENTRIES = 20
+# Larger libraries are drawn as a line-density image instead of individual lines
+MAX_LINE_SPECTRA = 250
+# Hover picks the nearest spectrum within this many screen pixels
+HOVER_TOLERANCE_PX = 6
+
+
+def decimate_spectra(x: np.ndarray, spectra: np.ndarray, x_min: float, x_max: float, columns: int):
+    """
+    Reduces spectra to what can be seen on `columns` screen columns.
+
+    Only samples inside [x_min, x_max] (plus one neighbour on each side) are kept.
+    If there are more than two per column, every spectrum is replaced by its
+    min/max envelope per column, which keeps narrow features visible.
+
+    Returns:
+        (N, P, 2) array of line vertices for a LineCollection.
+    """
+    lo = max(int(np.searchsorted(x, x_min, side='left')) - 1, 0)
+    hi = min(int(np.searchsorted(x, x_max, side='right')) + 1, x.size)
+    xs = x[lo:hi]
+    ys = np.asarray(spectra[:, lo:hi], dtype=np.float32)
+    if xs.size <= 2 * columns or columns < 1:
+        return np.stack(np.broadcast_arrays(xs[None, :], ys), axis=-1)
+
+    # Column boundaries in sample indices; each column becomes a (min, max) pair
+    edges = np.unique(np.searchsorted(xs, np.linspace(xs[0], xs[-1], columns + 1)[:-1]))
+    y_min = np.minimum.reduceat(ys, edges, axis=1)
+    y_max = np.maximum.reduceat(ys, edges, axis=1)
+    centers = (xs[edges] + np.append(xs[edges[1:] - 1], xs[-1])) / 2
+    y = np.empty((ys.shape[0], 2 * edges.size), dtype=np.float32)
+    y[:, 0::2] = y_min
+    y[:, 1::2] = y_max
+    return np.stack(np.broadcast_arrays(np.repeat(centers, 2)[None, :], y), axis=-1)
+
+
+def rasterize_spectra(x: np.ndarray, spectra: np.ndarray, x_range, y_range, width: int, height: int):
+    """
+    Line-density image of spectra: how many spectra cross each of the width x height
+    pixels of the view given by `x_range` and `y_range`.
+
+    Each spectrum is reduced to a min/max pair per pixel column, extended to the
+    next column so steep segments stay connected, and the covered row spans are
+    accumulated with a difference image and a cumulative sum.
+
+    Returns:
+        (height, width) int32 counts, row 0 at y_range[0].
+    """
+    (x_min, x_max), (y_min, y_max) = x_range, y_range
+    counts = np.zeros((height, width), dtype=np.int32)
+    lo = max(int(np.searchsorted(x, x_min, side='left')) - 1, 0)
+    hi = min(int(np.searchsorted(x, x_max, side='right')) + 1, x.size)
+    xs = x[lo:hi]
+    if xs.size == 0 or x_max <= x_min or y_max <= y_min:
+        return counts
+    ys = np.asarray(spectra[:, lo:hi], dtype=np.float32)
+
+    if xs.size >= width:
+        # Several samples per column: min/max envelope of the samples in each column
+        col = np.clip(((xs - x_min) / (x_max - x_min) * width).astype(np.int64), -1, width)
+        edges = np.flatnonzero(np.diff(col, prepend=col[0] - 1))
+        columns = col[edges]
+        col_min = np.minimum.reduceat(ys, edges, axis=1)
+        col_max = np.maximum.reduceat(ys, edges, axis=1)
+    else:
+        # Fewer samples than columns: interpolate at the column centres
+        columns = np.arange(width)
+        centres = x_min + (columns + 0.5) * (x_max - x_min) / width
+        right = np.clip(np.searchsorted(xs, centres), 1, xs.size - 1)
+        weight = ((centres - xs[right - 1]) / (xs[right] - xs[right - 1])).astype(np.float32)
+        inside = (centres >= xs[0]) & (centres <= xs[-1])
+        columns, right, weight = columns[inside], right[inside], weight[inside]
+        col_min = ys[:, right - 1] * (1 - weight) + ys[:, right] * weight
+        col_max = col_min
+
+    # Connect each column to the next one
+    col_min = np.minimum(col_min, np.append(col_min[:, 1:], col_min[:, -1:], axis=1))
+    col_max = np.maximum(col_max, np.append(col_max[:, 1:], col_max[:, -1:], axis=1))
+
+    scale = height / (y_max - y_min)
+    with np.errstate(invalid='ignore'):
+        row_lo = np.floor((col_min - y_min) * scale)
+        row_hi = np.floor((col_max - y_min) * scale)
+    keep = (np.isfinite(row_lo) & np.isfinite(row_hi) & (row_hi >= 0) & (row_lo < height)
+            & (columns >= 0)[None, :] & (columns < width)[None, :])
+    cols = np.broadcast_to(columns, keep.shape)[keep]
+    row_lo = np.clip(row_lo[keep], 0, height - 1).astype(np.int64)
+    row_hi = np.clip(row_hi[keep], 0, height - 1).astype(np.int64) + 1
+
+    # +1 where a span starts and -1 past its end; the cumulative sum over rows gives the counts
+    size = (height + 1) * width
+    diff = (np.bincount(row_lo * width + cols, minlength=size)
+            - np.bincount(row_hi * width + cols, minlength=size))
+    counts[:] = np.cumsum(diff.reshape(height + 1, width), axis=0)[:height]
+    return counts
+
+
+class SpectralLibraryPlotWindow(QMainWindow):
+    """
+    Plots a whole spectral library as a single LineCollection, or as a line-density
+    image when it has more than MAX_LINE_SPECTRA spectra.
+
+    Either is rebuilt for the visible range and the canvas size whenever the view
+    changes. Spectra are identified by hovering: the nearest spectrum under the
+    cursor is found through a per-band sorted index (built lazily) instead of a
+    legend entry for every spectrum.
+    """
+
+    def __init__(self, library: SpectralLibrary, parent=None):
+        super().__init__(parent)
+        self.library = library
+        self.setWindowTitle(f"Spectral Library: {library.display_name}")
+        self.setMinimumSize(800, 600)
+
+        # Plot against increasing wavelength
+        wavelengths = np.asarray(library.wavelengths, dtype=np.float64)
+        order = np.argsort(wavelengths, kind='stable')
+        if np.all(order == np.arange(order.size)):
+            self.x, self.spectra = wavelengths, library.spectra
+        else:
+            self.x, self.spectra = wavelengths[order], np.asarray(library.spectra)[:, order]
+        self._band_index = {}  # band index -> (spectrum indices, values) sorted by value at that band
+
+        self.figure = Figure()
+        self.canvas = FigureCanvas(self.figure)
+        self.ax = self.figure.add_subplot(111)
+        self._build_plot()
+
+        self.status_label = QLabel(f"{library.num_spectra} spectra, {library.num_bands} bands. "
+                                   "Hover over a spectrum to identify it.")
+        central_widget = QWidget()
+        self.setCentralWidget(central_widget)
+        layout = QVBoxLayout(central_widget)
+        layout.addWidget(NavigationToolbar(self.canvas, self))
+        layout.addWidget(self.canvas)
+        layout.addWidget(self.status_label)
+
+        self.ax.callbacks.connect('xlim_changed', lambda ax: self._update_view())
+        if self.dense:
+            self.ax.callbacks.connect('ylim_changed', lambda ax: self._update_view())
+        self.canvas.mpl_connect('resize_event', lambda event: self._update_view())
+        self.canvas.mpl_connect('motion_notify_event', self._on_hover)
+
+    def _build_plot(self):
+        n = self.library.num_spectra
+        self.dense = n > MAX_LINE_SPECTRA
+        colors = plt.get_cmap('tab10')(np.arange(n) % 10)
+        if self.dense:
+            cmap = plt.get_cmap('viridis').copy()
+            cmap.set_bad(alpha=0.0)
+            self.image = self.ax.imshow(np.full((1, 1), np.nan), origin='lower', aspect='auto',
+                                        interpolation='nearest', cmap=cmap, zorder=2)
+        else:
+            if n > MAX_LEGEND_ENTRIES:
+                # Many lines: thin and translucent so overlaps read as density
+                colors[:, 3] = max(0.08, min(1.0, 30.0 / n))
+            self.collection = LineCollection([], colors=colors, linewidths=1.0 if n > MAX_LEGEND_ENTRIES else 1.5)
+            self.ax.add_collection(self.collection)
+
+        self.highlight, = self.ax.plot([], [], color='black', linewidth=2.0, zorder=5)
+        self.annotation = self.ax.annotate("", xy=(0, 0), xytext=(10, 10), textcoords='offset points',
+                                           bbox=dict(boxstyle='round', facecolor='white', alpha=0.85), zorder=6)
+        self.annotation.set_visible(False)
+
+        y_min, y_max = np.nanmin(self.spectra), np.nanmax(self.spectra)
+        margin = 0.05 * (y_max - y_min if y_max > y_min else 1.0)
+        self.ax.set_xlim(self.x[0], self.x[-1] if self.x[-1] > self.x[0] else self.x[0] + 1)
+        self.ax.set_ylim(y_min - margin, y_max + margin)
+        self.ax.set_autoscale_on(False)
+        self._update_view()
+
+        units = self.library.wavelength_units if self.library.wavelength_units != "Unknown" else "micrometers"
+        self.ax.set_xlabel(f"Wavelength ({units})")
+        self.ax.set_ylabel("Reflectance")
+        self.ax.set_title("Spectral Library Plot")
+        self.ax.grid(True, linestyle='--', alpha=0.6)
+        if n <= MAX_LEGEND_ENTRIES:
+            handles = [Line2D([], [], color=colors[i], linewidth=1.5) for i in range(n)]
+            self.ax.legend(handles, self.library.names, loc="best", fontsize="small")
+        self.figure.tight_layout()
+
+    def _update_view(self):
+        x_range, y_range = self.ax.get_xlim(), self.ax.get_ylim()
+        width, height = max(1, int(self.ax.bbox.width)), max(1, int(self.ax.bbox.height))
+        if self.dense:
+            counts = rasterize_spectra(self.x, self.spectra, x_range, y_range, width, height)
+            # Log scale so sparse outliers stay visible next to the dense core
+            self.image.set_data(np.where(counts > 0, np.log1p(counts), np.nan))
+            self.image.set_extent((*x_range, *y_range))
+            self.image.autoscale()
+        else:
+            self.collection.set_segments(decimate_spectra(self.x, self.spectra, *x_range, width))
+        self.canvas.draw_idle()
+
+    def _sorted_band(self, band: int):
+        entry = self._band_index.get(band)
+        if entry is None:
+            column = np.asarray(self.spectra[:, band], dtype=np.float64)
+            column = np.where(np.isnan(column), np.inf, column)
+            order = np.argsort(column, kind='stable')
+            entry = (order, column[order])
+            self._band_index[band] = entry
+        return entry
+
+    def _nearest_spectrum(self, x: float, y: float):
+        """Index of the spectrum closest to (x, y) at the nearest band, or None."""
+        band = int(np.clip(np.searchsorted(self.x, x), 1, self.x.size - 1)) if self.x.size > 1 else 0
+        if band > 0 and abs(self.x[band - 1] - x) < abs(self.x[band] - x):
+            band -= 1
+        order, values = self._sorted_band(band)
+        pos = int(np.searchsorted(values, y))
+        candidates = [i for i in (pos - 1, pos) if 0 <= i < order.size and np.isfinite(values[i])]
+        if not candidates:
+            return None
+        nearest = min(candidates, key=lambda i: abs(values[i] - y))
+
+        # Accept only if within a few screen pixels of the cursor
+        _, y_px = self.ax.transData.transform((self.x[band], values[nearest]))
+        _, cursor_px = self.ax.transData.transform((x, y))
+        return int(order[nearest]) if abs(y_px - cursor_px) <= HOVER_TOLERANCE_PX else None
+
+    def _on_hover(self, event):
+        if event.inaxes is not self.ax or event.xdata is None:
+            return
+        index = self._nearest_spectrum(event.xdata, event.ydata)
+        if index is None:
+            if self.annotation.get_visible():
+                self.annotation.set_visible(False)
+                self.highlight.set_data([], [])
+                self.canvas.draw_idle()
+            return
+
+        name = self.library.names[index]
+        self.highlight.set_data(self.x, self.spectra[index])
+        self.annotation.xy = (event.xdata, event.ydata)
+        self.annotation.set_text(name)
+        self.annotation.set_visible(True)
+        self.status_label.setText(f"Spectrum {index + 1}: {name}")
+        self.canvas.draw_idle()
+
+
 class SpectralLibraryPlotter:
     """A class to handle loading and plotting of spectral libraries in various formats."""
 
+    # Windows opened without a parent are kept alive here until they are closed
+    _open_windows = []
+
     @staticmethod
     def plot_spectral_library(parent=None, file_path: str = None) -> None:
         """
@@ -39,212 +286,25 @@ class SpectralLibraryPlotter:
                     parent,
                     "Open Spectral Library",
                     "",
-                    "All Supported Files (*.sli *.txt *.csv *.h5 *.hdf *.nc);;"
-                    "ENVI Spectral Library (*.sli);;"
-                    "Text/CSV Files (*.txt *.csv);;"
-                    "HDF5 Files (*.h5 *.hdf);;"
-                    "NetCDF Files (*.nc);;"
-                    "All Files (*)"
+                    FILE_FILTER
                 )
 
             if not file_path:
                 logger.info("No file selected")
                 return
 
-            # Initialize variables
-            wavelengths = None
-            spectra = None
-            spectra_names = []
-            metadata = {}
-
-            # Determine file format
-            file_ext = os.path.splitext(file_path)[1].lower()
-
-            # Load spectral library based on file format
-            if file_ext == '.sli':
-                # Handle ENVI Spectral Library
-                folder = os.path.dirname(file_path)
-                base_name = os.path.splitext(os.path.basename(file_path))[0]
-                possible_data = [
-                    f for f in os.listdir(folder)
-                    if os.path.splitext(f)[0] == base_name
-                    and f.lower() != os.path.basename(file_path).lower()
-                ]
-                if not possible_data:
-                    raise ValueError("No corresponding data file found for .sli")
-                data_file = os.path.join(folder, possible_data[0])
-
-                # Open with GDAL
-                dataset = gdal.Open(data_file, gdal.GA_ReadOnly)
-                if dataset is None:
-                    raise ValueError(f"GDAL could not open file: {data_file}")
-
-                # Read spectral data (rows = spectra, cols = wavelengths)
-                spectra = dataset.ReadAsArray().astype(np.float32)
-                if len(spectra.shape) != 2:
-                    raise ValueError("Spectral library data is not 2D")
-
-                # Get metadata
-                metadata = dataset.GetMetadata()
-                print(f"keys of metadata {list(metadata.keys)}")
-                if 'wavelength' in metadata:
-                    try:
-                        wavelengths = metadata['wavelength'].replace('{', '').replace('}', '').split(',')
-                        wavelengths = [float(w.strip()) for w in wavelengths if w.strip()]
-                    except Exception as e:
-                        logger.warning(f"Failed to parse wavelength metadata: {str(e)}")
-                if 'spectra names' in metadata:
-                    spectra_names = metadata['spectra names'].replace('{', '').replace('}', '').split(',')
-                    spectra_names = [name.strip() for name in spectra_names]
-
-                # Default wavelengths if not provided
-                if wavelengths is None:
-                    wavelengths = np.arange(spectra.shape[1])
-                    logger.warning("No wavelength metadata found, using index as wavelength")
-
-                # Default spectra names if not provided
-                if not spectra_names:
-                    spectra_names = [f"Spectrum {i + 1}" for i in range(spectra.shape[0])]
-
-            elif file_ext in ('.txt', '.csv'):
-                # --- MODIFIED BLOCK FOR TXT/CSV ---
-                # This block now correctly handles text files with headers.
-                try:
-                    with open(file_path, 'r') as f:
-                        lines = f.readlines()
-
-                    header_lines = []
-                    data_lines = []
-                    # Use filename as a default name in case 'Name:' field is not found
-                    temp_name = os.path.splitext(os.path.basename(file_path))[0]
-
-                    for line in lines:
-                        stripped_line = line.strip()
-                        if not stripped_line:
-                            continue  # Skip empty lines
-
-                        # Attempt to identify data lines by checking if the first element is numeric
-                        try:
-                            float(stripped_line.split()[0])
-                            data_lines.append(line)
-                        except (ValueError, IndexError):
-                            # Treat as a header line and parse for the spectrum name
-                            header_lines.append(stripped_line)
-                            if stripped_line.lower().startswith('name:'):
-                                temp_name = stripped_line.split(':', 1)[1].strip()
-
-                    if not data_lines:
-                        raise ValueError("No numeric data found in the file.")
-
-                    # Load the numeric data
-                    data = np.loadtxt(StringIO(''.join(data_lines)))
-                    if data.ndim != 2 or data.shape[1] < 2:
-                        raise ValueError("Data must have at least two columns (wavelengths, reflectance).")
-                    
-                    # Assign data to the correct local variables for plotting
-                    wavelengths = data[:, 0]
-                    # Reshape the single spectrum into a 2D array (1 row, N columns)
-                    # as the plotting loop expects an iterable of spectra.
-                    spectra = data[:, 1].reshape(1, -1)
-                    spectra_names = [temp_name]
-
-                except Exception as e:
-                    raise ValueError(f"Failed to read text/CSV file: {str(e)}")
-                # --- END OF MODIFIED BLOCK ---
-
-            elif file_ext in ('.h5', '.hdf'):
-                # Handle HDF5 files
-                with h5py.File(file_path, 'r') as f:
-                    dataset_names = [key for key in f.keys() if isinstance(f[key], h5py.Dataset)]
-                    if not dataset_names:
-                        raise ValueError("No valid dataset found in HDF5 file")
-
-                    spectra_data = f[dataset_names[0]][:]
-                    if len(spectra_data.shape) != 2:
-                        raise ValueError("HDF5 dataset is not a 2D spectral library")
-
-                    spectra = spectra_data.astype(np.float32)
-                    metadata = dict(f.attrs)
-
-                    if 'wavelengths' in f:
-                        wavelengths = np.array(f['wavelengths'][:], dtype=np.float32)
-                    elif 'wavelengths' in metadata:
-                        wavelengths = np.array(metadata['wavelengths'], dtype=np.float32)
-                    else:
-                        wavelengths = np.arange(spectra.shape[1])
-                        logger.warning("No wavelengths found, using index as wavelength")
-
-                    if 'spectra_names' in metadata:
-                        spectra_names = list(metadata['spectra_names'])
-                    else:
-                        spectra_names = [f"Spectrum {i + 1}" for i in range(spectra.shape[0])]
-
-            elif file_ext == '.nc':
-                # Handle NetCDF files
-                with netCDF4.Dataset(file_path, 'r') as f:
-                    data_vars = [var for var in f.variables if len(f.variables[var].shape) == 2]
-                    if not data_vars:
-                        raise ValueError("No valid 2D variable found in NetCDF file")
-
-                    spectra = f.variables[data_vars[0]][:].astype(np.float32)
-                    metadata = dict(f.ncattrs())
-
-                    if 'wavelengths' in f.variables:
-                        wavelengths = f.variables['wavelengths'][:].astype(np.float32)
-                    elif 'wavelengths' in metadata:
-                        wavelengths = np.array(metadata['wavelengths'], dtype=np.float32)
-                    else:
-                        wavelengths = np.arange(spectra.shape[1])
-                        logger.warning("No wavelengths found, using index as wavelength")
-
-                    if 'spectra_names' in metadata:
-                        spectra_names = list(metadata['spectra_names'])
-                    else:
-                        spectra_names = [f"Spectrum {i + 1}" for i in range(spectra.shape[0])]
-
-            else:
-                raise ValueError(f"Unsupported file format: {file_ext}")
-
-            # Validate data
-            if spectra is None or len(spectra.shape) != 2:
-                raise ValueError("Loaded spectral data is not a valid 2D array")
-            if wavelengths is None or len(wavelengths) != spectra.shape[1]:
-                raise ValueError("Wavelengths do not match spectral data dimensions")
-            if len(spectra_names) < spectra.shape[0]:
-                spectra_names.extend([f"Spectrum {i + 1}" for i in range(len(spectra_names), spectra.shape[0])])
-
-            # Create a new window for plotting
-            plot_window = QMainWindow(parent)
-            plot_window.setWindowTitle(f"Spectral Library: {os.path.basename(file_path)}")
-            plot_window.setMinimumSize(800, 600)
-
-            # Create Matplotlib figure and canvas
-            figure = Figure()
-            canvas = FigureCanvas(figure)
-            ax = figure.add_subplot(111)
-
-            # Plot each spectrum
-            for i, spectrum in enumerate(spectra):
-                ax.plot(wavelengths, spectrum, label=spectra_names[i], linewidth=1.5)
-
-            # Customize plot
-            ax.set_xlabel("Wavelength (micrometers)")
-            ax.set_ylabel("Reflectance")
-            ax.set_title("Spectral Library Plot")
-            ax.grid(True, linestyle='--', alpha=0.6)
-            ax.legend(loc="best", fontsize="small")
-            figure.tight_layout()
-
-            # Set up the window layout
-            central_widget = QWidget()
-            plot_window.setCentralWidget(central_widget)
-            layout = QVBoxLayout(central_widget)
-            layout.addWidget(canvas)
-
-            # Show the window
+            # Parsed once into a memory-mapped binary store; later opens skip parsing
+            library = load_spectral_library(file_path)
+
+            plot_window = SpectralLibraryPlotWindow(library, parent)
+            # Closing a window frees it and its library
+            plot_window.setAttribute(Qt.WA_DeleteOnClose)
+            if parent is None:
+                SpectralLibraryPlotter._open_windows.append(plot_window)
+                plot_window.destroyed.connect(lambda *_: SpectralLibraryPlotter._open_windows.remove(plot_window))
             plot_window.show()
 
             logger.info(f"Successfully plotted spectral library: {file_path}")
 
         except Exception as e:
-            logger.error(f"Error plotting spectral library {file_path}: {str(e)}")
\ No newline at end of file
+            logger.error(f"Error plotting spectral library {file_path}: {str(e)}")
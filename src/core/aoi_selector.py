@@ -1,9 +1,10 @@
 # src/core/aoi_selector.py
 from PySide6.QtCore import QObject, Signal
-from matplotlib.widgets import RectangleSelector
+from matplotlib.widgets import PolygonSelector, RectangleSelector
 
 class AOISelector(QObject):
     finished = Signal(tuple)  # (x1, y1, x2, y2) in pixel coords
+    cancelled = Signal()
 
     def __init__(self, ax, canvas, parent=None):
         super().__init__(parent)
@@ -35,6 +36,7 @@ class AOISelector(QObject):
         x2, y2 = erelease.xdata, erelease.ydata
         if x1 is None or y1 is None or x2 is None or y2 is None:
             self.stop()
+            self.cancelled.emit()
             return
         xi1, xi2 = sorted([int(round(x1)), int(round(x2))])
         yi1, yi2 = sorted([int(round(y1)), int(round(y2))])
@@ -48,3 +50,54 @@ class AOISelector(QObject):
             self.selector = None
         self.canvas.draw_idle()
         self._active = False
+
+
+class PolygonAOISelector(QObject):
+    finished = Signal(list)  # [(x, y), ...] vertices in pixel coords
+    cancelled = Signal()  # Escape pressed, or fewer than 3 vertices
+
+    def __init__(self, ax, canvas, parent=None):
+        super().__init__(parent)
+        self.ax = ax
+        self.canvas = canvas
+        self.selector = None
+        self._key_cid = None
+        self._active = False
+
+    def start(self):
+        if self._active:
+            return
+        self._active = True
+        self._key_cid = self.canvas.mpl_connect('key_press_event', self._on_key)
+        # Click to add vertices; clicking the first vertex closes the polygon
+        self.selector = PolygonSelector(
+            self.ax,
+            onselect=self._on_select,
+            useblit=True,
+            props=dict(color='yellow', linewidth=1.5)
+        )
+        self.canvas.draw_idle()
+
+    def _on_select(self, vertices):
+        verts = [(float(x), float(y)) for x, y in vertices]
+        self.stop()
+        if len(verts) >= 3:
+            self.finished.emit(verts)
+        else:
+            self.cancelled.emit()
+
+    def _on_key(self, event):
+        if event.key == 'escape' and self._active:
+            self.stop()
+            self.cancelled.emit()
+
+    def stop(self):
+        if self._key_cid is not None:
+            self.canvas.mpl_disconnect(self._key_cid)
+            self._key_cid = None
+        if self.selector:
+            self.selector.set_visible(False)
+            self.selector.disconnect_events()
+            self.selector = None
+        self.canvas.draw_idle()
+        self._active = False
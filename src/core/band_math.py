@@ -0,0 +1,645 @@
+# src/core/band_math.py
+import ast
+import copy
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Sequence, Union
+
+import numpy as np
+import numexpr as ne
+
+from src.core.band_statistics import valid_mask
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# Upper bound of the input tiles plus output rows held per tile
+DEFAULT_TILE_BYTES = 32 * 1024 * 1024
+# Below this fraction of selected (or valid) pixels, a kernel runs on the gathered pixels only
+_COMPACT_FRACTION = 0.5
+
+# Elementwise functions accepted in expressions: name -> canonical (numexpr) name
+ELEMENTWISE_FUNCTIONS = {
+    'sin': 'sin', 'cos': 'cos', 'tan': 'tan',
+    'asin': 'arcsin', 'acos': 'arccos', 'atan': 'arctan',
+    'arcsin': 'arcsin', 'arccos': 'arccos', 'arctan': 'arctan', 'arctan2': 'arctan2',
+    'sqrt': 'sqrt', 'exp': 'exp', 'log': 'log', 'log10': 'log10',
+    'abs': 'abs', 'absolute': 'abs', 'ceil': 'ceil', 'floor': 'floor', 'round': 'round',
+    'min': 'minimum', 'max': 'maximum', 'minimum': 'minimum', 'maximum': 'maximum',
+    'where': 'where',
+}
+# Canonical names numexpr cannot compile; expressions using them run tile by tile in NumPy
+_NUMPY_ONLY_FUNCTIONS = {'round'}
+_NUMPY_FUNCTIONS = {
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+    'arcsin': np.arcsin, 'arccos': np.arccos, 'arctan': np.arctan, 'arctan2': np.arctan2,
+    'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log, 'log10': np.log10,
+    'abs': np.abs, 'ceil': np.ceil, 'floor': np.floor, 'round': np.round,
+    'minimum': np.minimum, 'maximum': np.maximum, 'where': np.where,
+}
+_BOOLEAN_OPERATORS = (ast.BitAnd, ast.BitOr, ast.BitXor)
+
+# Namespace of the whole-image evaluation (expressions with reductions such as mean())
+WHOLE_IMAGE_NAMESPACE = {
+    'np': np,
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'asin': np.arcsin,
+    'acos': np.arccos, 'atan': np.arctan, 'sqrt': np.sqrt,
+    'exp': np.exp, 'log': np.log, 'log10': np.log10, 'abs': np.abs,
+    'ceil': np.ceil, 'floor': np.floor, 'round': np.round,
+    'min': np.minimum, 'max': np.maximum, 'mean': np.mean,
+    'median': np.median, 'std': np.std, 'var': np.var
+}
+# With nodata, bands are masked arrays and reductions skip the masked pixels
+MASKED_WHOLE_IMAGE_NAMESPACE = {
+    **WHOLE_IMAGE_NAMESPACE,
+    'mean': np.ma.mean, 'median': np.ma.median, 'std': np.ma.std, 'var': np.ma.var,
+}
+
+_ELEMENTWISE_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Constant, ast.Load,
+    ast.operator, ast.unaryop, ast.cmpop,
+)
+
+
+class _ElementwiseCompiler(ast.NodeTransformer):
+    """
+    Rewrites function calls to their canonical names and records whether the
+    expression is purely elementwise.
+    """
+
+    def __init__(self, variables: Sequence[str]):
+        self.variables = set(variables)
+        self.elementwise = True
+
+    def generic_visit(self, node):
+        if not isinstance(node, _ELEMENTWISE_NODES):
+            self.elementwise = False
+        return super().generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id not in self.variables:
+            self.elementwise = False
+        return node
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id == 'np':
+            name = func.attr
+        else:
+            name = func.id if isinstance(func, ast.Name) else None
+        canonical = ELEMENTWISE_FUNCTIONS.get(name)
+        if canonical is None or node.keywords:
+            self.elementwise = False
+            return node
+        node.func = ast.copy_location(ast.Name(id=canonical, ctx=ast.Load()), func)
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+
+class _FloatConstantHoister(ast.NodeTransformer):
+    """
+    Replaces float literals with float32 variables. numexpr treats float literals
+    as float64 and would upcast the whole kernel; integer literals (e.g. integer
+    powers, which numexpr expands to multiplications) are left as they are.
+    """
+
+    def __init__(self):
+        self.constants: Dict[str, np.float32] = {}
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, float):
+            name = f"_c{len(self.constants)}"
+            self.constants[name] = np.float32(node.value)
+            return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+        return node
+
+
+class _CommutativeOrder(ast.NodeTransformer):
+    """Orders the operands of + and * so that `a + b` and `b + a` become the same tree."""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, (ast.Add, ast.Mult)) and ast.dump(node.right) < ast.dump(node.left):
+            node.left, node.right = node.right, node.left
+        return node
+
+
+def _parse_elementwise(expression: str, variables: Sequence[str]) -> Optional[ast.Expression]:
+    """The expression tree with canonical function names, or None if it is not purely elementwise."""
+    compiler = _ElementwiseCompiler(variables)
+    tree = compiler.visit(ast.parse(expression.strip(), mode='eval'))
+    return tree if compiler.elementwise else None
+
+
+def _is_where(node: ast.AST) -> bool:
+    return (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'where'
+            and len(node.args) == 3)
+
+
+def _is_boolean(node: ast.AST) -> bool:
+    """Whether an elementwise tree yields booleans (comparisons combined with &, | and ^)."""
+    if isinstance(node, ast.Compare):
+        return True
+    if isinstance(node, ast.BinOp) and isinstance(node.op, _BOOLEAN_OPERATORS):
+        return _is_boolean(node.left) and _is_boolean(node.right)
+    return isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert) and _is_boolean(node.operand)
+
+
+class _ConditionalLifter(ast.NodeTransformer):
+    """Replaces the outermost where() calls with variables computed by `_Conditional`s."""
+
+    def __init__(self, variables: Sequence[str]):
+        self.variables = variables
+        self.conditionals = []
+
+    def visit_Call(self, node):
+        if _is_where(node):
+            name = f"_w{len(self.conditionals)}"
+            self.conditionals.append((name, _Conditional(node, self.variables)))
+            return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+        self.generic_visit(node)
+        return node
+
+
+class _TileKernel:
+    """
+    An elementwise expression tree compiled for one tile: a fused numexpr kernel
+    when numexpr can take it, NumPy otherwise (e.g. for round).
+
+    where(cond, a, b) is not fused: each one is a `_Conditional` computed before
+    the rest of the kernel, so that its branches only run where they are selected.
+    """
+
+    def __init__(self, tree: ast.Expression, variables: Sequence[str]):
+        tree = ast.fix_missing_locations(tree)
+        # Variables read by the kernel (gathered when it runs on a subset of the pixels)
+        self.inputs = sorted({node.id for node in ast.walk(tree) if isinstance(node, ast.Name)} & set(variables))
+        self._root = None
+        self.conditionals = []
+        if _is_where(tree.body):
+            self._root = _Conditional(tree.body, variables)
+            self.mode = self._root.mode
+            return
+        lifter = _ConditionalLifter(variables)
+        tree = ast.fix_missing_locations(lifter.visit(tree))
+        self.conditionals = lifter.conditionals
+        variables = list(variables) + [name for name, _ in self.conditionals]
+
+        self.mode = 'numpy'
+        self._code = compile(tree, '<expression>', 'eval')
+        # Constant kernels broadcast through NumPy
+        if not any(isinstance(node, ast.Name) and node.id in variables for node in ast.walk(tree)):
+            return
+        if any(isinstance(node, ast.Call) and node.func.id in _NUMPY_ONLY_FUNCTIONS for node in ast.walk(tree)):
+            return
+        hoister = _FloatConstantHoister()
+        source = ast.unparse(hoister.visit(copy.deepcopy(tree)))
+        dummies = {var: np.zeros(1, dtype=np.float32) for var in variables}
+        # Anything numexpr still rejects (e.g. an unsupported type signature) stays on NumPy
+        if ne.validate(source, local_dict={**dummies, **hoister.constants}) is None:
+            self.mode = 'numexpr'
+            self.source = source
+            self._constants = hoister.constants
+
+    def compute(self, inputs: Dict[str, np.ndarray], target: np.ndarray):
+        if self._root is not None:
+            self._root.compute(inputs, target)
+            return
+        if self.conditionals:
+            inputs = dict(inputs)
+            for name, conditional in self.conditionals:
+                inputs[name] = np.empty(target.shape, dtype=np.float32)
+                conditional.compute(inputs, inputs[name])
+        if self.mode == 'numexpr':
+            ne.evaluate(self.source, local_dict={**inputs, **self._constants}, out=target, casting='unsafe')
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                target[...] = eval(self._code, {"__builtins__": {}}, {**_NUMPY_FUNCTIONS, **inputs})
+
+    def compute_at(self, inputs: Dict[str, np.ndarray], mask: np.ndarray, target: np.ndarray,
+                   count: Optional[int] = None):
+        """Computes the kernel on the pixels selected by `mask` only, writing them to `target`."""
+        if count is None:
+            count = np.count_nonzero(mask)
+        values = np.empty(count, dtype=target.dtype)
+        self.compute({var: inputs[var][mask] for var in self.inputs}, values)
+        target[mask] = values
+
+
+class _Conditional:
+    """
+    where(cond, a, b) on a tile. The condition is computed first; a tile that
+    selects a single branch only computes that branch, otherwise the branch
+    selected by most pixels runs on the whole tile and the other one on the
+    gathered pixels that select it.
+    """
+
+    def __init__(self, node: ast.Call, variables: Sequence[str]):
+        condition, then, otherwise = node.args
+        if not _is_boolean(condition):
+            condition = ast.Compare(left=condition, ops=[ast.NotEq()], comparators=[ast.Constant(value=0)])
+        self.condition = _TileKernel(ast.Expression(body=condition), variables)
+        self.branches = (_TileKernel(ast.Expression(body=then), variables),
+                         _TileKernel(ast.Expression(body=otherwise), variables))
+        kernels = (self.condition,) + self.branches
+        self.mode = 'numpy' if any(kernel.mode == 'numpy' for kernel in kernels) else 'numexpr'
+
+    def compute(self, inputs: Dict[str, np.ndarray], target: np.ndarray):
+        mask = np.empty(target.shape, dtype=bool)
+        self.condition.compute(inputs, mask)
+        selected = np.count_nonzero(mask)
+        then, otherwise = self.branches
+        if selected == mask.size:
+            then.compute(inputs, target)
+        elif selected == 0:
+            otherwise.compute(inputs, target)
+        elif selected >= mask.size * _COMPACT_FRACTION:
+            then.compute(inputs, target)
+            otherwise.compute_at(inputs, ~mask, target, mask.size - selected)
+        else:
+            otherwise.compute(inputs, target)
+            then.compute_at(inputs, mask, target, selected)
+
+
+def _compute_masked(kernel: _TileKernel, inputs: Optional[Dict[str, np.ndarray]], valid: Optional[np.ndarray],
+                    target: np.ndarray, fill_value: Optional[float]):
+    """
+    Computes `kernel` into `target` on the valid pixels and sets the others to
+    `fill_value` (as well as NaN and infinite results). Tiles without valid
+    pixels are not computed; sparsely valid ones are computed on the gathered
+    valid pixels only. With `fill_value` None, invalid pixels are NaN and the
+    results are kept as they are, NaN and infinities included.
+    """
+    raw = fill_value is None
+    if raw:
+        fill_value = np.nan
+    count = target.size if valid is None else np.count_nonzero(valid)
+    if inputs is None or count == 0:
+        target.fill(fill_value)
+        return
+    if count == target.size:
+        kernel.compute(inputs, target)
+    elif count < target.size * _COMPACT_FRACTION:
+        target.fill(fill_value)
+        kernel.compute_at(inputs, valid, target, count)
+    else:
+        kernel.compute(inputs, target)
+        np.copyto(target, fill_value, where=~valid)
+    if not raw:
+        np.nan_to_num(target, copy=False, nan=fill_value, posinf=fill_value, neginf=fill_value)
+
+
+def _all_valid(valid: Dict[str, np.ndarray], variables) -> Optional[np.ndarray]:
+    """Pixels valid in every one of `variables` (None when none of them is masked)."""
+    masks = [valid[var] for var in variables if var in valid]
+    if not masks:
+        return None
+    combined = masks[0].copy()
+    for mask in masks[1:]:
+        combined &= mask
+    return combined
+
+
+def _row_tiles(height: int, width: int, arrays_per_tile: int, tile_bytes: int):
+    """Row ranges such that `arrays_per_tile` float32 arrays of a tile fit in `tile_bytes`."""
+    tile_rows = max(1, tile_bytes // max(width * 4 * arrays_per_tile, 1))
+    return [(y0, min(y0 + tile_rows, height)) for y0 in range(0, height, tile_rows)]
+
+
+def _run_tiles(tiles, readers: Dict[str, Callable[[int, int], np.ndarray]], compute_tile,
+               num_workers: Optional[int] = None,
+               progress_callback: Optional[Callable[[int, int], None]] = None,
+               nodata: Optional[Dict[str, Optional[float]]] = None, skip_invalid: bool = False,
+               valid_readers: Optional[Dict[str, Callable[[int, int], np.ndarray]]] = None) -> int:
+    """
+    Reads every tile's inputs once (as float32) and passes them to
+    compute_tile(y0, y1, inputs, valid), `valid` holding the validity mask of
+    every variable listed in `nodata` (NaN and the variable's nodata value are
+    invalid) or in `valid_readers` (which read the masks of rows [y0, y1)
+    directly). With `skip_invalid`, reading a tile stops as soon as no pixel is
+    valid in all variables read so far and `inputs` is None.
+
+    Without `num_workers`, tiles are computed one after another (numexpr spreads each
+    kernel over all its threads) while a single reader thread prepares the next tile.
+    With `num_workers`, whole tiles are read and computed on a thread pool.
+    Returns the number of compute threads.
+    """
+    nodata = nodata or {}
+    valid_readers = valid_readers or {}
+
+    def read_tile(y0: int, y1: int):
+        inputs, valid, combined = {}, {}, None
+        for var, read in readers.items():
+            inputs[var] = np.asarray(read(y0, y1), dtype=np.float32)
+            if var in valid_readers:
+                valid[var] = np.asarray(valid_readers[var](y0, y1), dtype=bool)
+            elif var in nodata:
+                valid[var] = valid_mask(inputs[var], nodata[var])
+            else:
+                continue
+            if skip_invalid:
+                combined = valid[var].copy() if combined is None else (combined & valid[var])
+                if not combined.any():
+                    return None, valid
+        return inputs, valid
+
+    done = 0
+    if not tiles:
+        return 0
+    if num_workers is None:
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            pending = reader.submit(read_tile, *tiles[0])
+            for i, (y0, y1) in enumerate(tiles):
+                inputs, valid = pending.result()
+                if i + 1 < len(tiles):
+                    pending = reader.submit(read_tile, *tiles[i + 1])
+                compute_tile(y0, y1, inputs, valid)
+                done += 1
+                if progress_callback:
+                    progress_callback(done, len(tiles))
+        return ne.get_num_threads()
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(lambda y0, y1: compute_tile(y0, y1, *read_tile(y0, y1)), y0, y1)
+                   for y0, y1 in tiles]
+        for future in futures:
+            future.result()
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(tiles))
+    return num_workers
+
+
+class BandMathExpression:
+    """
+    A raster calculator expression compiled for tile-by-tile evaluation.
+
+    Band references must already be replaced by plain variable names. Depending
+    on what the expression uses, it is evaluated in one of three modes:
+
+    - 'numexpr': only elementwise operations numexpr supports. Each tile is
+      computed by a single fused, multi-threaded numexpr kernel written straight
+      into the output, so there are no full-size temporaries.
+    - 'numpy': elementwise, but with a function numexpr lacks (e.g. round).
+      Tiles are evaluated with NumPy on a thread pool; temporaries are tile-sized.
+    - 'whole': whole-image reductions (mean, median, std, ...) or anything not
+      known to be elementwise. The referenced bands are read in full and the
+      expression is evaluated once in float64, as the calculator always did.
+
+    where(cond, a, b) is evaluated lazily in the tiled modes: a branch is only
+    computed on the tiles, or the gathered pixels, that select it.
+
+    Inputs are read in their native dtype and converted to float32 per tile; the
+    result is float32 with NaN and infinities replaced by `fill_value` (0). With
+    `nodata`, every tile carries the validity mask of its inputs: invalid pixels
+    are set to `fill_value` without being computed, and a tile with no valid
+    pixel is neither computed nor read past the first band that empties it.
+    """
+
+    def __init__(self, expression: str, variables: Sequence[str]):
+        self.expression = expression
+        self.variables = list(variables)
+        tree = _parse_elementwise(expression, self.variables)
+        if tree is None:
+            self.mode = 'whole'
+            self._code = compile(ast.parse(expression.strip(), mode='eval'), '<expression>', 'eval')
+        else:
+            self._kernel = _TileKernel(tree, self.variables)
+            self.mode = self._kernel.mode
+
+    def evaluate(self, readers: Dict[str, Callable[[int, int], np.ndarray]], height: int, width: int,
+                 out: Optional[np.ndarray] = None, tile_bytes: int = DEFAULT_TILE_BYTES,
+                 num_workers: Optional[int] = None,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 nodata: Optional[Dict[str, Optional[float]]] = None, fill_value: float = 0.0) -> np.ndarray:
+        """
+        Evaluates the expression over a height x width grid.
+
+        Args:
+            readers: For every variable, a function reading rows [y0, y1) of its
+                band as a 2D array (any dtype).
+            height, width: Size of the output grid.
+            out: Optional preallocated (height, width) float32 output.
+            tile_bytes: Approximate memory budget of one tile (inputs and output).
+            num_workers: Threads for the 'numpy' mode (default: CPU count, at most 8).
+            progress_callback: Called as progress_callback(done_tiles, total_tiles).
+            nodata: Variables whose NaN and nodata pixels (None: NaN only) are invalid.
+            fill_value: Output value of invalid pixels and of NaN or infinite results.
+
+        Returns:
+            The (height, width) float32 result.
+        """
+        start = time.time()
+        if out is None:
+            out = np.empty((height, width), dtype=np.float32)
+        nodata = {var: value for var, value in (nodata or {}).items() if var in self.variables}
+
+        if self.mode == 'whole':
+            namespace = dict(MASKED_WHOLE_IMAGE_NAMESPACE if nodata else WHOLE_IMAGE_NAMESPACE)
+            for var, read in readers.items():
+                band = np.asarray(read(0, height), dtype=np.float64)
+                if var in nodata:
+                    band = np.ma.masked_array(band, mask=~valid_mask(band, nodata[var]))
+                namespace[var] = band
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out[...] = np.ma.filled(eval(self._code, {"__builtins__": {}}, namespace), fill_value)
+            np.nan_to_num(out, copy=False, nan=fill_value, posinf=fill_value, neginf=fill_value)
+            if progress_callback:
+                progress_callback(1, 1)
+            logger.info(f"Evaluated '{self.expression}' on the whole image in {time.time() - start:.2f}s")
+            return out
+
+        skipped = []
+
+        def compute_tile(y0: int, y1: int, inputs: Optional[Dict[str, np.ndarray]], valid: Dict[str, np.ndarray]):
+            if inputs is None:
+                skipped.append((y0, y1))
+            _compute_masked(self._kernel, inputs, _all_valid(valid, self.variables), out[y0:y1], fill_value)
+
+        tiles = _row_tiles(height, width, len(self.variables) + 1, tile_bytes)
+        if self.mode == 'numpy':
+            num_workers = num_workers or min(8, os.cpu_count() or 1)
+        else:
+            num_workers = None
+        workers = _run_tiles(tiles, readers, compute_tile, num_workers, progress_callback,
+                             nodata=nodata, skip_invalid=True)
+        logger.info(f"Evaluated '{self.expression}' ({self.mode}) on {height}x{width} in {len(tiles)} tiles "
+                    f"({len(skipped)} without valid pixels) with {workers} threads in {time.time() - start:.2f}s")
+        return out
+
+
+def _is_shareable(node: ast.AST) -> bool:
+    """Operations worth keeping as a shared temporary (not plain names or constant subtrees)."""
+    return (isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Call, ast.Compare))
+            and any(isinstance(child, ast.Name) for child in ast.walk(node)))
+
+
+class BatchBandMath:
+    """
+    Several expressions over the same bands (e.g. a set of spectral indices),
+    evaluated in a single pass over the data.
+
+    The union of the referenced bands is read once per tile. Subexpressions that
+    occur more than once across the expressions (after ordering the operands of
+    + and *) are computed once per tile into tile-sized temporaries and shared,
+    e.g. `NIR + Red` in NDVI, SAVI and friends. Each expression then writes its
+    band of the (N, height, width) float32 output. Expressions that are not
+    elementwise (whole-image reductions) are evaluated separately afterwards,
+    reading only their own bands.
+
+    With `nodata` (or `valid_readers`), each expression's pixels are valid where
+    all bands it reads are; a tile is only computed on the pixels valid for some
+    expression (gathered when they are few) and the invalid pixels of each band
+    are set to its fill value.
+    """
+
+    def __init__(self, expressions: Sequence[str], variables: Sequence[str]):
+        self.expressions = list(expressions)
+        self.variables = list(variables)
+        self._whole: Dict[int, BandMathExpression] = {}
+        bodies = {}
+        order = _CommutativeOrder()
+        for i, expression in enumerate(self.expressions):
+            tree = _parse_elementwise(expression, self.variables)
+            if tree is None:
+                used = {node.id for node in ast.walk(ast.parse(expression.strip(), mode='eval'))
+                        if isinstance(node, ast.Name)}
+                self._whole[i] = BandMathExpression(expression, [v for v in self.variables if v in used])
+            else:
+                bodies[i] = order.visit(tree).body
+        # Bands each elementwise expression reads, before shared subexpressions replace them
+        self._reads = {i: sorted({node.id for node in ast.walk(body) if isinstance(node, ast.Name)}
+                                 & set(self.variables)) for i, body in bodies.items()}
+
+        counts = Counter(ast.dump(node) for body in bodies.values() for node in ast.walk(body)
+                         if _is_shareable(node))
+        names = {}
+        shared = []
+
+        def substitute(node, enclosing: int):
+            # Shared if it occurs more often than the shared expression it sits in
+            if _is_shareable(node):
+                key = ast.dump(node)
+                if counts[key] > 1 and counts[key] > enclosing:
+                    if key not in names:
+                        body = substitute_children(copy.deepcopy(node), counts[key])
+                        names[key] = f"_s{len(shared)}"
+                        shared.append((names[key], body))
+                    return ast.Name(id=names[key], ctx=ast.Load())
+            return substitute_children(node, enclosing)
+
+        def substitute_children(node, enclosing: int):
+            for field, value in ast.iter_fields(node):
+                if isinstance(value, list):
+                    setattr(node, field, [substitute(v, enclosing) if isinstance(v, ast.expr) else v for v in value])
+                elif isinstance(value, ast.expr):
+                    setattr(node, field, substitute(value, enclosing))
+            return node
+
+        outputs = {i: substitute(body, 1) for i, body in bodies.items()}
+        known = list(self.variables)
+        self._shared = []
+        for name, body in shared:
+            self._shared.append((name, _TileKernel(ast.Expression(body=body), known)))
+            known.append(name)
+        self._outputs = {i: _TileKernel(ast.Expression(body=body), known) for i, body in outputs.items()}
+
+    @property
+    def num_shared(self) -> int:
+        """Number of subexpressions computed once and shared between expressions."""
+        return len(self._shared)
+
+    def evaluate(self, readers: Dict[str, Callable[[int, int], np.ndarray]], height: int, width: int,
+                 out: Optional[np.ndarray] = None, tile_bytes: int = DEFAULT_TILE_BYTES,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 nodata: Optional[Dict[str, Optional[float]]] = None,
+                 fill_value: Union[Optional[float], Sequence[Optional[float]]] = 0.0,
+                 valid_readers: Optional[Dict[str, Callable[[int, int], np.ndarray]]] = None,
+                 valid_out: Optional[Dict[int, np.ndarray]] = None) -> np.ndarray:
+        """
+        Evaluates all expressions over a height x width grid.
+
+        Args:
+            readers: For every variable, a function reading rows [y0, y1) of its band.
+            height, width: Size of the output grid.
+            out: Optional preallocated (N, height, width) float32 output, or a list of
+                N (height, width) float32 arrays.
+            tile_bytes: Approximate memory budget of one tile (inputs and shared temporaries).
+            progress_callback: Called as progress_callback(done_steps, total_steps).
+            nodata: Variables whose NaN and nodata pixels (None: NaN only) are invalid.
+            fill_value: Value of invalid pixels and of NaN or infinite results, for
+                all expressions or one per expression. None keeps the raw results
+                (invalid pixels are NaN).
+            valid_readers: For variables whose validity is known beforehand, a
+                function reading rows [y0, y1) of their boolean validity mask.
+            valid_out: For some elementwise expressions (by index), a (height, width)
+                boolean array receiving their validity mask.
+
+        Returns:
+            The results (`out`), one band per expression.
+        """
+        start = time.time()
+        if out is None:
+            out = np.empty((len(self.expressions), height, width), dtype=np.float32)
+        nodata = {var: value for var, value in (nodata or {}).items() if var in self.variables}
+        valid_readers = {var: read for var, read in (valid_readers or {}).items() if var in self.variables}
+        valid_out = valid_out or {}
+        fills = (list(fill_value) if isinstance(fill_value, Sequence)
+                 else [fill_value] * len(self.expressions))
+        # Value of the pixels not computed (raw outputs: NaN)
+        blanks = [np.nan if fill is None else fill for fill in fills]
+        tiles = _row_tiles(height, width, len(self.variables) + len(self._shared) + 1, tile_bytes)
+        total = (len(tiles) if self._outputs else 0) + len(self._whole)
+
+        def compute_tile(y0: int, y1: int, inputs: Dict[str, np.ndarray], valid: Dict[str, np.ndarray]):
+            shape = (y1 - y0, width)
+            masks = {i: _all_valid(valid, reads) for i, reads in self._reads.items()}
+            for i, mask_out in valid_out.items():
+                mask_out[y0:y1] = True if masks[i] is None else masks[i]
+            # Pixels some expression needs; the shared subexpressions are computed there only
+            needed = None
+            if all(mask is not None for mask in masks.values()):
+                needed = np.logical_or.reduce(list(masks.values()))
+                count = np.count_nonzero(needed)
+                if count == 0:
+                    for i in self._outputs:
+                        out[i][y0:y1] = blanks[i]
+                    return
+                if count < needed.size * _COMPACT_FRACTION:
+                    inputs = {var: tile[needed] for var, tile in inputs.items()}
+                    masks = {i: mask[needed] for i, mask in masks.items()}
+                    shape = (count,)
+            for name, kernel in self._shared:
+                inputs[name] = np.empty(shape, dtype=np.float32)
+                kernel.compute(inputs, inputs[name])
+            for i, kernel in self._outputs.items():
+                target = out[i][y0:y1]
+                if shape != target.shape:
+                    values = np.empty(shape, dtype=np.float32)
+                    _compute_masked(kernel, inputs, masks[i], values, fills[i])
+                    target.fill(blanks[i])
+                    target[needed] = values
+                else:
+                    _compute_masked(kernel, inputs, masks[i], target, fills[i])
+
+        done = 0
+        if self._outputs:
+            tile_readers = {var: readers[var] for var in self.variables}
+            progress = (lambda d, t: progress_callback(d, total)) if progress_callback else None
+            _run_tiles(tiles, tile_readers, compute_tile, progress_callback=progress, nodata=nodata,
+                       valid_readers=valid_readers)
+            done = len(tiles)
+        for i, expression in self._whole.items():
+            expression.evaluate({var: readers[var] for var in expression.variables}, height, width, out=out[i],
+                                nodata=nodata, fill_value=fills[i])
+            done += 1
+            if progress_callback:
+                progress_callback(done, total)
+
+        logger.info(f"Evaluated {len(self.expressions)} expressions ({len(self._shared)} shared subexpressions, "
+                    f"{len(self._whole)} whole-image) on {height}x{width} in {len(tiles)} tiles "
+                    f"in {time.time() - start:.2f}s")
+        return out
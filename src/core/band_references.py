@@ -0,0 +1,257 @@
+# src/core/band_references.py
+import ast
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.core.spectral_reductions import SPECTRAL_REDUCTIONS, reduction_identifier, rewrite_spectral_reductions
+from src.core.spectral_resampling import layer_spectral_grid, to_nanometers
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# A wavelength reference fails if the nearest band centre is further away than this (nm)
+MAX_WAVELENGTH_OFFSET_NM = 50.0
+
+_UNIT_TO_NM = {'nm': 1.0, 'um': 1000.0, 'µm': 1000.0}
+_WAVELENGTH = r'(\d+(?:\.\d*)?|\.\d+)\s*(nm|um|µm)'
+_WAVELENGTH_RE = re.compile(_WAVELENGTH + r'(?![\w])')
+_QUOTED_RE = re.compile(r'"([^"]+)@([^"]+)"')
+_QUOTED_WAVELENGTH_RE = re.compile(r'^\s*' + _WAVELENGTH + r'\s*(?::\s*' + _WAVELENGTH + r'\s*)?$')
+
+_MAX_CACHED_INDEXES = 64
+_index_cache: "OrderedDict[Tuple, WavelengthIndex]" = OrderedDict()
+_index_lock = threading.Lock()
+
+
+class WavelengthIndex:
+    """Band centres of a layer in nanometres, sorted once for nearest-band and range lookups."""
+
+    def __init__(self, wavelengths_nm: np.ndarray):
+        wavelengths_nm = np.asarray(wavelengths_nm, dtype=np.float64)
+        self.wavelengths = wavelengths_nm
+        self.order = np.argsort(wavelengths_nm, kind='stable')
+        self.sorted = wavelengths_nm[self.order]
+
+    def nearest(self, nm: float) -> int:
+        """Index of the band whose centre is closest to `nm`."""
+        pos = int(np.searchsorted(self.sorted, nm))
+        candidates = [i for i in (pos - 1, pos) if 0 <= i < self.sorted.size]
+        best = min(candidates, key=lambda i: abs(self.sorted[i] - nm))
+        return int(self.order[best])
+
+    def between(self, lo_nm: float, hi_nm: float) -> np.ndarray:
+        """Indices of the bands with centres in [lo_nm, hi_nm], by increasing wavelength."""
+        lo_nm, hi_nm = min(lo_nm, hi_nm), max(lo_nm, hi_nm)
+        start = np.searchsorted(self.sorted, lo_nm, side='left')
+        stop = np.searchsorted(self.sorted, hi_nm, side='right')
+        return self.order[start:stop]
+
+
+def get_wavelength_index(layer: dict) -> Optional[WavelengthIndex]:
+    """Cached `WavelengthIndex` of a layer, or None if the layer has no wavelengths."""
+    grid = layer_spectral_grid(layer)
+    if grid is None:
+        return None
+    wavelengths, _, units = grid
+    key = (wavelengths.tobytes(), units)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = WavelengthIndex(to_nanometers(wavelengths, units))
+    with _index_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > _MAX_CACHED_INDEXES:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def _to_nm(value: str, unit: str) -> float:
+    return float(value) * _UNIT_TO_NM[unit]
+
+
+def _rewrite_text(expression: str) -> Tuple[str, List[str]]:
+    """
+    Turns the wavelength syntax into plain Python: "layer@860nm" becomes
+    R("layer", 860.0), "layer@700nm:750nm" becomes R("layer", 700.0, 750.0), and
+    outside quotes 860nm / 0.86um become 860.0 and ranges a:b become a, b.
+
+    Other quoted strings ("layer@bN") are swapped for placeholders so they come back
+    out of the AST exactly as written; returns the text and the swapped strings.
+    """
+    parts = re.split(r'("[^"]*")', expression)
+    quoted = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            match = _QUOTED_RE.fullmatch(part)
+            spec = _QUOTED_WAVELENGTH_RE.match(match.group(2)) if match else None
+            if spec:
+                args = [repr(match.group(1)), repr(_to_nm(spec.group(1), spec.group(2)))]
+                if spec.group(3):
+                    args.append(repr(_to_nm(spec.group(3), spec.group(4))))
+                parts[i] = f"R({', '.join(args)})"
+            else:
+                parts[i] = f"__quoted{len(quoted)}__"
+                quoted.append(part)
+        else:
+            part = _WAVELENGTH_RE.sub(lambda m: repr(_to_nm(m.group(1), m.group(2))), part)
+            parts[i] = part.replace(':', ',')
+    return ''.join(parts), quoted
+
+
+class _ReferenceResolver(ast.NodeTransformer):
+    """Replaces R(...), band-range reductions and CR(...) by arithmetic on band placeholders."""
+
+    def __init__(self, layer_map: Dict[str, dict], default_layer: Optional[str], max_offset_nm: float):
+        self.layer_map = layer_map
+        self.default_layer = default_layer
+        self.max_offset_nm = max_offset_nm
+        self.identifiers: List[str] = []
+        self._requested: Dict[Tuple[str, int], float] = {}  # (layer, band) -> first wavelength resolved to it
+
+    # ---------------- LOOKUPS ----------------
+    def _parse_reference(self, node: ast.Call) -> Tuple[str, List[float]]:
+        """(layer name, [wavelength] or [start, end]) of an R(...) call."""
+        args = list(node.args)
+        layer_name = self.default_layer
+        if args and isinstance(args[0], ast.Constant) and isinstance(args[0].value, str):
+            layer_name = args.pop(0).value
+        if not 1 <= len(args) <= 2 or not all(isinstance(a, ast.Constant) and isinstance(a.value, (int, float))
+                                              for a in args):
+            raise ValueError("Use R(860nm) for a band or R(700nm:750nm) for a band range.")
+        if not layer_name:
+            raise ValueError("R(...) needs a layer: select one or write \"layer@860nm\".")
+        if layer_name not in self.layer_map:
+            raise ValueError(f"Layer '{layer_name}' not found")
+        return layer_name, [float(a.value) for a in args]
+
+    def _index(self, layer_name: str) -> WavelengthIndex:
+        index = get_wavelength_index(self.layer_map[layer_name])
+        if index is None:
+            raise ValueError(f"Layer '{layer_name}' has no band wavelengths; use \"{layer_name}@bN\" instead.")
+        return index
+
+    def _placeholder(self, layer_name: str, band: int) -> ast.Name:
+        return self._identifier(f"{layer_name}@b{band + 1}")
+
+    def _identifier(self, identifier: str) -> ast.Name:
+        if identifier not in self.identifiers:
+            self.identifiers.append(identifier)
+        return ast.Name(id=f"__ref{self.identifiers.index(identifier)}__", ctx=ast.Load())
+
+    def _band(self, layer_name: str, nm: float) -> Tuple[ast.Name, float]:
+        index = self._index(layer_name)
+        band = index.nearest(nm)
+        offset = abs(index.wavelengths[band] - nm)
+        if offset > self.max_offset_nm:
+            raise ValueError(f"Layer '{layer_name}' has no band near {nm:g} nm "
+                             f"(closest is {index.wavelengths[band]:g} nm).")
+        # Two different wavelengths on one band would silently turn e.g. a narrowband index into 0
+        first = self._requested.setdefault((layer_name, band), nm)
+        if abs(first - nm) > 1.0:
+            raise ValueError(f"{first:g} nm and {nm:g} nm both resolve to band b{band + 1} "
+                             f"({index.wavelengths[band]:g} nm) of layer '{layer_name}'.")
+        return self._placeholder(layer_name, band), float(index.wavelengths[band])
+
+    def _range(self, layer_name: str, start: float, end: float) -> List[int]:
+        bands = self._index(layer_name).between(start, end)
+        if bands.size == 0:
+            raise ValueError(f"Layer '{layer_name}' has no band between {start:g} and {end:g} nm.")
+        return sorted(int(b) for b in bands)
+
+    def _single(self, node: ast.AST) -> Tuple[ast.Name, float]:
+        """A band given as a bare wavelength (default layer) or an R(...) with one wavelength."""
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            node = ast.Call(func=ast.Name(id='R', ctx=ast.Load()), args=[node], keywords=[])
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'R'):
+            raise ValueError("CR(...) takes wavelengths or single-band references, e.g. CR(680nm, 550nm, 750nm).")
+        layer_name, wavelengths = self._parse_reference(node)
+        if len(wavelengths) != 1:
+            raise ValueError("CR(...) takes single bands, not band ranges.")
+        return self._band(layer_name, wavelengths[0])
+
+    # ---------------- REWRITING ----------------
+    def visit_Call(self, node):
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        if name == 'R':
+            layer_name, wavelengths = self._parse_reference(node)
+            if len(wavelengths) == 2:
+                raise ValueError("A band range must be reduced per pixel, e.g. mean(R(700nm:750nm)).")
+            return self._band(layer_name, wavelengths[0])[0]
+
+        if (name in SPECTRAL_REDUCTIONS and len(node.args) == 1 and isinstance(node.args[0], ast.Call)
+                and isinstance(node.args[0].func, ast.Name) and node.args[0].func.id == 'R'):
+            layer_name, wavelengths = self._parse_reference(node.args[0])
+            if len(wavelengths) == 2:
+                # One streaming per-pixel reduction over the band set (see spectral_reductions)
+                bands = self._range(layer_name, *wavelengths)
+                return self._identifier(reduction_identifier(layer_name, name, bands))
+
+        if name == 'CR':
+            # Continuum removal: the band divided by the straight line between two shoulder bands
+            if len(node.args) != 3:
+                raise ValueError("Use CR(band, left shoulder, right shoulder), e.g. CR(680nm, 550nm, 750nm).")
+            (band, wl), (left, wl_left), (right, wl_right) = [self._single(arg) for arg in node.args]
+            if wl_left == wl_right:
+                raise ValueError("The continuum shoulders of CR(...) resolve to the same band.")
+            weight = (wl - wl_left) / (wl_right - wl_left)
+            continuum = ast.BinOp(left, ast.Add(), ast.BinOp(ast.BinOp(right, ast.Sub(), left), ast.Mult(),
+                                                             ast.Constant(weight)))
+            return ast.BinOp(band, ast.Div(), continuum)
+
+        return self.generic_visit(node)
+
+
+def uses_wavelength_references(expression: str) -> bool:
+    """True if the expression contains R(...), CR(...) or "layer@<wavelength>" references."""
+    if re.search(r'\b(?:R|CR)\s*\(', expression):
+        return True
+    return any(_QUOTED_WAVELENGTH_RE.match(spec) for _, spec in _QUOTED_RE.findall(expression))
+
+
+def resolve_band_references(expression: str, layer_map: Dict[str, dict], default_layer: Optional[str] = None,
+                            max_offset_nm: float = MAX_WAVELENGTH_OFFSET_NM) -> str:
+    """
+    Rewrites wavelength-addressed band references to the "layer@bN" form.
+
+    Supported syntax (wavelengths in nm, um or µm):
+        R(860nm)                 nearest band of `default_layer`
+        "layer@860nm"            nearest band of another layer
+        mean(R(700nm:750nm))     per-pixel reduction over the bands in a range (any of
+                                 SPECTRAL_REDUCTIONS; also with "layer@700nm:750nm")
+        CR(680nm, 550nm, 750nm)  continuum-removed value: the band divided by the line
+                                 between the two shoulder bands (arguments may also be
+                                 R(...) or "layer@...nm" references)
+
+    Band lookups go through each layer's cached `WavelengthIndex`. Reductions over
+    ranges, and over band sets such as mean("layer@b10:b50"), become reduction
+    identifiers ("layer@mean(b10:b50)") that are streamed band chunk by band chunk
+    (see `spectral_reductions`). Other expressions are returned unchanged.
+
+    Raises:
+        ValueError: For unknown layers, layers without wavelengths or wavelengths
+            that no band is close to.
+    """
+    if not uses_wavelength_references(expression):
+        return rewrite_spectral_reductions(expression)
+    text, quoted = _rewrite_text(expression)
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Syntax error: {e}")
+    resolver = _ReferenceResolver(layer_map, default_layer, max_offset_nm)
+    tree = ast.fix_missing_locations(resolver.visit(tree))
+    resolved = ast.unparse(tree)
+    for i, identifier in enumerate(resolver.identifiers):
+        resolved = resolved.replace(f"__ref{i}__", f'"{identifier}"')
+    for i, part in enumerate(quoted):
+        resolved = resolved.replace(f"__quoted{i}__", part)
+    resolved = rewrite_spectral_reductions(resolved)
+    logger.info(f"Resolved '{expression}' to '{resolved}'")
+    return resolved
@@ -0,0 +1,325 @@
+# src/core/band_statistics.py
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+DEFAULT_BINS = 1024
+# Native bytes of one chunk of rows; its temporaries are a few times larger
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+# Values (pixels x bands) of the strided sample that sets each band's histogram range
+_RANGE_SAMPLE_VALUES = 1 << 22
+_MAX_CACHED_STATISTICS = 16
+
+_cache: "OrderedDict[Hashable, Tuple[BandStatistics, weakref.ref]]" = OrderedDict()
+_pending: Dict[Hashable, Future] = {}
+_cache_lock = threading.Lock()
+# Requests are queued on one background thread; each computation is itself multithreaded
+_background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='band-statistics')
+
+
+def valid_mask(flat: np.ndarray, nodata: Optional[float]) -> Optional[np.ndarray]:
+    """Mask of the finite, non-nodata values of `flat`, or None when every value is valid."""
+    mask = np.isfinite(flat) if np.issubdtype(flat.dtype, np.floating) else None
+    if nodata is not None:
+        mask = (flat != nodata) if mask is None else (mask & (flat != nodata))
+    return mask
+
+
+class RunningBandStatistics:
+    """Running per-band min/max/mean/std, merged tile by tile (Chan et al. parallel update)."""
+
+    def __init__(self, num_bands: int):
+        self.count = np.zeros(num_bands, dtype=np.float64)
+        self.mean = np.zeros(num_bands, dtype=np.float64)
+        self.m2 = np.zeros(num_bands, dtype=np.float64)
+        self.min = np.full(num_bands, np.inf)
+        self.max = np.full(num_bands, -np.inf)
+
+    @staticmethod
+    def of_tile(tile: np.ndarray, nodata: Optional[float], mask: Optional[np.ndarray] = None):
+        """
+        Partial statistics of a (bands, rows, cols) or (bands, pixels) tile, ignoring
+        NaN and nodata. A mask already computed with `valid_mask` can be passed in.
+        """
+        flat = tile.reshape(tile.shape[0], -1)
+        if mask is None:
+            mask = valid_mask(flat, nodata)
+
+        if mask is None:
+            count = np.full(flat.shape[0], flat.shape[1], dtype=np.float64)
+            total = flat.sum(axis=1, dtype=np.float64)
+            vmin = flat.min(axis=1).astype(np.float64) if flat.shape[1] else np.full(flat.shape[0], np.inf)
+            vmax = flat.max(axis=1).astype(np.float64) if flat.shape[1] else np.full(flat.shape[0], -np.inf)
+        else:
+            count = mask.sum(axis=1).astype(np.float64)
+            values = np.where(mask, flat, 0).astype(np.float64, copy=False)
+            total = values.sum(axis=1)
+            vmin = np.where(mask, flat, np.inf).min(axis=1).astype(np.float64)
+            vmax = np.where(mask, flat, -np.inf).max(axis=1).astype(np.float64)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, total / count, 0.0)
+        # Squared deviations from the tile mean (sum of squares minus count * mean^2 cancels on high means)
+        dev = flat.astype(np.float64) - mean[:, None]
+        if mask is not None:
+            dev[~mask] = 0.0
+        m2 = np.einsum('ij,ij->i', dev, dev)
+        return count, mean, m2, vmin, vmax
+
+    def merge(self, band_slice: slice, partial):
+        count, mean, m2, vmin, vmax = partial
+        n_a = self.count[band_slice]
+        n = n_a + count
+        delta = mean - self.mean[band_slice]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(n > 0, count / n, 0.0)
+        self.mean[band_slice] += delta * frac
+        self.m2[band_slice] += m2 + delta * delta * n_a * frac
+        self.count[band_slice] = n
+        np.minimum(self.min[band_slice], vmin, out=self.min[band_slice])
+        np.maximum(self.max[band_slice], vmax, out=self.max[band_slice])
+
+    def std(self) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(np.where(self.count > 0, self.m2 / self.count, 0.0))
+
+
+class BandStatistics:
+    """
+    Per-band statistics of a cube: valid pixel count, min, max, mean, std, counts
+    of zero and negative values, and a histogram of `bins` equal bins between
+    `hist_lo` and `hist_hi`. The histogram range comes from a strided sample, so
+    the rare values outside it are counted in the first or last bin; percentiles
+    read from it are accurate to about one bin.
+    """
+
+    def __init__(self, running: RunningBandStatistics, zeros: np.ndarray, negatives: np.ndarray,
+                 histogram: np.ndarray, hist_lo: np.ndarray, hist_hi: np.ndarray, num_pixels: int):
+        self.count = running.count.astype(np.int64)
+        valid = self.count > 0
+        self.min = np.where(valid, running.min, np.nan)
+        self.max = np.where(valid, running.max, np.nan)
+        self.mean = np.where(valid, running.mean, np.nan)
+        self.std = np.where(valid, running.std(), np.nan)
+        self.zeros = zeros
+        self.negatives = negatives
+        self.histogram = histogram
+        self.hist_lo = hist_lo
+        self.hist_hi = hist_hi
+        self.num_pixels = num_pixels
+
+    @property
+    def num_bands(self) -> int:
+        return self.count.size
+
+    @property
+    def invalid(self) -> np.ndarray:
+        """Per-band number of NaN, infinite or nodata pixels."""
+        return self.num_pixels - self.count
+
+    def percentiles(self, q: Sequence[float], bands: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Percentiles `q` (0-100) of the valid values of each band, interpolated
+        within histogram bins. Returns a (bands, len(q)) array; NaN for empty bands.
+        """
+        bands = np.arange(self.num_bands) if bands is None else np.asarray(bands, dtype=np.intp)
+        hist = self.histogram[bands]
+        cum = np.cumsum(hist, axis=1)
+        total = cum[:, -1]
+        nbins = hist.shape[1]
+        width = (self.hist_hi[bands] - self.hist_lo[bands]) / nbins
+        rows = np.arange(bands.size)
+        out = np.empty((bands.size, len(q)), dtype=np.float64)
+        for j, p in enumerate(q):
+            target = total * (float(p) / 100.0)
+            k = np.minimum((cum < target[:, None]).sum(axis=1), nbins - 1)
+            before = np.where(k > 0, cum[rows, k - 1], 0)
+            in_bin = hist[rows, k]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                frac = np.where(in_bin > 0, (target - before) / in_bin, 0.0)
+            out[:, j] = np.clip(self.hist_lo[bands] + (k + frac) * width, self.min[bands], self.max[bands])
+        out[total == 0] = np.nan
+        return out
+
+
+def _band_major(block: np.ndarray) -> np.ndarray:
+    """(bands, pixels) view of a (rows, cols, bands) block; no copy for BSQ or BIP layouts."""
+    return np.moveaxis(block, 2, 0).reshape(block.shape[2], -1)
+
+
+def _histogram_range(data: np.ndarray, nodata: Optional[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-band (lo, hi) of a strided sample of the valid values."""
+    h, w, num_bands = data.shape
+    step = max(1, int(np.sqrt(h * w * num_bands / _RANGE_SAMPLE_VALUES)))
+    flat = _band_major(data[::step, ::step])
+    mask = valid_mask(flat, nodata)
+    if mask is None:
+        lo, hi = flat.min(axis=1).astype(np.float64), flat.max(axis=1).astype(np.float64)
+    else:
+        lo = np.where(mask, flat, np.inf).min(axis=1).astype(np.float64)
+        hi = np.where(mask, flat, -np.inf).max(axis=1).astype(np.float64)
+    empty = ~np.isfinite(lo)
+    lo[empty], hi[empty] = 0.0, 1.0
+    return lo, hi
+
+
+def _chunk_statistics(block: np.ndarray, nodata: Optional[float], lo: np.ndarray, scale: np.ndarray, bins: int):
+    flat = _band_major(block)
+    num_bands = flat.shape[0]
+    mask = valid_mask(flat, nodata)
+    moments = RunningBandStatistics.of_tile(flat, nodata, mask)
+
+    zero, negative = (flat == 0), (flat < 0)
+    if mask is not None:
+        zero &= mask
+        negative &= mask
+    zeros = np.count_nonzero(zero, axis=1)
+    negatives = np.count_nonzero(negative, axis=1)
+
+    # One bincount for every band: bin index offset by band
+    with np.errstate(invalid='ignore'):
+        index = ((flat - lo[:, None]) * scale[:, None]).astype(np.intp)
+    np.clip(index, 0, bins - 1, out=index)
+    index += (np.arange(num_bands, dtype=np.intp) * bins)[:, None]
+    if mask is not None:
+        index = index[mask]
+    histogram = np.bincount(index.ravel(), minlength=num_bands * bins).reshape(num_bands, bins)
+    return moments, zeros, negatives, histogram
+
+
+def compute_band_statistics(data: np.ndarray, nodata: Optional[float] = None, bins: int = DEFAULT_BINS,
+                            chunk_bytes: int = DEFAULT_CHUNK_BYTES, num_workers: Optional[int] = None,
+                            progress_callback: Optional[Callable[[int, int], None]] = None) -> BandStatistics:
+    """
+    Statistics of every band of a (rows, cols, bands) cube in one chunked pass.
+    Chunks of rows are reduced on a thread pool (NumPy releases the GIL) and
+    merged in order; no masked copy of a band is ever made.
+
+    Args:
+        data: The (rows, cols, bands) cube, in any layout and dtype.
+        nodata: Value to ignore besides NaN and infinities.
+        bins: Number of histogram bins per band.
+        chunk_bytes: Approximate native bytes per chunk.
+        num_workers: Threads (default: CPU count, at most 8).
+        progress_callback: Called as progress_callback(done_chunks, total_chunks).
+    """
+    start = time.time()
+    if data.ndim == 2:
+        data = data[:, :, np.newaxis]
+    h, w, num_bands = data.shape
+    lo, hi = _histogram_range(data, nodata)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(hi > lo, bins / (hi - lo), 0.0)
+    # Values equal to hi land in the last bin
+    scale *= 1.0 - 1e-12
+
+    rows = max(1, chunk_bytes // max(w * num_bands * data.dtype.itemsize, 1))
+    chunks = [(y, min(y + rows, h)) for y in range(0, h, rows)]
+    running = RunningBandStatistics(num_bands)
+    zeros = np.zeros(num_bands, dtype=np.int64)
+    negatives = np.zeros(num_bands, dtype=np.int64)
+    histogram = np.zeros((num_bands, bins), dtype=np.int64)
+
+    num_workers = num_workers or min(8, os.cpu_count() or 1)
+    everything = slice(None)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = [pool.submit(_chunk_statistics, data[y0:y1], nodata, lo, scale, bins) for y0, y1 in chunks]
+        for done, future in enumerate(futures, start=1):
+            moments, z, n, hist = future.result()
+            running.merge(everything, moments)
+            zeros += z
+            negatives += n
+            histogram += hist
+            if progress_callback:
+                progress_callback(done, len(chunks))
+
+    stats = BandStatistics(running, zeros, negatives, histogram, lo, hi, h * w)
+    logger.info(f"Band statistics of {h}x{w}x{num_bands} ({data.dtype}) in {len(chunks)} chunks "
+                f"with {num_workers} threads in {time.time() - start:.2f}s")
+    return stats
+
+
+def _resolve(source: Union[np.ndarray, dict]) -> Tuple[np.ndarray, Optional[float], Hashable]:
+    """(data, nodata, cache key) of a layer dict or a bare cube."""
+    if isinstance(source, dict):
+        data = source['data']
+        nodata = (source.get('metadata') or {}).get('NoData')
+        nodata = float(nodata) if nodata is not None else None
+        version = source.get('version', 0)
+    else:
+        data, nodata, version = source, None, 0
+    key = (id(data), data.shape, data.strides, str(data.dtype), version, nodata)
+    return data, nodata, key
+
+
+def _lookup(key: Hashable) -> Optional[BandStatistics]:
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    if entry[1]() is None:
+        # The array is gone and its id may have been reused
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return entry[0]
+
+
+def _store(key: Hashable, data: np.ndarray, stats: BandStatistics):
+    with _cache_lock:
+        _cache[key] = (stats, weakref.ref(data))
+        while len(_cache) > _MAX_CACHED_STATISTICS:
+            _cache.popitem(last=False)
+
+
+def cached_band_statistics(source: Union[np.ndarray, dict]) -> Optional[BandStatistics]:
+    """Statistics of a layer (or cube) if they are already computed, without blocking."""
+    _, _, key = _resolve(source)
+    with _cache_lock:
+        return _lookup(key)
+
+
+def request_band_statistics(source: Union[np.ndarray, dict]) -> Future:
+    """
+    Statistics of a layer (or cube) computed in the background. Returns a future;
+    repeated requests for the same data share one computation, and statistics
+    that are already cached come back as a completed future. Code that edits a
+    layer's data in place must increment `layer['version']`.
+    """
+    data, nodata, key = _resolve(source)
+    with _cache_lock:
+        stats = _lookup(key)
+        if stats is not None:
+            future = Future()
+            future.set_result(stats)
+            return future
+        future = _pending.get(key)
+        if future is not None:
+            return future
+
+        def compute():
+            try:
+                stats = compute_band_statistics(data, nodata)
+                _store(key, data, stats)
+                return stats
+            finally:
+                with _cache_lock:
+                    _pending.pop(key, None)
+
+        future = _background.submit(compute)
+        _pending[key] = future
+        return future
+
+
+def get_band_statistics(source: Union[np.ndarray, dict]) -> BandStatistics:
+    """Statistics of a layer (or cube), blocking until they are available."""
+    return request_band_statistics(source).result()
@@ -0,0 +1,82 @@
+# src/core/component_transform.py
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import numpy as np
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# Native bytes of the input rows transformed at a time
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def _transform_block(block: np.ndarray, mean: np.ndarray, transform: np.ndarray,
+                     out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    (block - mean) @ transform in float32 for a (rows, cols, bands) block, NaN
+    counting as 0. `out`, if given, is a (rows, cols, components) float32 array.
+    """
+    rows, cols, bands = block.shape
+    pixels = np.array(block, dtype=np.float32, order='C').reshape(-1, bands)  # a copy: edited in place
+    np.nan_to_num(pixels, copy=False, nan=0.0)
+    pixels -= mean
+    if out is not None and out.flags.c_contiguous:
+        np.matmul(pixels, transform, out=out.reshape(-1, transform.shape[1]))
+        return out
+    result = (pixels @ transform).reshape(rows, cols, transform.shape[1])
+    if out is not None:
+        out[...] = result
+        return out
+    return result
+
+
+def forward_transform(data: np.ndarray, mean: np.ndarray, transform: np.ndarray,
+                      num_components: Optional[int] = None, out: Optional[np.ndarray] = None,
+                      chunk_bytes: int = DEFAULT_CHUNK_BYTES, num_workers: Optional[int] = None,
+                      progress_callback: Optional[Callable[[int, int], None]] = None) -> np.ndarray:
+    """
+    Components (x - mean) @ transform[:, :num_components] of every pixel of a
+    (rows, cols, bands) cube, computed chunk of rows by chunk of rows in float32
+    on a thread pool and written straight into the output. Only the kept
+    columns of the transform are applied, so time and memory scale with
+    `num_components` rather than with the number of bands.
+
+    Args:
+        data: The (rows, cols, bands) cube, in any layout and dtype.
+        mean: Band means (bands,).
+        transform: (bands, components) forward transform.
+        num_components: Leading components to compute (default: all).
+        out: Optional preallocated (rows, cols, num_components) float32 output.
+        chunk_bytes: Approximate native bytes of input per chunk.
+        num_workers: Threads (default: CPU count, at most 8).
+        progress_callback: Called as progress_callback(done_chunks, total_chunks).
+
+    Returns:
+        The (rows, cols, num_components) float32 components.
+    """
+    start = time.time()
+    h, w, bands = data.shape
+    k = transform.shape[1] if num_components is None else min(num_components, transform.shape[1])
+    P = np.ascontiguousarray(transform[:, :k], dtype=np.float32)
+    mu = np.asarray(mean, dtype=np.float32)
+    if out is None:
+        out = np.empty((h, w, k), dtype=np.float32)
+    rows = max(1, chunk_bytes // max(w * bands * data.dtype.itemsize, 1))
+    chunks = [(y, min(y + rows, h)) for y in range(0, h, rows)]
+
+    num_workers = num_workers or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = [pool.submit(lambda y0, y1: _transform_block(data[y0:y1], mu, P, out[y0:y1]), y0, y1)
+                   for y0, y1 in chunks]
+        for done, future in enumerate(futures, start=1):
+            future.result()
+            if progress_callback:
+                progress_callback(done, len(chunks))
+    logger.info(f"Transformed {h}x{w}x{bands} to {k} components in {len(chunks)} chunks "
+                f"with {num_workers} threads in {time.time() - start:.2f}s")
+    return out
+
@@ -0,0 +1,279 @@
+# src/core/covariance.py
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# Native bytes of one chunk of rows; its float64 temporaries are a few times larger
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Subsampled statistics: mode -> description
+SAMPLING_MODES = {
+    'grid': "Stratified spatial grid",
+    'blocks': "Random blocks",
+}
+DEFAULT_SAMPLE_FRACTION = 0.05
+# Side (pixels) of the blocks of the 'blocks' mode
+DEFAULT_SAMPLE_BLOCK = 64
+
+
+class RunningCovariance:
+    """
+    Running mean and scatter (co-moment) matrix of pixel vectors, merged chunk
+    by chunk with the pairwise update of Chan et al., so that the result does not
+    suffer from the cancellation of a one-pass sum of squares.
+    """
+
+    def __init__(self, num_bands: int):
+        self.count = 0
+        self.mean = np.zeros(num_bands, dtype=np.float64)
+        self.scatter = np.zeros((num_bands, num_bands), dtype=np.float64)
+
+    @staticmethod
+    def of_pixels(pixels: np.ndarray) -> Tuple[int, np.ndarray, np.ndarray]:
+        """Partial (count, mean, scatter) of a (pixels, bands) float64 array."""
+        count = pixels.shape[0]
+        if count == 0:
+            return 0, np.zeros(pixels.shape[1]), np.zeros((pixels.shape[1], pixels.shape[1]))
+        mean = pixels.mean(axis=0)
+        centered = pixels - mean
+        return count, mean, centered.T @ centered
+
+    def merge(self, partial: Tuple[int, np.ndarray, np.ndarray]):
+        count, mean, scatter = partial
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.scatter += scatter + np.outer(delta, delta) * (self.count * count / total)
+        self.mean += delta * (count / total)
+        self.count = total
+
+    def covariance(self, ddof: int = 1) -> np.ndarray:
+        """The (bands, bands) covariance matrix."""
+        return self.scatter / max(1, self.count - ddof)
+
+
+def _partials(pixels: np.ndarray, diff: Optional[np.ndarray]):
+    """
+    Signal partial of (pixels, bands) float64 pixels and noise partial of their
+    (pairs, bands) differences with the pixels below them (None: no noise).
+    Vectors with a non-finite value in any band are left out.
+    """
+    finite = np.isfinite(pixels).all(axis=1)
+    signal = RunningCovariance.of_pixels(pixels if finite.all() else pixels[finite])
+    invalid = pixels.shape[0] - int(finite.sum())
+    if diff is None:
+        return signal, None, invalid
+    finite_diff = np.isfinite(diff).all(axis=1)
+    return signal, RunningCovariance.of_pixels(diff if finite_diff.all() else diff[finite_diff]), invalid
+
+
+def _chunk_partials(data: np.ndarray, y0: int, y1: int, noise: bool):
+    """Partials of rows [y0, y1), the differences reaching one row past y1."""
+    block = np.asarray(data[y0:min(y1 + 1, data.shape[0]) if noise else y1], dtype=np.float64)
+    num_bands = block.shape[2]
+    diff = (block[1:] - block[:-1]).reshape(-1, num_bands) if noise else None
+    return _partials(block[:y1 - y0].reshape(-1, num_bands), diff)
+
+
+def _grid_partials(data: np.ndarray, rows: np.ndarray, x0: int, step: int, noise: bool):
+    """Partials of every `step`-th pixel from column x0 of the given rows."""
+    num_bands = data.shape[2]
+    top = np.asarray(data[rows, x0::step], dtype=np.float64)
+    diff = None
+    if noise:
+        # Rows are sorted: those with a row below them come first
+        paired = rows[rows + 1 < data.shape[0]]
+        below = np.asarray(data[paired + 1, x0::step], dtype=np.float64)
+        diff = (below - top[:len(paired)]).reshape(-1, num_bands)
+    return _partials(top.reshape(-1, num_bands), diff)
+
+
+def _accumulate(tasks: List[Tuple], num_bands: int, noise: bool, num_workers: int,
+                progress_callback: Optional[Callable[[int, int], None]]):
+    """Runs (function, *args) partial tasks on a thread pool and merges them in order."""
+    signal = RunningCovariance(num_bands)
+    shift = RunningCovariance(num_bands) if noise else None
+    skipped = 0
+    pending = deque()
+
+    def collect():
+        nonlocal skipped
+        signal_partial, noise_partial, invalid = pending.popleft().result()
+        signal.merge(signal_partial)
+        if shift is not None:
+            shift.merge(noise_partial)
+        skipped += invalid
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for done, task in enumerate(tasks):
+            pending.append(pool.submit(*task))
+            # A bounded number of chunks in flight keeps memory flat
+            if len(pending) >= 2 * num_workers:
+                collect()
+                if progress_callback:
+                    progress_callback(done + 1 - len(pending), len(tasks))
+        while pending:
+            collect()
+            if progress_callback:
+                progress_callback(len(tasks) - len(pending), len(tasks))
+
+    if signal.count == 0:
+        raise ValueError("Covariance estimation failed: no pixel is finite in every band.")
+    if shift is not None and shift.count == 0:
+        raise ValueError("Noise estimation failed (NaNs everywhere after diff).")
+    return signal, shift, skipped
+
+
+def compute_covariance(data: np.ndarray, noise: bool = True, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                       num_workers: Optional[int] = None,
+                       progress_callback: Optional[Callable[[int, int], None]] = None
+                       ) -> Tuple[RunningCovariance, Optional[RunningCovariance]]:
+    """
+    Mean and covariance of the pixels of a (rows, cols, bands) cube and, with
+    `noise`, of its shift differences (each pixel minus the one below it, the
+    noise estimate used by MNF), in one chunked pass.
+
+    Chunks of rows (plus one overlapping row for the differences) are converted
+    to float64 and reduced on a thread pool; at most a few chunks are in flight,
+    so memory stays at the (bands, bands) matrices plus a few chunks whatever
+    the size or dtype of the cube. Pixels with a non-finite value in any band
+    are ignored.
+
+    Args:
+        data: The (rows, cols, bands) cube, in any layout and dtype.
+        noise: Whether to accumulate the shift-difference covariance as well.
+        chunk_bytes: Approximate native bytes per chunk.
+        num_workers: Threads (default: CPU count, at most 8).
+        progress_callback: Called as progress_callback(done_chunks, total_chunks).
+
+    Returns:
+        (signal, noise) running covariances; noise is None without `noise`.
+    """
+    start = time.time()
+    h, w, num_bands = data.shape
+    rows = max(1, chunk_bytes // max(w * num_bands * data.dtype.itemsize, 1))
+    # The differences of a chunk's last row need the first row of the next one
+    tasks = [(_chunk_partials, data, y, min(y + rows, h), noise) for y in range(0, h, rows)]
+    num_workers = num_workers or min(8, os.cpu_count() or 1)
+    signal, shift, skipped = _accumulate(tasks, num_bands, noise, num_workers, progress_callback)
+    logger.info(f"Covariance{' and noise covariance' if noise else ''} of {h}x{w}x{num_bands} ({data.dtype}) "
+                f"in {len(tasks)} chunks with {num_workers} threads in {time.time() - start:.2f}s "
+                f"({skipped} pixels with non-finite values ignored)")
+    return signal, shift
+
+
+def compute_sampled_covariance(data: np.ndarray, fraction: float = DEFAULT_SAMPLE_FRACTION, mode: str = 'grid',
+                               seed: int = 0, noise: bool = True, block_size: int = DEFAULT_SAMPLE_BLOCK,
+                               chunk_bytes: int = DEFAULT_CHUNK_BYTES, num_workers: Optional[int] = None,
+                               progress_callback: Optional[Callable[[int, int], None]] = None
+                               ) -> Tuple[RunningCovariance, Optional[RunningCovariance]]:
+    """
+    Like `compute_covariance`, from a spatial sample of about `fraction` of the pixels.
+
+    - 'grid': every k-th pixel of every k-th row (k = 1 / sqrt(fraction)), from a
+      random offset, so every part of the scene is represented.
+    - 'blocks': randomly chosen, non-overlapping block_size x block_size blocks,
+      which read faster from tiled or chunked storage.
+
+    Noise differences pair each sampled pixel with the pixel below it. The sample
+    depends only on `seed`, the cube size and the settings. A fraction of 1 or
+    more uses every pixel.
+
+    Returns:
+        (signal, noise) running covariances; noise is None without `noise`.
+    """
+    if fraction >= 1:
+        return compute_covariance(data, noise, chunk_bytes, num_workers, progress_callback)
+    if mode not in SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling mode '{mode}'. Use one of: {', '.join(SAMPLING_MODES)}.")
+    start = time.time()
+    h, w, num_bands = data.shape
+    rng = np.random.default_rng(seed)
+
+    if mode == 'grid':
+        step = max(1, int(round(1.0 / np.sqrt(fraction))))
+        y_offset, x_offset = (int(v) for v in rng.integers(0, step, size=2))
+        rows = np.arange(min(y_offset, h - 1), h, step)
+        cols = len(range(min(x_offset, w - 1), w, step))
+        per_task = max(1, chunk_bytes // max(cols * num_bands * data.dtype.itemsize, 1))
+        tasks = [(_grid_partials, data, rows[i:i + per_task], min(x_offset, w - 1), step, noise)
+                 for i in range(0, len(rows), per_task)]
+    else:
+        ny, nx = -(-h // block_size), -(-w // block_size)
+        count = min(ny * nx, max(1, int(round(fraction * ny * nx))))
+        cells = np.sort(rng.choice(ny * nx, size=count, replace=False))
+        tasks = []
+        for cell in cells:
+            y0, x0 = (int(cell) // nx) * block_size, (int(cell) % nx) * block_size
+            y1, x1 = min(y0 + block_size, h), min(x0 + block_size, w)
+            tasks.append((_chunk_partials, data[:, x0:x1], y0, y1, noise))
+
+    num_workers = num_workers or min(8, os.cpu_count() or 1)
+    signal, shift, skipped = _accumulate(tasks, num_bands, noise, num_workers, progress_callback)
+    logger.info(f"Sampled covariance ({SAMPLING_MODES[mode].lower()}, {signal.count} of {h * w} pixels) "
+                f"of {h}x{w}x{num_bands} in {time.time() - start:.2f}s ({skipped} pixels with non-finite "
+                f"values ignored)")
+    return signal, shift
+
+
+def mnf_decomposition(signal_cov: np.ndarray, noise_cov: np.ndarray,
+                      eps: float = 1e-8) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Eigenvalues (signal-to-noise ratios, descending) and (bands, bands) forward
+    transform P of the MNF: components are (x - mean) @ P.
+    """
+    ew, Ev = np.linalg.eigh(noise_cov)
+    ew = np.clip(ew, eps, None)
+    Cn_inv_sqrt = Ev @ np.diag(1.0 / np.sqrt(ew)) @ Ev.T
+    lam, E = np.linalg.eigh(Cn_inv_sqrt @ signal_cov @ Cn_inv_sqrt.T)
+    idx = np.argsort(lam)[::-1]
+    return lam[idx], Cn_inv_sqrt.T @ E[:, idx]
+
+
+def pca_decomposition(signal_cov: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Eigenvalues (variances, descending) and (bands, bands) forward transform of the PCA."""
+    lam, E = np.linalg.eigh(signal_cov)
+    idx = np.argsort(lam)[::-1]
+    return lam[idx], E[:, idx]
+
+
+class SamplingDiagnostics:
+    """
+    Agreement of the leading components estimated from a sample with those from
+    a larger (reference) sample: relative eigenvalue errors, the |cosine| between
+    matching component directions, and the mean squared cosine of the principal
+    angles between the subspaces spanned by the first `num_components`.
+    """
+
+    def __init__(self, eigenvalues: np.ndarray, transform: np.ndarray, reference_eigenvalues: np.ndarray,
+                 reference_transform: np.ndarray, fraction: float, reference_fraction: float,
+                 num_components: int = 10):
+        k = max(1, min(num_components, len(eigenvalues)))
+        self.fraction = fraction
+        self.reference_fraction = reference_fraction
+        self.num_components = k
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.eigenvalue_error = np.abs(eigenvalues[:k] - reference_eigenvalues[:k]) / np.abs(reference_eigenvalues[:k])
+        a = transform[:, :k] / np.linalg.norm(transform[:, :k], axis=0)
+        b = reference_transform[:, :k] / np.linalg.norm(reference_transform[:, :k], axis=0)
+        self.eigenvector_similarity = np.abs(np.sum(a * b, axis=0))
+        cosines = np.linalg.svd(np.linalg.qr(a)[0].T @ np.linalg.qr(b)[0], compute_uv=False)
+        self.subspace_similarity = float(np.mean(np.clip(cosines, 0, 1) ** 2))
+
+    def summary(self) -> str:
+        first = min(3, self.num_components)
+        return (f"Sample of {self.fraction:.1%} vs {self.reference_fraction:.1%} of the pixels, "
+                f"first {self.num_components} components: eigenvalues within "
+                f"{np.nanmax(self.eigenvalue_error):.2%} (worst), eigenvector |cos| >= "
+                f"{self.eigenvector_similarity[:first].min():.4f} for the first {first} and >= "
+                f"{self.eigenvector_similarity.min():.4f} overall, subspace similarity "
+                f"{self.subspace_similarity:.4f}")
@@ -0,0 +1,347 @@
+# src/core/expression_cache.py
+import ast
+import copy
+import logging
+import operator
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.core.band_math import (
+    DEFAULT_TILE_BYTES, BandMathExpression, BatchBandMath, _CommutativeOrder, _is_shareable, _parse_elementwise
+)
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# Memory held by cached band loads, subterms and results together
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024
+# Entries larger than this fraction of the budget are not cached (they would evict everything)
+_MAX_ENTRY_FRACTION = 0.25
+
+_FOLDABLE_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+    ast.USub: operator.neg, ast.UAdd: operator.pos,
+}
+
+
+def layer_version(layer: dict) -> Tuple:
+    """
+    Identifies the current contents of a layer: its file, the identity and layout
+    of its data array and an optional `version` counter. Code that edits a layer's
+    data in place must increment `layer['version']`.
+    """
+    data = layer['data']
+    return (layer.get('file_path'), id(data), data.shape, data.strides, str(data.dtype), layer.get('version', 0))
+
+
+def band_key(layer: dict, band_index: int, grid_key: Hashable, resampling: str) -> Tuple:
+    """Cache key of one band of `layer` read onto a grid with a resampling method."""
+    return ('band', layer_version(layer), int(band_index), grid_key, resampling)
+
+
+class ExpressionCache:
+    """
+    LRU cache of float32 arrays (band loads, subexpression and expression results)
+    under a memory budget. Entries keep weak references to the layer data they were
+    computed from and are dropped once any of it is gone, so a recycled object id
+    can never produce a stale hit.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[np.ndarray, List[weakref.ref]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def accepts(self, nbytes: int) -> bool:
+        """Whether an array of `nbytes` is small enough to be cached."""
+        return nbytes <= self.max_bytes * _MAX_ENTRY_FRACTION
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and any(ref() is None for ref in entry[1]):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, array: np.ndarray, sources: Sequence[np.ndarray] = ()):
+        """Caches `array` (which the cache then owns) computed from the `sources` arrays."""
+        if not self.accepts(array.nbytes):
+            return
+        refs = [weakref.ref(source) for source in sources]
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (array, refs)
+            self.nbytes += array.nbytes
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable):
+        array, _ = self._entries.pop(key)
+        self.nbytes -= array.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_cache = ExpressionCache()
+
+
+def get_expression_cache() -> ExpressionCache:
+    """The process-wide expression cache used by the raster calculator."""
+    return _cache
+
+
+class _ConstantFolder(ast.NodeTransformer):
+    """Folds arithmetic on numeric literals, e.g. `2 * 0.25` -> `0.5`."""
+
+    @staticmethod
+    def _number(node) -> bool:
+        return isinstance(node, ast.Constant) and type(node.value) in (int, float)
+
+    def _fold(self, node, op, *operands):
+        try:
+            value = _FOLDABLE_OPERATORS[type(op)](*(o.value for o in operands))
+        except (KeyError, ArithmeticError, ValueError):
+            return node
+        # Keep huge integers and non-finite results out of the expression text
+        if type(value) not in (int, float) or not np.isfinite(value) or abs(value) > 2 ** 63:
+            return node
+        return ast.copy_location(ast.Constant(value=value), node)
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if self._number(node.left) and self._number(node.right):
+            return self._fold(node, node.op, node.left, node.right)
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if self._number(node.operand):
+            return self._fold(node, node.op, node.operand)
+        return node
+
+
+class _Rename(ast.NodeTransformer):
+    """Renames variables (not functions) through a mapping."""
+
+    def __init__(self, mapping: Dict[str, str]):
+        self.mapping = mapping
+
+    def visit_Call(self, node):
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_Name(self, node):
+        return ast.copy_location(ast.Name(id=self.mapping.get(node.id, node.id), ctx=ast.Load()), node)
+
+
+def _constant_free(node: ast.AST) -> bool:
+    return not any(isinstance(child, ast.Constant) for child in ast.walk(node))
+
+
+class CachedBandMath:
+    """
+    A raster calculator expression evaluated through an `ExpressionCache`.
+
+    The expression is canonicalized before it is looked up: literal arithmetic is
+    folded, variables are replaced by the identity of the band they read (layer
+    version, band, grid, resampling) and the operands of + and * are ordered.
+    Besides the final result, the cache keeps the float32 band loads and the
+    largest constant-free subterms (e.g. `b50 - b30` and `b50 + b30` in
+    `(b50 - b30) / (b50 + b30 + 0.5)`), so re-running an expression after
+    changing one of its constants only evaluates the outer kernel. Expressions
+    with whole-image reductions are cached as a whole. Cached subterms hold their
+    raw values (NaN and infinities included); with nodata, their validity mask
+    is cached next to them, so expressions reusing them mask the same pixels as
+    a fresh evaluation. Full-size band and subterm arrays are only kept when the
+    cache accepts arrays of the output's size.
+
+    Args:
+        expression: Expression over plain variable names (as for `BandMathExpression`).
+        band_keys: For every variable, the `band_key` of the band it reads.
+        cache: The cache to use (default: the process-wide one).
+        nodata: Variables whose NaN and nodata pixels (None: NaN only) are invalid.
+        fill_value: Output value of invalid pixels and of NaN or infinite results.
+    """
+
+    def __init__(self, expression: str, band_keys: Dict[str, Tuple],
+                 cache: Optional[ExpressionCache] = None,
+                 nodata: Optional[Dict[str, Optional[float]]] = None, fill_value: float = 0.0):
+        self.expression = expression
+        self.variables = list(band_keys)
+        self.band_keys = band_keys
+        self.cache = cache if cache is not None else get_expression_cache()
+        self.nodata = {var: value for var, value in (nodata or {}).items() if var in band_keys}
+        self.fill_value = fill_value
+
+        tree = _parse_elementwise(expression, self.variables)
+        self.elementwise = tree is not None
+        if tree is None:
+            tree = ast.parse(expression.strip(), mode='eval')
+        tree = _ConstantFolder().visit(tree)
+        # Band identities as names: equal expressions over the same bands dump equally
+        self._identity = {var: repr(key) for var, key in band_keys.items()}
+        tree = _Rename(self._identity).visit(tree)
+        if self.elementwise:
+            tree = _CommutativeOrder().visit(tree)
+        self._tree = tree
+        # Which bands are masked (and how) changes every result computed from them
+        self._masking = tuple(sorted((self._identity[var], repr(value)) for var, value in self.nodata.items()))
+        self.key = ('expr', self.elementwise, ast.dump(tree), self._masking, repr(fill_value))
+
+    def evaluate(self, readers: Dict[str, Callable[[int, int], np.ndarray]], sources: Dict[str, np.ndarray],
+                 height: int, width: int, out: Optional[np.ndarray] = None,
+                 tile_bytes: int = DEFAULT_TILE_BYTES,
+                 progress_callback: Optional[Callable[[int, int], None]] = None) -> np.ndarray:
+        """
+        Evaluates the expression over a height x width grid, reusing cached results.
+
+        Args:
+            readers: For every variable, a function reading rows [y0, y1) of its band.
+            sources: For every variable, the layer data array the band comes from.
+            height, width: Size of the output grid.
+            out: Optional preallocated (height, width) float32 output.
+            tile_bytes: Approximate memory budget of one tile.
+            progress_callback: Called as progress_callback(done_steps, total_steps).
+
+        Returns:
+            The (height, width) float32 result.
+        """
+        start = time.time()
+        if out is None:
+            out = np.empty((height, width), dtype=np.float32)
+        all_sources = list({id(a): a for a in sources.values()}.values())
+
+        cached = self.cache.get(self.key)
+        if cached is not None:
+            out[...] = cached
+            if progress_callback:
+                progress_callback(1, 1)
+            logger.info(f"Reused the cached result of '{self.expression}'")
+            return out
+
+        if not self.elementwise:
+            BandMathExpression(self.expression, self.variables).evaluate(
+                readers, height, width, out=out, tile_bytes=tile_bytes, progress_callback=progress_callback,
+                nodata=self.nodata, fill_value=self.fill_value
+            )
+        else:
+            self._evaluate_elementwise(readers, sources, height, width, out, tile_bytes, progress_callback)
+        # The caller owns `out`: the cache keeps its own copy, if the result fits
+        if self.cache.accepts(out.nbytes):
+            self.cache.put(self.key, np.array(out, dtype=np.float32, order='C'), all_sources)
+        logger.info(f"Evaluated '{self.expression}' through the expression cache in {time.time() - start:.2f}s "
+                    f"(cache: {len(self.cache)} entries, {self.cache.nbytes / 1e6:.0f} MB)")
+        return out
+
+    def _evaluate_elementwise(self, readers, sources, height, width, result, tile_bytes, progress_callback):
+        names: Dict[str, str] = {}          # identity or subterm key -> evaluation variable
+        inputs: Dict[str, Callable] = {}    # evaluation variable -> tile reader
+        band_loads: Dict[str, Tuple] = {}   # band variables read fresh -> (full array, key, source)
+        subterm_valid: Dict[str, Callable] = {}  # cached subterms -> reader of their validity mask
+        reverse = {identity: var for var, identity in self._identity.items()}
+        # Full-size arrays (stored subterms, kept band loads) only for what the cache will take
+        cacheable = self.cache.accepts(height * width * 4)
+
+        def plan(node, is_root: bool):
+            # Cached subterms become inputs; the largest constant-free ones not cached yet are stored
+            if not is_root and _is_shareable(node):
+                key = ('expr', True, ast.dump(node), self._masking)
+                array = self.cache.get(key)
+                # With nodata, a subterm is only usable together with its validity mask
+                mask = self.cache.get(('valid', key)) if array is not None and self._masking else None
+                if array is not None and (mask is not None or not self._masking):
+                    var = names.setdefault(key, f"_m{len(names)}")
+                    inputs[var] = lambda y0, y1, a=array: a[y0:y1]
+                    if mask is not None:
+                        subterm_valid[var] = lambda y0, y1, m=mask: m[y0:y1]
+                    return ast.Name(id=var, ctx=ast.Load()), []
+                if cacheable and _constant_free(node):
+                    fresh = copy.deepcopy(node)
+                    fresh, _ = plan_children(fresh)
+                    return fresh, [(key, fresh)]
+            return plan_children(node)
+
+        def plan_children(node):
+            stored = []
+            for field, value in ast.iter_fields(node):
+                if isinstance(value, list):
+                    new = []
+                    for v in value:
+                        if isinstance(v, ast.expr):
+                            v, s = plan(v, False)
+                            stored.extend(s)
+                        new.append(v)
+                    setattr(node, field, new)
+                elif isinstance(value, ast.expr):
+                    value, s = plan(value, False)
+                    stored.extend(s)
+                    setattr(node, field, value)
+            return node, stored
+
+        final, subterms = plan(copy.deepcopy(self._tree), True)
+
+        # Band loads: cached ones are read from memory, the others are kept as they stream past
+        used = {node.id for tree in [final] + [t for _, t in subterms] for node in ast.walk(tree)
+                if isinstance(node, ast.Name) and node.id in reverse}
+        for identity in used:
+            var = reverse[identity]
+            key = self.band_keys[var]
+            array = self.cache.get(key)
+            if array is None and cacheable:
+                array = np.empty((height, width), dtype=np.float32)
+                band_loads[var] = (array, key, sources[var])
+
+                def read(y0, y1, read=readers[var], array=array):
+                    array[y0:y1] = read(y0, y1)
+                    return array[y0:y1]
+                inputs[var] = read
+            elif array is None:
+                inputs[var] = readers[var]
+            else:
+                inputs[var] = lambda y0, y1, a=array: a[y0:y1]
+
+        rename = _Rename({identity: reverse[identity] for identity in used})
+        expressions = [ast.unparse(rename.visit(copy.deepcopy(tree))) for _, tree in subterms]
+        expressions.append(ast.unparse(rename.visit(final)))
+        outputs = [np.empty((height, width), dtype=np.float32) for _ in subterms] + [result]
+        masks = {i: np.empty((height, width), dtype=bool) for i in range(len(subterms))} if self._masking else {}
+
+        # Stored subterms keep their raw values whatever this expression's fill value; their
+        # validity (from the masked bands they read) is stored as a separate mask
+        BatchBandMath(expressions, list(inputs)).evaluate(
+            inputs, height, width, out=outputs, tile_bytes=tile_bytes, progress_callback=progress_callback,
+            nodata=self.nodata, fill_value=[None] * len(subterms) + [self.fill_value],
+            valid_readers=subterm_valid, valid_out=masks
+        )
+
+        for var, (array, key, source) in band_loads.items():
+            self.cache.put(key, array, [source])
+        all_sources = list({id(a): a for a in sources.values()}.values())
+        for i, ((key, _), array) in enumerate(zip(subterms, outputs)):
+            if i in masks:
+                self.cache.put(('valid', key), masks[i], all_sources)
+            self.cache.put(key, array, all_sources)
+        logger.debug(f"'{self.expression}': {len(names)} cached subterms reused, {len(subterms)} stored, "
+                     f"{len(used) - len(band_loads)} of {len(used)} bands from memory")
@@ -0,0 +1,119 @@
+# src/core/geo_transforms.py
+import logging
+import threading
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from osgeo import osr
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+_transform_cache = {}
+_transform_lock = threading.Lock()
+
+
+def _make_srs(wkt_or_epsg) -> osr.SpatialReference:
+    """Builds a SpatialReference (traditional GIS axis order) from WKT or an EPSG code."""
+    srs = osr.SpatialReference()
+    if isinstance(wkt_or_epsg, int):
+        srs.ImportFromEPSG(wkt_or_epsg)
+    else:
+        srs.ImportFromWkt(wkt_or_epsg)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def get_coordinate_transform(src, dst=4326) -> Optional[osr.CoordinateTransformation]:
+    """
+    Returns a cached CoordinateTransformation between two reference systems.
+
+    Building SpatialReference/CoordinateTransformation objects is expensive compared
+    to transforming a handful of points, so callers that transform on every mouse
+    event or for every tile should always go through this cache.
+
+    Args:
+        src: Source projection as WKT string or EPSG code.
+        dst: Target projection as WKT string or EPSG code (default WGS84).
+
+    Returns:
+        The transformation, or None if both systems are the same.
+    """
+    key = (src, dst)
+    with _transform_lock:
+        if key in _transform_cache:
+            return _transform_cache[key]
+
+    src_srs = _make_srs(src)
+    dst_srs = _make_srs(dst)
+    transform = None if src_srs.IsSame(dst_srs) else osr.CoordinateTransformation(src_srs, dst_srs)
+
+    with _transform_lock:
+        _transform_cache[key] = transform
+    logger.debug(f"Cached coordinate transformation ({len(_transform_cache)} entries)")
+    return transform
+
+
+def same_projection(proj_a: Optional[str], proj_b: Optional[str]) -> bool:
+    """True if two WKT strings describe the same CRS (or both are missing)."""
+    if not proj_a and not proj_b:
+        return True
+    if not proj_a or not proj_b:
+        return False
+    if proj_a == proj_b:
+        return True
+    return get_coordinate_transform(proj_a, proj_b) is None
+
+
+def pixel_to_map(geotransform: Sequence[float], cols, rows) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized GDAL affine transform from pixel/line to map coordinates.
+
+    Args:
+        geotransform: GDAL geotransform (x0, dx, rx, y0, ry, dy).
+        cols, rows: Pixel coordinates (scalars or arrays, broadcastable).
+
+    Returns:
+        (map_x, map_y) arrays.
+    """
+    gt0, gt1, gt2, gt3, gt4, gt5 = geotransform
+    cols = np.asarray(cols, dtype=np.float64)
+    rows = np.asarray(rows, dtype=np.float64)
+    return gt0 + cols * gt1 + rows * gt2, gt3 + cols * gt4 + rows * gt5
+
+
+def map_to_pixel(geotransform: Sequence[float], map_x, map_y) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized inverse of `pixel_to_map`.
+
+    Returns:
+        (cols, rows) as float arrays (fractional pixel coordinates).
+    """
+    gt0, gt1, gt2, gt3, gt4, gt5 = geotransform
+    det = gt1 * gt5 - gt2 * gt4
+    if det == 0:
+        raise ValueError("Geotransform is not invertible.")
+    dx = np.asarray(map_x, dtype=np.float64) - gt0
+    dy = np.asarray(map_y, dtype=np.float64) - gt3
+    cols = (gt5 * dx - gt2 * dy) / det
+    rows = (-gt4 * dx + gt1 * dy) / det
+    return cols, rows
+
+
+def transform_points(map_x, map_y, src_projection: Optional[str], dst_projection) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Transforms arrays of map coordinates between two projections using the cached
+    CoordinateTransformation. Returns the inputs unchanged if no transform is needed.
+    """
+    map_x = np.asarray(map_x, dtype=np.float64)
+    map_y = np.asarray(map_y, dtype=np.float64)
+    if not src_projection or not dst_projection:
+        return map_x, map_y
+    transform = get_coordinate_transform(src_projection, dst_projection)
+    if transform is None:
+        return map_x, map_y
+
+    shape = map_x.shape
+    points = np.column_stack([map_x.ravel(), map_y.ravel()])
+    result = np.asarray(transform.TransformPoints(points), dtype=np.float64)
+    return result[:, 0].reshape(shape), result[:, 1].reshape(shape)
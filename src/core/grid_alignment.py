@@ -0,0 +1,325 @@
+# src/core/grid_alignment.py
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from osgeo import gdal
+
+from src.core.geo_transforms import map_to_pixel, pixel_to_map, same_projection, transform_points
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# --- GDAL Exception Handling ---
+gdal.UseExceptions()
+
+RESAMPLING_METHODS = ('nearest', 'bilinear')
+DEFAULT_TILE_ROWS = 512
+_DEFAULT_GEOTRANSFORM = (0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+
+# Resampling index maps depend only on the source/target geometry, not on pixel values,
+# so they are cached at module level and shared by every reader of the same grids.
+# Per-tile maps of reprojected layers are 16 bytes per pixel: the cache is bounded by bytes.
+_MAX_CACHED_MAP_BYTES = 256 * 1024 * 1024
+# Maps larger than this fraction of the budget are rebuilt every time (they would evict everything)
+_MAX_MAP_FRACTION = 0.25
+_index_map_cache: "OrderedDict[Tuple, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+_index_map_bytes = 0
+_index_map_lock = threading.Lock()
+
+
+def _cached_index_map(key: Tuple, build):
+    global _index_map_bytes
+    with _index_map_lock:
+        cached = _index_map_cache.get(key)
+        if cached is not None:
+            _index_map_cache.move_to_end(key)
+            return cached
+    maps = build()
+    nbytes = sum(m.nbytes for m in maps)
+    if nbytes > _MAX_CACHED_MAP_BYTES * _MAX_MAP_FRACTION:
+        return maps
+    with _index_map_lock:
+        if key not in _index_map_cache:
+            _index_map_cache[key] = maps
+            _index_map_bytes += nbytes
+        while _index_map_bytes > _MAX_CACHED_MAP_BYTES:
+            _, old = _index_map_cache.popitem(last=False)
+            _index_map_bytes -= sum(m.nbytes for m in old)
+    return maps
+
+
+def layer_has_georef(layer: dict) -> bool:
+    """True if the layer carries a usable (non-default) geotransform."""
+    gt = layer.get("geotransform")
+    if not gt or len(gt) != 6:
+        return False
+    return not np.allclose(gt, _DEFAULT_GEOTRANSFORM)
+
+
+class ReferenceGrid:
+    """
+    A target pixel grid defined by a GDAL geotransform, a projection and a size.
+    Layers are resampled onto this grid by `AlignedLayer`.
+    """
+
+    def __init__(self, geotransform: Sequence[float], projection: Optional[str], width: int, height: int):
+        self.geotransform = tuple(float(v) for v in geotransform) if geotransform else None
+        self.projection = projection or ""
+        self.width = int(width)
+        self.height = int(height)
+
+    @classmethod
+    def from_layer(cls, layer: dict) -> "ReferenceGrid":
+        data = layer["data"]
+        gt = layer.get("geotransform") if layer_has_georef(layer) else None
+        return cls(gt, layer.get("projection"), data.shape[1], data.shape[0])
+
+    @property
+    def key(self) -> Tuple:
+        return (self.geotransform, self.projection, self.width, self.height)
+
+    @property
+    def is_north_up(self) -> bool:
+        return self.geotransform is not None and self.geotransform[2] == 0 and self.geotransform[4] == 0
+
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """(min_x, min_y, max_x, max_y) of a north-up grid."""
+        gt0, gt1, _, gt3, _, gt5 = self.geotransform
+        xs = (gt0, gt0 + self.width * gt1)
+        ys = (gt3, gt3 + self.height * gt5)
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def __repr__(self):
+        return f"<ReferenceGrid {self.width}x{self.height} gt={self.geotransform}>"
+
+
+def layers_share_grid(layer: dict, grid: ReferenceGrid) -> bool:
+    """True if `layer` can be read on `grid` without any resampling."""
+    h, w = layer["data"].shape[:2]
+    if (h, w) != (grid.height, grid.width):
+        return False
+    if grid.geotransform is None or not layer_has_georef(layer):
+        # Same shape and no georeferencing to disagree with: treat as the same grid.
+        return True
+    return (np.allclose(layer["geotransform"], grid.geotransform)
+            and same_projection(layer.get("projection"), grid.projection))
+
+
+class AlignedLayer:
+    """
+    Lazy, tile-by-tile view of a layer resampled onto a reference grid.
+
+    Nothing is resampled up front. For grids that share a projection and are
+    north-up, the resampling index maps are separable and are stored as two 1D
+    arrays (one per axis) for the whole grid. Otherwise 2D index maps are computed
+    per tile through the cached coordinate transformation. Both kinds of map are
+    kept in a module-level LRU keyed by the source and target geometry.
+    Pixels that fall outside the source layer are returned as NaN.
+    """
+
+    def __init__(self, layer: dict, grid: ReferenceGrid, resampling: str = 'nearest'):
+        if resampling not in RESAMPLING_METHODS:
+            raise ValueError(f"Unsupported resampling '{resampling}'. Use one of {RESAMPLING_METHODS}.")
+        self.layer = layer
+        self.data = layer["data"]
+        self.grid = grid
+        self.resampling = resampling
+        self.num_bands = self.data.shape[2]
+        self.identity = layers_share_grid(layer, grid)
+
+        if not self.identity and (grid.geotransform is None or not layer_has_georef(layer)):
+            raise ValueError(
+                f"Layer '{layer.get('name', 'Layer')}' has a different grid than the reference "
+                f"and no georeferencing to align it with."
+            )
+
+        self.dtype = self.data.dtype if self.identity else np.result_type(self.data.dtype, np.float32)
+        self.separable = (not self.identity and grid.is_north_up
+                          and layer["geotransform"][2] == 0 and layer["geotransform"][4] == 0
+                          and same_projection(layer.get("projection"), grid.projection))
+
+        self._geometry_key = None
+        self._col_map = self._row_map = None
+        if not self.identity:
+            self._geometry_key = (tuple(layer["geotransform"]), layer.get("projection") or "",
+                                  self.data.shape[:2], grid.key)
+        if self.separable:
+            self._col_map, self._row_map = _cached_index_map(
+                self._geometry_key + ('separable',), self._build_separable_maps)
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.grid.height, self.grid.width, self.num_bands
+
+    # ---------------- INDEX MAPS ----------------
+    def _build_separable_maps(self):
+        """Fractional source pixel coordinates for every grid column and row (pixel centres)."""
+        src_gt = self.layer["geotransform"]
+        cols = np.arange(self.grid.width) + 0.5
+        rows = np.arange(self.grid.height) + 0.5
+        map_x, _ = pixel_to_map(self.grid.geotransform, cols, np.zeros_like(cols))
+        _, map_y = pixel_to_map(self.grid.geotransform, np.zeros_like(rows), rows)
+        src_cols = (map_x - src_gt[0]) / src_gt[1]
+        src_rows = (map_y - src_gt[3]) / src_gt[5]
+        return src_cols, src_rows
+
+    def _source_coords(self, xoff: int, yoff: int, xsize: int, ysize: int):
+        """Fractional source (cols, rows) for a window of the reference grid."""
+        if self.separable:
+            src_cols = self._col_map[xoff:xoff + xsize]
+            src_rows = self._row_map[yoff:yoff + ysize]
+            return np.broadcast_to(src_cols[None, :], (ysize, xsize)), np.broadcast_to(src_rows[:, None], (ysize, xsize))
+
+        key = self._geometry_key + (xoff, yoff, xsize, ysize)
+        return _cached_index_map(key, lambda: self._build_tile_map(xoff, yoff, xsize, ysize))
+
+    def _build_tile_map(self, xoff: int, yoff: int, xsize: int, ysize: int):
+        cols, rows = np.meshgrid(np.arange(xoff, xoff + xsize) + 0.5, np.arange(yoff, yoff + ysize) + 0.5)
+        map_x, map_y = pixel_to_map(self.grid.geotransform, cols, rows)
+        map_x, map_y = transform_points(map_x, map_y, self.grid.projection, self.layer.get("projection"))
+        return map_to_pixel(self.layer["geotransform"], map_x, map_y)
+
+    # ---------------- READING ----------------
+    def read(self, xoff: int, yoff: int, xsize: int, ysize: int, bands: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Reads a window of the reference grid as a (ysize, xsize, nbands) array.
+
+        Args:
+            xoff, yoff, xsize, ysize: Window on the reference grid (GDAL convention).
+            bands: Zero-based band indices to read (default: all bands).
+        """
+        band_idx = np.arange(self.num_bands) if bands is None else np.asarray(bands, dtype=np.intp)
+
+        if self.identity:
+            window = self.data[yoff:yoff + ysize, xoff:xoff + xsize]
+            return window if bands is None else window[:, :, band_idx]
+
+        src_cols, src_rows = self._source_coords(xoff, yoff, xsize, ysize)
+        if self.resampling == 'bilinear':
+            return self._read_bilinear(src_cols, src_rows, band_idx)
+        return self._read_nearest(src_cols, src_rows, band_idx)
+
+    def read_band(self, band: int, y0: int, y1: int) -> np.ndarray:
+        """Reads full-width rows [y0, y1) of a single band on the reference grid."""
+        return self.read(0, y0, self.grid.width, y1 - y0, bands=[band])[:, :, 0]
+
+    def read_full_band(self, band: int, tile_rows: int = DEFAULT_TILE_ROWS) -> np.ndarray:
+        """Materializes one band on the reference grid, resampling tile by tile."""
+        if self.identity:
+            return self.data[:, :, band]
+        out = np.empty((self.grid.height, self.grid.width), dtype=self.dtype)
+        for y0 in range(0, self.grid.height, tile_rows):
+            y1 = min(y0 + tile_rows, self.grid.height)
+            out[y0:y1] = self.read_band(band, y0, y1)
+        return out
+
+    def _read_nearest(self, src_cols, src_rows, band_idx) -> np.ndarray:
+        h, w = self.data.shape[:2]
+        ci = np.floor(src_cols).astype(np.intp)
+        ri = np.floor(src_rows).astype(np.intp)
+        valid = (ci >= 0) & (ci < w) & (ri >= 0) & (ri < h)
+        np.clip(ci, 0, w - 1, out=ci)
+        np.clip(ri, 0, h - 1, out=ri)
+
+        out = self.data[ri[..., None], ci[..., None], band_idx[None, None, :]].astype(self.dtype, copy=False)
+        if not valid.all():
+            out[~valid] = np.nan
+        return out
+
+    def _read_bilinear(self, src_cols, src_rows, band_idx) -> np.ndarray:
+        h, w = self.data.shape[:2]
+        fx = src_cols - 0.5
+        fy = src_rows - 0.5
+        valid = (src_cols >= 0) & (src_cols < w) & (src_rows >= 0) & (src_rows < h)
+        x0 = np.floor(fx).astype(np.intp)
+        y0 = np.floor(fy).astype(np.intp)
+        wx = (fx - x0).astype(np.float32)[..., None]
+        wy = (fy - y0).astype(np.float32)[..., None]
+        x1 = np.clip(x0 + 1, 0, w - 1)
+        y1 = np.clip(y0 + 1, 0, h - 1)
+        np.clip(x0, 0, w - 1, out=x0)
+        np.clip(y0, 0, h - 1, out=y0)
+
+        b = band_idx[None, None, :]
+
+        def gather(ri, ci):
+            return self.data[ri[..., None], ci[..., None], b].astype(self.dtype, copy=False)
+
+        top = gather(y0, x0) * (1 - wx) + gather(y0, x1) * wx
+        bottom = gather(y1, x0) * (1 - wx) + gather(y1, x1) * wx
+        out = (top * (1 - wy) + bottom * wy).astype(self.dtype, copy=False)
+        if not valid.all():
+            out[~valid] = np.nan
+        return out
+
+
+def get_aligned_layer(layer: dict, grid: ReferenceGrid, resampling: str = 'nearest') -> AlignedLayer:
+    """Builds an `AlignedLayer`, logging which alignment path is used."""
+    aligned = AlignedLayer(layer, grid, resampling)
+    if not aligned.identity:
+        logger.info(f"Aligning layer '{layer.get('name', 'Layer')}' onto {grid} "
+                    f"({'separable' if aligned.separable else 'warped'} {resampling})")
+    return aligned
+
+
+def check_alignable(layers: Sequence[dict], grid: ReferenceGrid) -> Tuple[bool, str]:
+    """Checks that every layer is either on `grid` or can be resampled onto it."""
+    for layer in layers:
+        if layers_share_grid(layer, grid):
+            continue
+        if grid.geotransform is None:
+            return False, (f"Layer '{layer.get('name', 'Layer')}' has a different size and the "
+                           f"reference layer has no georeferencing")
+        if not layer_has_georef(layer):
+            return False, f"Layer '{layer.get('name', 'Layer')}' has a different grid and no georeferencing"
+    return True, "All layers can be aligned"
+
+
+def build_warped_vrt(src_path: str, grid: ReferenceGrid, resampling: str = 'nearest',
+                     dst_path: Optional[str] = None) -> str:
+    """
+    Builds a GDAL warped VRT that presents `src_path` on `grid`. Reads from the VRT
+    resample lazily, block by block, inside GDAL.
+
+    Returns:
+        The path of the VRT (an in-memory /vsimem/ path unless `dst_path` is given).
+    """
+    if grid.geotransform is None or not grid.is_north_up:
+        raise ValueError("Warped VRTs require a north-up, georeferenced reference grid.")
+    if dst_path is None:
+        dst_path = f"/vsimem/hypril_aligned_{abs(hash((src_path, grid.key, resampling)))}.vrt"
+    resample_alg = {'nearest': 'near', 'bilinear': 'bilinear'}.get(resampling, resampling)
+    gdal.Warp(
+        dst_path, src_path,
+        format='VRT',
+        outputBounds=grid.bounds(),
+        width=grid.width,
+        height=grid.height,
+        dstSRS=grid.projection or None,
+        resampleAlg=resample_alg,
+    )
+    logger.info(f"Built warped VRT {dst_path} for {src_path}")
+    return dst_path
+
+
+def read_aligned_stack(layers: Sequence[dict], grid: ReferenceGrid, resampling: str = 'nearest',
+                       dtype=None, tile_rows: int = DEFAULT_TILE_ROWS) -> np.ndarray:
+    """
+    Concatenates the bands of several layers on a common grid, filling a single
+    preallocated output tile by tile.
+    """
+    aligned = [get_aligned_layer(layer, grid, resampling) for layer in layers]
+    total_bands = sum(a.num_bands for a in aligned)
+    dtype = dtype or np.result_type(*[a.dtype for a in aligned])
+    out = np.empty((grid.height, grid.width, total_bands), dtype=dtype)
+
+    for y0 in range(0, grid.height, tile_rows):
+        ysize = min(tile_rows, grid.height - y0)
+        b0 = 0
+        for a in aligned:
+            out[y0:y0 + ysize, :, b0:b0 + a.num_bands] = a.read(0, y0, grid.width, ysize)
+            b0 += a.num_bands
+    return out
@@ -0,0 +1,187 @@
+# src/core/point_query.py
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.core.geo_transforms import map_to_pixel, pixel_to_map, transform_points
+from src.core.grid_alignment import ReferenceGrid, layer_has_georef, layers_share_grid
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+
+def _unique_names(layers: Sequence[dict]) -> List[str]:
+    names, seen = [], {}
+    for layer in layers:
+        name = layer.get("name", "Layer")
+        if name in seen:
+            seen[name] += 1
+            name = f"{name} ({seen[name]})"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+class PointQueryService:
+    """
+    Batch pixel-value lookups across many layers.
+
+    Points are given once (as pixel coordinates on a reference layer, or as map
+    coordinates in any projection) and every layer is sampled with a single fancy
+    indexing gather. Layers on another grid are reached through the cached
+    coordinate transformations, so points never go through a per-point Python loop.
+    Values outside a layer are NaN.
+    """
+
+    def __init__(self, layers: Sequence[dict]):
+        self.layers = [layer for layer in layers if layer.get("data") is not None]
+        self.names = _unique_names(self.layers)
+
+    @staticmethod
+    def _gather(data: np.ndarray, cols: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """(N, B) values at integer pixel positions; NaN where outside the layer."""
+        h, w = data.shape[:2]
+        valid = (cols >= 0) & (cols < w) & (rows >= 0) & (rows < h)
+        out_dtype = np.result_type(data.dtype, np.float32)
+        out = np.full((cols.shape[0], data.shape[2]), np.nan, dtype=out_dtype)
+        if not valid.any():
+            return out
+
+        idx = np.flatnonzero(valid)
+        r, c = rows[idx], cols[idx]
+        # Visit pixels in row-major order so the gather walks memory mostly forward
+        order = np.lexsort((c, r))
+        out[idx[order]] = data[r[order], c[order]]
+        return out
+
+    def _layer_pixels(self, layer: dict, map_x: np.ndarray, map_y: np.ndarray,
+                      projection: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        lx, ly = transform_points(map_x, map_y, projection, layer.get("projection"))
+        cols, rows = map_to_pixel(layer["geotransform"], lx, ly)
+        return np.floor(cols).astype(np.intp), np.floor(rows).astype(np.intp)
+
+    def query_pixels(self, cols, rows, reference_layer: Optional[dict] = None,
+                     layers: Optional[Sequence[dict]] = None) -> "OrderedDict[str, np.ndarray]":
+        """
+        Samples all layers at pixel positions of `reference_layer` (default: the first layer).
+
+        Args:
+            cols, rows: Pixel coordinates on the reference layer's grid.
+            reference_layer: Layer whose grid the coordinates refer to.
+            layers: Subset of layers to sample (default: all).
+
+        Returns:
+            Ordered mapping of layer name -> (N, bands) array.
+        """
+        cols = np.atleast_1d(np.asarray(cols)).astype(np.intp)
+        rows = np.atleast_1d(np.asarray(rows)).astype(np.intp)
+        reference_layer = reference_layer if reference_layer is not None else self.layers[0]
+        grid = ReferenceGrid.from_layer(reference_layer)
+
+        map_x = map_y = None
+        results = OrderedDict()
+        for name, layer in self._selected(layers):
+            if layers_share_grid(layer, grid):
+                results[name] = self._gather(layer["data"], cols, rows)
+                continue
+            if grid.geotransform is None or not layer_has_georef(layer):
+                results[name] = np.full((cols.shape[0], layer["data"].shape[2]), np.nan, dtype=np.float32)
+                continue
+            if map_x is None:
+                map_x, map_y = pixel_to_map(grid.geotransform, cols + 0.5, rows + 0.5)
+            lc, lr = self._layer_pixels(layer, map_x, map_y, grid.projection)
+            results[name] = self._gather(layer["data"], lc, lr)
+        return results
+
+    def query_map(self, map_x, map_y, projection: Optional[str] = None,
+                  layers: Optional[Sequence[dict]] = None) -> "OrderedDict[str, np.ndarray]":
+        """
+        Samples all georeferenced layers at map coordinates given in `projection`
+        (WKT or EPSG code; None means each layer's own projection).
+
+        Returns:
+            Ordered mapping of layer name -> (N, bands) array.
+        """
+        map_x = np.atleast_1d(np.asarray(map_x, dtype=np.float64))
+        map_y = np.atleast_1d(np.asarray(map_y, dtype=np.float64))
+        results = OrderedDict()
+        for name, layer in self._selected(layers):
+            if not layer_has_georef(layer):
+                results[name] = np.full((map_x.shape[0], layer["data"].shape[2]), np.nan, dtype=np.float32)
+                continue
+            lc, lr = self._layer_pixels(layer, map_x, map_y, projection)
+            results[name] = self._gather(layer["data"], lc, lr)
+        return results
+
+    def _selected(self, layers: Optional[Sequence[dict]]):
+        if layers is None:
+            return list(zip(self.names, self.layers))
+        wanted = {id(layer) for layer in layers}
+        return [(name, layer) for name, layer in zip(self.names, self.layers) if id(layer) in wanted]
+
+    def band_labels(self, name: str) -> List[str]:
+        layer = self.layers[self.names.index(name)]
+        band_names = layer.get("band_names") or []
+        nb = layer["data"].shape[2]
+        return [band_names[i] if i < len(band_names) else f"Band {i+1}" for i in range(nb)]
+
+
+def read_point_list(csv_path: str) -> Tuple[str, np.ndarray, np.ndarray, Optional[str], "object"]:
+    """
+    Reads a CSV point list. Columns `x`/`y` (or `lon`/`lat`, `easting`/`northing`)
+    are map coordinates; an optional `epsg` column gives their CRS (default: the
+    layers' own). Columns `col`/`row` (or `pixel_x`/`pixel_y`) are pixel coordinates.
+
+    Returns:
+        (kind, a, b, projection, frame) where kind is 'map' or 'pixel'.
+    """
+    import pandas as pd
+
+    frame = pd.read_csv(csv_path)
+    columns = {c.lower().strip(): c for c in frame.columns}
+
+    for cx, cy in (('col', 'row'), ('pixel_x', 'pixel_y')):
+        if cx in columns and cy in columns:
+            return 'pixel', frame[columns[cx]].to_numpy(), frame[columns[cy]].to_numpy(), None, frame
+
+    for cx, cy in (('x', 'y'), ('lon', 'lat'), ('longitude', 'latitude'), ('easting', 'northing')):
+        if cx in columns and cy in columns:
+            projection = None
+            if 'epsg' in columns:
+                projection = int(frame[columns['epsg']].iloc[0])
+            elif cx in ('lon', 'longitude'):
+                projection = 4326
+            return 'map', frame[columns[cx]].to_numpy(), frame[columns[cy]].to_numpy(), projection, frame
+
+    raise ValueError("CSV must contain x/y, lon/lat, easting/northing or col/row columns.")
+
+
+def extract_point_spectra(layers: Sequence[dict], csv_path: str, output_path: str,
+                          reference_layer: Optional[dict] = None) -> int:
+    """
+    Extracts spectra of every point in `csv_path` from all `layers` and writes them
+    to `output_path` (input columns followed by one column per layer band).
+
+    Returns:
+        The number of points extracted.
+    """
+    import pandas as pd
+
+    kind, a, b, projection, frame = read_point_list(csv_path)
+    service = PointQueryService(layers)
+    if kind == 'pixel':
+        results = service.query_pixels(a, b, reference_layer=reference_layer)
+    else:
+        results = service.query_map(a, b, projection=projection)
+
+    blocks = [frame.reset_index(drop=True)]
+    for name, values in results.items():
+        labels = [f"{name}:{label}" for label in service.band_labels(name)]
+        blocks.append(pd.DataFrame(values, columns=labels))
+    pd.concat(blocks, axis=1).to_csv(output_path, index=False, float_format='%.6g')
+
+    logger.info(f"Extracted {len(frame)} point(s) from {len(results)} layer(s) to {output_path}")
+    return len(frame)
@@ -0,0 +1,561 @@
+# src/core/raster_export.py
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from src.core.band_statistics import RunningBandStatistics
+
+# --- Optional Zarr support ---
+try:
+    import zarr
+    ZARR_AVAILABLE = True
+except ImportError:
+    ZARR_AVAILABLE = False
+    print("Warning: zarr not installed. Zarr export will not be available.")
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# --- GDAL Exception Handling ---
+gdal.UseExceptions()
+
+NUMPY_DTYPES = {
+    'Float32': np.float32,
+    'Float64': np.float64,
+    'UInt16': np.uint16,
+    'Int16': np.int16,
+    'UInt32': np.uint32,
+    'Int32': np.int32,
+    'Byte': np.uint8,
+}
+
+GDAL_DTYPES = {
+    'Float32': gdal.GDT_Float32,
+    'Float64': gdal.GDT_Float64,
+    'UInt16': gdal.GDT_UInt16,
+    'Int16': gdal.GDT_Int16,
+    'UInt32': gdal.GDT_UInt32,
+    'Int32': gdal.GDT_Int32,
+    'Byte': gdal.GDT_Byte,
+}
+
+# ENVI header "data type" codes
+ENVI_DTYPES = {
+    'Byte': 1,
+    'Int16': 2,
+    'Int32': 3,
+    'Float32': 4,
+    'Float64': 5,
+    'UInt16': 12,
+    'UInt32': 13,
+}
+
+ENVI_EXTENSIONS = ('.hdr', '.img', '.dat', '.bsq', '.bil')
+
+DEFAULT_TILE_SIZE = 512
+# Upper bound for one in-flight tile (rows x cols x bands); bands are grouped to stay below it
+DEFAULT_TILE_BYTES = 32 * 1024 * 1024
+
+
+def shift_geotransform(geotransform: Sequence[float], xoff: int, yoff: int) -> Tuple[float, ...]:
+    """Geotransform of a pixel window starting at (xoff, yoff)."""
+    gt0, gt1, gt2, gt3, gt4, gt5 = geotransform
+    return (gt0 + xoff * gt1 + yoff * gt2, gt1, gt2, gt3 + xoff * gt4 + yoff * gt5, gt4, gt5)
+
+
+class ArraySource:
+    """
+    Tile reader over an in-memory (or memory-mapped) HxWxB array.
+
+    Args:
+        data: The HxWxB array.
+        window: Optional (xoff, yoff, xsize, ysize) pixel window of `data` to expose.
+        bands: Optional zero-based band indices to expose (default: all bands).
+    """
+
+    def __init__(self, data: np.ndarray, window: Optional[Tuple[int, int, int, int]] = None,
+                 bands: Optional[Sequence[int]] = None):
+        if data.ndim == 2:
+            data = data[:, :, np.newaxis]
+        self.data = data
+        h, w = data.shape[:2]
+        self.xoff, self.yoff, self.width, self.height = window if window else (0, 0, w, h)
+        self.bands = list(bands) if bands is not None else list(range(data.shape[2]))
+        self.num_bands = len(self.bands)
+        self.dtype = data.dtype
+
+    def read(self, xoff: int, yoff: int, xsize: int, ysize: int, bands: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Reads a (ysize, xsize, nbands) tile; offsets and band indices are relative to this source."""
+        y0 = self.yoff + yoff
+        x0 = self.xoff + xoff
+        window = self.data[y0:y0 + ysize, x0:x0 + xsize]
+        src_bands = self.bands if bands is None else [self.bands[b] for b in bands]
+        if src_bands == list(range(self.data.shape[2])):
+            return window
+        return window[:, :, src_bands]
+
+    def close(self):
+        pass
+
+
+class GdalFileSource:
+    """
+    Tile reader that reads windows and bands straight from a GDAL-readable file,
+    so exports of file-backed layers never need the cube in memory. Each thread
+    gets its own dataset handle (GDAL handles must not be shared across threads).
+
+    Args:
+        file_path: Path (or GDAL subdataset name) of the source raster.
+        window: Optional (xoff, yoff, xsize, ysize) pixel window to expose.
+        bands: Optional zero-based band indices to expose (default: all bands).
+    """
+
+    def __init__(self, file_path: str, window: Optional[Tuple[int, int, int, int]] = None,
+                 bands: Optional[Sequence[int]] = None):
+        self.file_path = file_path
+        self._local = threading.local()
+        self._handles = []
+        self._handles_lock = threading.Lock()
+
+        dataset = self._dataset()
+        w, h, count = dataset.RasterXSize, dataset.RasterYSize, dataset.RasterCount
+        self.xoff, self.yoff, self.width, self.height = window if window else (0, 0, w, h)
+        self.bands = list(bands) if bands is not None else list(range(count))
+        self.num_bands = len(self.bands)
+        self.dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(dataset.GetRasterBand(1).DataType))
+        self.raster_shape = (h, w, count)
+
+    def _dataset(self):
+        dataset = getattr(self._local, 'dataset', None)
+        if dataset is None:
+            dataset = gdal.Open(self.file_path, gdal.GA_ReadOnly)
+            if dataset is None:
+                raise IOError(f"GDAL could not open {self.file_path}")
+            self._local.dataset = dataset
+            with self._handles_lock:
+                self._handles.append(dataset)
+        return dataset
+
+    def read(self, xoff: int, yoff: int, xsize: int, ysize: int, bands: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Reads a (ysize, xsize, nbands) tile; offsets and band indices are relative to this source."""
+        dataset = self._dataset()
+        src_bands = self.bands if bands is None else [self.bands[b] for b in bands]
+        band_list = [b + 1 for b in src_bands]
+        x0, y0 = self.xoff + xoff, self.yoff + yoff
+        try:
+            data = dataset.ReadAsArray(x0, y0, xsize, ysize, band_list=band_list)
+        except TypeError:
+            # GDAL builds without `band_list` support: read band by band
+            data = np.stack([dataset.GetRasterBand(b).ReadAsArray(x0, y0, xsize, ysize) for b in band_list])
+        if data.ndim == 2:
+            data = data[np.newaxis, :, :]
+        return np.moveaxis(data, 0, -1)
+
+    def close(self):
+        with self._handles_lock:
+            self._handles.clear()
+        self._local = threading.local()
+
+
+def layer_source(layer: dict, window: Optional[Tuple[int, int, int, int]] = None,
+                 bands: Optional[Sequence[int]] = None):
+    """
+    Returns a tile source for a layer: a `GdalFileSource` when the layer is still
+    backed by an unmodified file of the same shape, otherwise an `ArraySource`
+    over its in-memory data.
+    """
+    file_path = layer.get('file_path')
+    data = layer.get('data')
+    if file_path:
+        try:
+            source = GdalFileSource(file_path, window=window, bands=bands)
+            if data is None or source.raster_shape == tuple(np.shape(data)):
+                return source
+            source.close()
+        except Exception as e:
+            logger.warning(f"Falling back to in-memory export for '{layer.get('name')}': {e}")
+    return ArraySource(data, window=window, bands=bands)
+
+
+class GeoTiffExporter:
+    """
+    Parallel, tiled GeoTIFF / Cloud-Optimized GeoTIFF writer.
+
+    Tiles are block-aligned and produced in band-interleaved order: a pool of worker
+    threads reads and converts tiles (and computes their statistics) while a single
+    writer hands them to GDAL in file order. Compression runs inside GDAL with
+    NUM_THREADS=ALL_CPUS, and band statistics are set from the same pass instead of
+    a ComputeStatistics() pass per band. With `cog`, internal overviews are then
+    built from the written file, so the data is only written once.
+    """
+
+    def __init__(self, file_path: str, data_type: str = 'Float32', compression: str = 'LZW',
+                 tile_size: int = DEFAULT_TILE_SIZE, cog: bool = False, overview_resampling: str = 'AVERAGE',
+                 nodata: Optional[float] = None, num_workers: Optional[int] = None,
+                 max_tile_bytes: int = DEFAULT_TILE_BYTES):
+        self.file_path = file_path
+        self.data_type = data_type if data_type in NUMPY_DTYPES else 'Float32'
+        self.np_dtype = np.dtype(NUMPY_DTYPES[self.data_type])
+        self.compression = compression or 'None'
+        self.tile_size = int(tile_size)
+        self.cog = cog
+        self.overview_resampling = overview_resampling
+        self.nodata = nodata
+        self.num_workers = num_workers or min(8, os.cpu_count() or 1)
+        self.max_tile_bytes = max_tile_bytes
+
+    # ---------------- CREATION OPTIONS ----------------
+    def _compression_options(self) -> List[str]:
+        options = []
+        if self.compression in ('LZW', 'DEFLATE', 'ZSTD'):
+            options.append(f'COMPRESS={self.compression}')
+            # Floating point predictor for float output, horizontal differencing otherwise
+            predictor = 3 if np.issubdtype(self.np_dtype, np.floating) else 2
+            options.append(f'PREDICTOR={predictor}')
+        elif self.compression == 'JPEG':
+            options.extend(['COMPRESS=JPEG', 'JPEG_QUALITY=95'])
+        return options
+
+    def _gtiff_options(self) -> List[str]:
+        options = [
+            'TILED=YES',
+            f'BLOCKXSIZE={self.tile_size}',
+            f'BLOCKYSIZE={self.tile_size}',
+            'INTERLEAVE=BAND',
+            'BIGTIFF=IF_SAFER',
+            'NUM_THREADS=ALL_CPUS',
+        ]
+        options.extend(self._compression_options())
+        return options
+
+    # ---------------- TILING ----------------
+    def _band_groups(self, source) -> List[Tuple[int, int]]:
+        tile_band_bytes = self.tile_size * self.tile_size * max(self.np_dtype.itemsize, source.dtype.itemsize)
+        per_group = max(1, min(source.num_bands, self.max_tile_bytes // max(tile_band_bytes, 1)))
+        return [(b0, min(b0 + per_group, source.num_bands)) for b0 in range(0, source.num_bands, per_group)]
+
+    def _tiles(self, source) -> List[Tuple[int, int, int, int, int, int]]:
+        """(b0, b1, xoff, yoff, xsize, ysize) in band-interleaved, row-major block order."""
+        tiles = []
+        for b0, b1 in self._band_groups(source):
+            for yoff in range(0, source.height, self.tile_size):
+                for xoff in range(0, source.width, self.tile_size):
+                    tiles.append((b0, b1, xoff, yoff,
+                                  min(self.tile_size, source.width - xoff),
+                                  min(self.tile_size, source.height - yoff)))
+        return tiles
+
+    def _prepare_tile(self, source, tile):
+        b0, b1, xoff, yoff, xsize, ysize = tile
+        data = source.read(xoff, yoff, xsize, ysize, bands=list(range(b0, b1)))
+        # (rows, cols, bands) -> contiguous (bands, rows, cols) in the output type
+        data = np.ascontiguousarray(np.moveaxis(data, 2, 0), dtype=self.np_dtype)
+        return data, RunningBandStatistics.of_tile(data, self.nodata)
+
+    # ---------------- EXPORT ----------------
+    def export(self, source, geotransform=None, projection: Optional[str] = None,
+               band_names: Optional[Sequence[str]] = None, wavelengths: Optional[Sequence[float]] = None,
+               wavelength_units: str = 'nm', metadata: Optional[Dict[str, str]] = None,
+               progress_callback: Optional[Callable[[int], None]] = None) -> str:
+        """
+        Writes `source` (anything with width/height/num_bands/dtype and read(xoff, yoff, xsize, ysize, bands))
+        to `self.file_path`.
+
+        Returns:
+            The path of the written file.
+        """
+        target_path = self.file_path
+        driver = gdal.GetDriverByName('GTiff')
+        dataset = driver.Create(target_path, source.width, source.height, source.num_bands,
+                                GDAL_DTYPES[self.data_type], self._gtiff_options())
+        if dataset is None:
+            raise Exception("Could not create output file")
+
+        try:
+            if geotransform:
+                dataset.SetGeoTransform(geotransform)
+            if projection:
+                dataset.SetProjection(projection)
+
+            self._write_tiles(dataset, source, progress_callback)
+            self._write_metadata(dataset, band_names, wavelengths, wavelength_units, metadata)
+            if self.cog:
+                self._build_overviews(dataset)
+            dataset.FlushCache()
+        finally:
+            dataset = None
+
+        logger.info(f"Exported {source.num_bands} band(s) {source.width}x{source.height} to {target_path}")
+        return target_path
+
+    def _write_tiles(self, dataset, source, progress_callback):
+        tiles = self._tiles(source)
+        stats = RunningBandStatistics(source.num_bands)
+        bands = [dataset.GetRasterBand(i + 1) for i in range(source.num_bands)]
+        if self.nodata is not None:
+            for band in bands:
+                band.SetNoDataValue(self.nodata)
+
+        total = len(tiles)
+        max_in_flight = 2 * self.num_workers
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            pending = []
+            next_submit = 0
+            for done in range(total):
+                # Keep a bounded number of tiles in flight; results are consumed in file order
+                while next_submit < total and len(pending) < max_in_flight:
+                    pending.append(pool.submit(self._prepare_tile, source, tiles[next_submit]))
+                    next_submit += 1
+                data, partial = pending.pop(0).result()
+
+                b0, b1, xoff, yoff, _, _ = tiles[done]
+                for k in range(b1 - b0):
+                    bands[b0 + k].WriteArray(data[k], xoff, yoff)
+                stats.merge(slice(b0, b1), partial)
+
+                if progress_callback and (done % 16 == 0 or done == total - 1):
+                    progress_callback(int(100 * (done + 1) / total))
+
+        std = stats.std()
+        for i, band in enumerate(bands):
+            if stats.count[i] > 0:
+                band.SetStatistics(float(stats.min[i]), float(stats.max[i]), float(stats.mean[i]), float(std[i]))
+
+    @staticmethod
+    def _write_metadata(dataset, band_names, wavelengths, wavelength_units, metadata):
+        band_names = band_names or []
+        wavelengths = wavelengths if wavelengths is not None else []
+        for i in range(dataset.RasterCount):
+            band = dataset.GetRasterBand(i + 1)
+            if i < len(band_names):
+                band.SetDescription(str(band_names[i]))
+            if i < len(wavelengths):
+                band.SetMetadataItem('wavelength', str(wavelengths[i]))
+                band.SetMetadataItem('wavelength_units', wavelength_units or 'nm')
+
+        for key, value in (metadata or {}).items():
+            if isinstance(value, (str, int, float)):
+                dataset.SetMetadataItem(str(key), str(value))
+
+    def _build_overviews(self, dataset):
+        """Internal overviews (halving down to one tile), compressed like the full-resolution data."""
+        factors, size = [], max(dataset.RasterXSize, dataset.RasterYSize)
+        while size // (2 ** (len(factors) + 1)) >= self.tile_size:
+            factors.append(2 ** (len(factors) + 1))
+        if not factors:
+            return
+        compression = next((o.split('=', 1)[1] for o in self._compression_options() if o.startswith('COMPRESS=')),
+                           None)
+        previous = gdal.GetConfigOption('COMPRESS_OVERVIEW')
+        if compression:
+            gdal.SetConfigOption('COMPRESS_OVERVIEW', compression)
+        try:
+            dataset.BuildOverviews(self.overview_resampling, factors)
+        finally:
+            gdal.SetConfigOption('COMPRESS_OVERVIEW', previous)
+
+
+def _row_strip(width: int, num_bands: int, itemsize: int, max_bytes: int) -> int:
+    """Number of full-width rows of `num_bands` bands that fit in `max_bytes`."""
+    return max(1, max_bytes // max(width * num_bands * itemsize, 1))
+
+
+class EnviExporter:
+    """
+    Streams a source to an ENVI BSQ or BIL raw binary file plus a `.hdr` header
+    (band names, wavelengths, map info). The raw file is a memory map that is
+    filled in full-width row strips, so the source never has to be in memory at
+    once and the file is written front to back.
+    """
+
+    def __init__(self, file_path: str, interleave: str = 'bsq', data_type: str = 'Float32',
+                 nodata: Optional[float] = None, max_tile_bytes: int = DEFAULT_TILE_BYTES):
+        interleave = interleave.lower()
+        if interleave not in ('bsq', 'bil'):
+            raise ValueError(f"Unsupported ENVI interleave '{interleave}'. Use 'bsq' or 'bil'.")
+        base, ext = os.path.splitext(file_path)
+        if ext.lower() == '.hdr':
+            self.data_path = base + '.img'
+            self.header_path = file_path
+        else:
+            self.data_path = file_path
+            self.header_path = base + '.hdr'
+        self.interleave = interleave
+        self.data_type = data_type if data_type in ENVI_DTYPES else 'Float32'
+        self.np_dtype = np.dtype(NUMPY_DTYPES[self.data_type])
+        self.nodata = nodata
+        self.max_tile_bytes = max_tile_bytes
+
+    def export(self, source, geotransform=None, projection: Optional[str] = None,
+               band_names: Optional[Sequence[str]] = None, wavelengths: Optional[Sequence[float]] = None,
+               wavelength_units: str = 'nm', metadata: Optional[Dict[str, str]] = None,
+               progress_callback: Optional[Callable[[int], None]] = None) -> str:
+        """
+        Writes the raw data file and its header.
+
+        Returns:
+            The path of the header file.
+        """
+        rows, cols, nb = source.height, source.width, source.num_bands
+        shape = (nb, rows, cols) if self.interleave == 'bsq' else (rows, nb, cols)
+        # Little endian on disk ("byte order = 0")
+        out = np.memmap(self.data_path, dtype=self.np_dtype.newbyteorder('<'), mode='w+', shape=shape)
+
+        try:
+            if self.interleave == 'bil':
+                self._write_bil(out, source, progress_callback)
+            else:
+                self._write_bsq(out, source, progress_callback)
+            out.flush()
+        finally:
+            del out
+
+        self._write_header(source, geotransform, projection, band_names, wavelengths, wavelength_units, metadata)
+        logger.info(f"Exported {nb} band(s) {cols}x{rows} to ENVI {self.interleave.upper()} {self.data_path}")
+        return self.header_path
+
+    def _write_bsq(self, out, source, progress_callback):
+        # Band groups outermost so each band's rows land contiguously in the file
+        group = max(1, min(source.num_bands, self.max_tile_bytes //
+                           max(source.width * self.np_dtype.itemsize * DEFAULT_TILE_SIZE, 1)))
+        strip = _row_strip(source.width, group, self.np_dtype.itemsize, self.max_tile_bytes)
+        for b0 in range(0, source.num_bands, group):
+            b1 = min(b0 + group, source.num_bands)
+            for y0 in range(0, source.height, strip):
+                y1 = min(y0 + strip, source.height)
+                tile = source.read(0, y0, source.width, y1 - y0, bands=list(range(b0, b1)))
+                out[b0:b1, y0:y1, :] = np.moveaxis(tile, 2, 0)
+            if progress_callback:
+                progress_callback(int(100 * b1 / source.num_bands))
+
+    def _write_bil(self, out, source, progress_callback):
+        strip = _row_strip(source.width, source.num_bands, self.np_dtype.itemsize, self.max_tile_bytes)
+        for y0 in range(0, source.height, strip):
+            y1 = min(y0 + strip, source.height)
+            tile = source.read(0, y0, source.width, y1 - y0)
+            # (rows, cols, bands) -> (rows, bands, cols)
+            out[y0:y1] = np.swapaxes(tile, 1, 2)
+            if progress_callback:
+                progress_callback(int(100 * y1 / source.height))
+
+    def _write_header(self, source, geotransform, projection, band_names, wavelengths, wavelength_units, metadata):
+        lines = [
+            'ENVI',
+            f"description = {{{(metadata or {}).get('SOURCE_FILE', 'HYPRIL export')}}}",
+            f'samples = {source.width}',
+            f'lines = {source.height}',
+            f'bands = {source.num_bands}',
+            'header offset = 0',
+            'file type = ENVI Standard',
+            f'data type = {ENVI_DTYPES[self.data_type]}',
+            f'interleave = {self.interleave}',
+            'byte order = 0',
+        ]
+        if geotransform and geotransform[2] == 0 and geotransform[4] == 0:
+            gt0, gt1, _, gt3, _, gt5 = geotransform
+            lines.append(f'map info = {{Arbitrary, 1, 1, {gt0!r}, {gt3!r}, {gt1!r}, {abs(gt5)!r}}}')
+        if projection:
+            lines.append(f'coordinate system string = {{{projection}}}')
+        if self.nodata is not None:
+            lines.append(f'data ignore value = {self.nodata}')
+        if band_names:
+            lines.append('band names = {' + ', '.join(str(b).replace(',', ';') for b in band_names) + '}')
+        if wavelengths is not None and len(wavelengths):
+            lines.append(f'wavelength units = {wavelength_units or "nm"}')
+            lines.append('wavelength = {' + ', '.join(f'{float(w):g}' for w in wavelengths) + '}')
+
+        with open(self.header_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+class ZarrExporter:
+    """
+    Streams a source into a chunked, compressed Zarr array laid out as
+    (band, y, x), the same order as GDAL/xarray raster stacks. Chunk-aligned
+    regions are written concurrently by a thread pool; georeferencing, band
+    names and wavelengths are stored as array attributes.
+    """
+
+    def __init__(self, file_path: str, data_type: str = 'Float32', chunk_size: int = DEFAULT_TILE_SIZE,
+                 band_chunk: int = 16, nodata: Optional[float] = None, num_workers: Optional[int] = None):
+        if not ZARR_AVAILABLE:
+            raise ImportError("zarr is not installed. Install it with 'pip install zarr' to export Zarr stores.")
+        self.file_path = file_path
+        self.data_type = data_type if data_type in NUMPY_DTYPES else 'Float32'
+        self.np_dtype = np.dtype(NUMPY_DTYPES[self.data_type])
+        self.chunk_size = int(chunk_size)
+        self.band_chunk = int(band_chunk)
+        self.nodata = nodata
+        self.num_workers = num_workers or min(8, os.cpu_count() or 1)
+
+    def export(self, source, geotransform=None, projection: Optional[str] = None,
+               band_names: Optional[Sequence[str]] = None, wavelengths: Optional[Sequence[float]] = None,
+               wavelength_units: str = 'nm', metadata: Optional[Dict[str, str]] = None,
+               progress_callback: Optional[Callable[[int], None]] = None) -> str:
+        """
+        Writes the Zarr store.
+
+        Returns:
+            The path of the store.
+        """
+        nb, rows, cols = source.num_bands, source.height, source.width
+        band_chunk = min(self.band_chunk, nb)
+        array = zarr.open_array(
+            self.file_path, mode='w', shape=(nb, rows, cols),
+            chunks=(band_chunk, min(self.chunk_size, rows), min(self.chunk_size, cols)),
+            dtype=self.np_dtype, fill_value=self.nodata,
+        )
+
+        # Each region covers whole chunks, so concurrent writes never touch the same chunk
+        regions = [(b0, min(b0 + band_chunk, nb), y0, min(y0 + self.chunk_size, rows))
+                   for b0 in range(0, nb, band_chunk)
+                   for y0 in range(0, rows, self.chunk_size)]
+
+        def write_region(region):
+            b0, b1, y0, y1 = region
+            tile = source.read(0, y0, cols, y1 - y0, bands=list(range(b0, b1)))
+            array[b0:b1, y0:y1, :] = np.moveaxis(tile, 2, 0).astype(self.np_dtype, copy=False)
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            for done, _ in enumerate(pool.map(write_region, regions), start=1):
+                if progress_callback and (done % 8 == 0 or done == len(regions)):
+                    progress_callback(int(100 * done / len(regions)))
+
+        attrs = {
+            '_ARRAY_DIMENSIONS': ['band', 'y', 'x'],
+            'geotransform': list(geotransform) if geotransform else None,
+            'crs_wkt': projection or '',
+            'band_names': [str(b) for b in band_names] if band_names else [],
+            'wavelengths': [float(w) for w in wavelengths] if wavelengths is not None else [],
+            'wavelength_units': wavelength_units or 'nm',
+        }
+        if self.nodata is not None:
+            attrs['nodata'] = self.nodata
+        for key, value in (metadata or {}).items():
+            if isinstance(value, (str, int, float)):
+                attrs[str(key)] = value
+        array.attrs.update(attrs)
+
+        logger.info(f"Exported {nb} band(s) {cols}x{rows} to Zarr store {self.file_path}")
+        return self.file_path
+
+
+def create_exporter(file_path: str, data_type: str = 'Float32', compression: str = 'LZW', cog: bool = False,
+                    interleave: str = 'bsq', nodata: Optional[float] = None):
+    """
+    Picks the export backend from the output extension: `.zarr` -> Zarr,
+    ENVI extensions (.hdr/.img/.dat/.bsq/.bil) -> ENVI, anything else -> GeoTIFF.
+    """
+    ext = os.path.splitext(file_path.rstrip('/\\'))[1].lower()
+    if ext == '.zarr':
+        return ZarrExporter(file_path, data_type=data_type, nodata=nodata)
+    if ext in ENVI_EXTENSIONS:
+        if ext == '.bil':
+            interleave = 'bil'
+        return EnviExporter(file_path, interleave=interleave, data_type=data_type, nodata=nodata)
+    return GeoTiffExporter(file_path, data_type=data_type, compression=compression, cog=cog, nodata=nodata)
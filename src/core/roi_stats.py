@@ -0,0 +1,225 @@
+# src/core/roi_stats.py
+import logging
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from matplotlib.path import Path
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILES = (2, 25, 50, 75, 98)
+DEFAULT_MAX_SAMPLE = 100_000
+# Values (pixels x bands) gathered per chunk; the float32 working set stays around 32 MB
+DEFAULT_CHUNK_VALUES = 8 * 1024 * 1024
+
+
+class ROI:
+    """
+    A rasterized region of interest: a pixel bounding box plus a bit-packed mask
+    (np.packbits, one bit per pixel) covering that box.
+    """
+
+    def __init__(self, bbox: Tuple[int, int, int, int], packed_mask: np.ndarray, name: str = "ROI"):
+        # bbox is (x0, y0, x1, y1) with exclusive upper bounds
+        self.bbox = bbox
+        self.packed_mask = packed_mask
+        self.name = name
+        self.pixel_count = int(np.unpackbits(packed_mask).sum()) if packed_mask.size else 0
+
+    @property
+    def box_shape(self) -> Tuple[int, int]:
+        x0, y0, x1, y1 = self.bbox
+        return y1 - y0, x1 - x0
+
+    def mask(self) -> np.ndarray:
+        """Boolean mask over the bounding box."""
+        h, w = self.box_shape
+        return np.unpackbits(self.packed_mask, count=h * w).reshape(h, w).astype(bool)
+
+    def indices(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, cols) image indices of all ROI pixels."""
+        rows, cols = np.nonzero(self.mask())
+        return rows + self.bbox[1], cols + self.bbox[0]
+
+    @staticmethod
+    def _clip_bbox(x0, y0, x1, y1, image_shape) -> Tuple[int, int, int, int]:
+        h, w = image_shape[:2]
+        return max(0, int(x0)), max(0, int(y0)), min(w, int(x1)), min(h, int(y1))
+
+    @classmethod
+    def from_rectangle(cls, x1: int, y1: int, x2: int, y2: int, image_shape, name: str = "Rectangle ROI") -> "ROI":
+        """Rectangle with inclusive pixel corners (as emitted by `AOISelector`)."""
+        bbox = cls._clip_bbox(min(x1, x2), min(y1, y2), max(x1, x2) + 1, max(y1, y2) + 1, image_shape)
+        h, w = max(0, bbox[3] - bbox[1]), max(0, bbox[2] - bbox[0])
+        return cls(bbox, np.packbits(np.ones(h * w, dtype=bool)), name)
+
+    @classmethod
+    def from_polygon(cls, vertices: Sequence[Tuple[float, float]], image_shape, name: str = "Polygon ROI") -> "ROI":
+        """Polygon in pixel coordinates; a pixel belongs to the ROI if its centre is inside."""
+        verts = np.asarray(vertices, dtype=np.float64)
+        if verts.ndim != 2 or verts.shape[0] < 3:
+            raise ValueError("A polygon ROI needs at least three vertices.")
+        bbox = cls._clip_bbox(np.floor(verts[:, 0].min()), np.floor(verts[:, 1].min()),
+                              np.ceil(verts[:, 0].max()) + 1, np.ceil(verts[:, 1].max()) + 1, image_shape)
+        h, w = max(0, bbox[3] - bbox[1]), max(0, bbox[2] - bbox[0])
+        if h == 0 or w == 0:
+            return cls(bbox, np.zeros(0, dtype=np.uint8), name)
+
+        # Pixel (c, r) covers [c, c+1) x [r, r+1) in display coordinates (imshow extent),
+        # matching how the viewer maps clicks to pixels with int(xdata)
+        path = Path(verts)
+        cols = np.arange(bbox[0], bbox[2]) + 0.5
+        packed_rows = []
+        rows_per_chunk = max(1, 1_000_000 // w)
+        for r0 in range(bbox[1], bbox[3], rows_per_chunk):
+            r1 = min(r0 + rows_per_chunk, bbox[3])
+            cc, rr = np.meshgrid(cols, np.arange(r0, r1) + 0.5)
+            inside = path.contains_points(np.column_stack([cc.ravel(), rr.ravel()]))
+            packed_rows.append(inside)
+        return cls(bbox, np.packbits(np.concatenate(packed_rows)), name)
+
+
+class ROIStatistics:
+    """Result of `compute_roi_statistics`: per-band spectra, covariance and a pixel sample."""
+
+    def __init__(self, roi_name: str, count: int, mean: np.ndarray, std: np.ndarray, vmin: np.ndarray,
+                 vmax: np.ndarray, percentiles: Dict[float, np.ndarray], covariance: np.ndarray,
+                 sample: np.ndarray, total_pixels: int):
+        self.roi_name = roi_name
+        self.count = count
+        self.mean = mean
+        self.std = std
+        self.min = vmin
+        self.max = vmax
+        self.percentiles = percentiles
+        self.covariance = covariance
+        self.sample = sample
+        self.total_pixels = total_pixels
+
+    def correlation(self) -> np.ndarray:
+        d = np.sqrt(np.diag(self.covariance))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.covariance / np.outer(d, d)
+
+
+def compute_roi_statistics(data: np.ndarray, roi: ROI, percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+                           nodata: Optional[float] = None, max_sample: int = DEFAULT_MAX_SAMPLE,
+                           chunk_values: int = DEFAULT_CHUNK_VALUES, seed: int = 0) -> ROIStatistics:
+    """
+    Mean, std, min, max, percentile spectra and band covariance of an ROI in one
+    chunked pass over its bounding box.
+
+    Pixels with any NaN/inf (or `nodata`) band are skipped. Sums and cross-products
+    are accumulated around a shift (the first chunk's mean) for numerical stability;
+    percentiles are taken from a uniform random sample of at most `max_sample`
+    pixels, which is exact for smaller ROIs.
+
+    Args:
+        data: HxWxB image.
+        roi: Rasterized ROI.
+        percentiles: Percentiles to compute (0-100).
+        nodata: Optional nodata value to ignore.
+        max_sample: Maximum number of pixels kept for percentiles / density plots.
+        chunk_values: Approximate number of values (pixels x bands) gathered per chunk.
+        seed: Seed of the sampling RNG (results are reproducible).
+    """
+    x0, y0, x1, y1 = roi.bbox
+    bands = data.shape[2]
+    mask = roi.mask()
+    rng = np.random.default_rng(seed)
+    keep_prob = min(1.0, max_sample / max(roi.pixel_count, 1))
+    work_dtype = np.result_type(data.dtype, np.float32)
+    # Cubes loaded through GDAL are band-sequential views: gather band planes, not pixels
+    band_planar = data.strides[2] > data.strides[1]
+
+    count = 0
+    shift = None
+    sum_dev = np.zeros(bands, dtype=np.float64)
+    cross = np.zeros((bands, bands), dtype=np.float64)
+    vmin = np.full(bands, np.inf)
+    vmax = np.full(bands, -np.inf)
+    samples = []
+
+    width = max(x1 - x0, 1)
+    rows_per_chunk = max(1, chunk_values // (width * bands))
+    for r0 in range(y0, y1, rows_per_chunk):
+        r1 = min(r0 + rows_per_chunk, y1)
+        chunk_mask = mask[r0 - y0:r1 - y0]
+        n = int(np.count_nonzero(chunk_mask))
+        if n == 0:
+            continue
+
+        # (bands, pixels) working array
+        block = data[r0:r1, x0:x1]
+        if band_planar:
+            pixels = np.empty((bands, n), dtype=work_dtype)
+            for b in range(bands):
+                pixels[b] = block[:, :, b][chunk_mask]
+        else:
+            pixels = np.ascontiguousarray(block[chunk_mask].T, dtype=work_dtype)
+
+        # Fast path: a finite per-band sum means no NaN/inf in the chunk
+        if nodata is not None or not np.isfinite(pixels.sum(axis=1)).all():
+            valid = np.isfinite(pixels).all(axis=0)
+            if nodata is not None:
+                valid &= (pixels != nodata).all(axis=0)
+            pixels = pixels[:, valid]
+            if pixels.shape[1] == 0:
+                continue
+
+        np.minimum(vmin, pixels.min(axis=1), out=vmin)
+        np.maximum(vmax, pixels.max(axis=1), out=vmax)
+        if keep_prob >= 1.0:
+            samples.append(pixels.T.astype(np.float32))
+        else:
+            samples.append(pixels[:, rng.random(pixels.shape[1]) < keep_prob].T.astype(np.float32))
+
+        if shift is None:
+            # Rounded to the working dtype once: the value subtracted is the value added back
+            shift = pixels.mean(axis=1, dtype=np.float64).astype(work_dtype)
+        pixels -= shift[:, None]
+        sum_dev += pixels.sum(axis=1)
+        cross += pixels @ pixels.T
+        count += pixels.shape[1]
+
+    if count == 0:
+        raise ValueError(f"ROI '{roi.name}' contains no valid pixels.")
+
+    mean_dev = sum_dev / count
+    mean = shift.astype(np.float64) + mean_dev
+    covariance = (cross - count * np.outer(mean_dev, mean_dev)) / max(count - 1, 1)
+    std = np.sqrt(np.maximum(np.diag(covariance) * (max(count - 1, 1) / count), 0.0))
+
+    sample = np.concatenate(samples, axis=0) if samples else np.empty((0, bands), dtype=np.float32)
+    pct = {}
+    if sample.shape[0]:
+        values = np.percentile(sample, list(percentiles), axis=0)
+        pct = {p: values[i] for i, p in enumerate(percentiles)}
+
+    logger.info(f"ROI '{roi.name}': {count} valid pixels, {bands} bands, sample of {sample.shape[0]}")
+    return ROIStatistics(roi.name, count, mean, std, vmin, vmax, pct, covariance, sample, roi.pixel_count)
+
+
+def spectral_density(sample: np.ndarray, value_bins: int = 200,
+                     value_range: Optional[Tuple[float, float]] = None) -> Tuple[np.ndarray, float, float]:
+    """
+    2D histogram of (value, band) over a pixel sample, used to draw ROI spectra as
+    a density image instead of one line per pixel.
+
+    Returns:
+        (counts of shape (value_bins, bands), low, high)
+    """
+    n, bands = sample.shape
+    if value_range is None:
+        lo, hi = (np.percentile(sample, [0.5, 99.5]) if n else (0.0, 1.0))
+    else:
+        lo, hi = value_range
+    if hi <= lo:
+        hi = lo + 1.0
+
+    idx = ((sample - lo) * (value_bins / (hi - lo))).astype(np.int64)
+    np.clip(idx, 0, value_bins - 1, out=idx)
+    flat = idx * bands + np.arange(bands)[None, :]
+    counts = np.bincount(flat.ravel(), minlength=value_bins * bands).reshape(value_bins, bands)
+    return counts, float(lo), float(hi)
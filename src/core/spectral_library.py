@@ -0,0 +1,511 @@
+# src/core/spectral_library.py
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import h5py
+    H5PY_AVAILABLE = True
+except ImportError:
+    H5PY_AVAILABLE = False
+    print("Warning: h5py not found. HDF5 spectral libraries cannot be opened.")
+
+try:
+    import netCDF4
+    NETCDF4_AVAILABLE = True
+except ImportError:
+    NETCDF4_AVAILABLE = False
+    print("Warning: netCDF4 not found. NetCDF spectral libraries cannot be opened.")
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".hypril", "spectral_library_cache")
+# Bumped whenever the on-disk layout of the cache changes
+CACHE_VERSION = 1
+MAX_OPEN_LIBRARIES = 16
+
+SUPPORTED_EXTENSIONS = ('.sli', '.txt', '.csv', '.h5', '.hdf', '.nc')
+FILE_FILTER = (
+    "All Supported Files (*.sli *.txt *.csv *.h5 *.hdf *.nc);;"
+    "ENVI Spectral Library (*.sli);;"
+    "Text/CSV Files (*.txt *.csv);;"
+    "HDF5 Files (*.h5 *.hdf);;"
+    "NetCDF Files (*.nc);;"
+    "All Files (*)"
+)
+
+# ENVI header 'data type' codes
+ENVI_DATA_TYPES = {
+    1: np.uint8, 2: np.int16, 3: np.int32, 4: np.float32, 5: np.float64,
+    12: np.uint16, 13: np.uint32, 14: np.int64, 15: np.uint64,
+}
+
+
+class SpectralLibrary:
+    """
+    A spectral library: N spectra sampled at B wavelengths.
+
+    Attributes:
+        spectra: (N, B) float32 array; a read-only memory map when loaded from the cache.
+        wavelengths: (B,) float64 array (band index when the source has none).
+        names: N spectrum names.
+        wavelength_units: Units of `wavelengths` as given by the source ('Unknown' if absent).
+        metadata: Source metadata (JSON-serializable values only).
+        source_path: File the library was parsed from.
+    """
+
+    def __init__(self, spectra: np.ndarray, wavelengths: np.ndarray, names: List[str],
+                 wavelength_units: str = "Unknown", metadata: Optional[Dict] = None,
+                 source_path: Optional[str] = None, fwhm: Optional[np.ndarray] = None):
+        if spectra.ndim != 2:
+            raise ValueError("Spectral library data is not a valid 2D array")
+        if len(wavelengths) != spectra.shape[1]:
+            raise ValueError("Wavelengths do not match spectral data dimensions")
+        names = list(names)[:spectra.shape[0]]
+        if len(names) < spectra.shape[0]:
+            names.extend(f"Spectrum {i + 1}" for i in range(len(names), spectra.shape[0]))
+
+        self.spectra = spectra
+        self.wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        self.names = names
+        self.wavelength_units = wavelength_units
+        self.metadata = metadata or {}
+        self.source_path = source_path
+        self.fwhm = None if fwhm is None or len(fwhm) != spectra.shape[1] else np.asarray(fwhm, dtype=np.float64)
+        # Source file version (mtime/size) the library was loaded from
+        self.signature: Optional[Dict] = None
+
+    @property
+    def num_spectra(self) -> int:
+        return self.spectra.shape[0]
+
+    @property
+    def num_bands(self) -> int:
+        return self.spectra.shape[1]
+
+    @property
+    def display_name(self) -> str:
+        return os.path.basename(self.source_path) if self.source_path else "Spectral Library"
+
+    def index_of(self, name: str) -> int:
+        return self.names.index(name)
+
+    def __len__(self) -> int:
+        return self.num_spectra
+
+    def __repr__(self) -> str:
+        return f"SpectralLibrary('{self.display_name}', spectra={self.num_spectra}, bands={self.num_bands})"
+
+
+# --- Parsers ---
+
+def _envi_list(value: str) -> List[str]:
+    return [v.strip() for v in value.strip().strip('{}').split(',') if v.strip()]
+
+
+def read_envi_header(hdr_path: str) -> Dict[str, str]:
+    """Parses an ENVI header into a dict of lowercase keys to raw string values."""
+    with open(hdr_path, 'r', errors='replace') as f:
+        text = f.read()
+    header = {}
+    # Values in braces may span several lines
+    for match in re.finditer(r'^\s*([^=\n]+?)\s*=\s*(\{[^}]*\}|[^\n]*)', text, re.MULTILINE):
+        header[match.group(1).strip().lower()] = match.group(2).strip()
+    return header
+
+
+def _find_envi_header(file_path: str) -> Optional[str]:
+    base = os.path.splitext(file_path)[0]
+    for candidate in (file_path + '.hdr', base + '.hdr', base + '.HDR'):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def _parse_sli(file_path: str) -> SpectralLibrary:
+    hdr_path = _find_envi_header(file_path)
+    if hdr_path is None:
+        return _parse_sli_gdal(file_path)
+
+    header = read_envi_header(hdr_path)
+    samples = int(header['samples'])
+    lines = int(header['lines'])
+    dtype = np.dtype(ENVI_DATA_TYPES[int(header.get('data type', 4))])
+    if int(header.get('byte order', 0)) == 1:
+        dtype = dtype.newbyteorder('>')
+    offset = int(header.get('header offset', 0))
+
+    # Rows = spectra, columns = wavelengths; read straight from disk, no GDAL round trip
+    raw = np.fromfile(file_path, dtype=dtype, count=samples * lines, offset=offset)
+    if raw.size != samples * lines:
+        raise ValueError(f"{file_path} is shorter than its header describes")
+    spectra = raw.reshape(lines, samples).astype(np.float32)
+
+    wavelengths = np.arange(samples, dtype=np.float64)
+    if 'wavelength' in header:
+        try:
+            wavelengths = np.array([float(w) for w in _envi_list(header['wavelength'])])
+        except ValueError as e:
+            logger.warning(f"Failed to parse wavelength metadata: {e}")
+    else:
+        logger.warning("No wavelength metadata found, using index as wavelength")
+
+    fwhm = None
+    if 'fwhm' in header:
+        try:
+            fwhm = np.array([float(w) for w in _envi_list(header['fwhm'])])
+        except ValueError:
+            fwhm = None
+
+    names = _envi_list(header.get('spectra names', ''))
+    metadata = {k: v for k, v in header.items() if k not in ('wavelength', 'spectra names', 'fwhm')}
+    return SpectralLibrary(spectra, wavelengths, names, header.get('wavelength units', 'Unknown'),
+                           metadata, file_path, fwhm)
+
+
+def _parse_sli_gdal(file_path: str) -> SpectralLibrary:
+    from osgeo import gdal
+    gdal.UseExceptions()
+
+    dataset = gdal.Open(file_path, gdal.GA_ReadOnly)
+    if dataset is None:
+        raise ValueError(f"GDAL could not open file: {file_path}")
+    spectra = dataset.ReadAsArray().astype(np.float32)
+    if spectra.ndim != 2:
+        raise ValueError("Spectral library data is not 2D")
+    metadata = dataset.GetMetadata() or {}
+    dataset = None
+
+    wavelengths = np.arange(spectra.shape[1], dtype=np.float64)
+    if 'wavelength' in metadata:
+        try:
+            wavelengths = np.array([float(w) for w in _envi_list(metadata['wavelength'])])
+        except ValueError as e:
+            logger.warning(f"Failed to parse wavelength metadata: {e}")
+    names = _envi_list(metadata.get('spectra names', ''))
+    return SpectralLibrary(spectra, wavelengths, names, metadata.get('wavelength units', 'Unknown'),
+                           dict(metadata), file_path)
+
+
+def _parse_text(file_path: str) -> SpectralLibrary:
+    """
+    Text/CSV library: header lines followed by numeric rows. The first column is
+    the wavelength, every further column a spectrum.
+    """
+    with open(file_path, 'r', errors='replace') as f:
+        lines = f.read().splitlines()
+
+    header_lines = []
+    data_start = None
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        try:
+            float(stripped.replace(',', ' ').split()[0])
+            data_start = i
+            break
+        except (ValueError, IndexError):
+            header_lines.append(stripped)
+    if data_start is None:
+        raise ValueError("No numeric data found in the file.")
+
+    body = "\n".join(lines[data_start:]).replace(',', ' ')
+    data = np.array(body.split(), dtype=np.float64)
+    columns = len(lines[data_start].replace(',', ' ').split())
+    if columns < 2 or data.size % columns:
+        raise ValueError("Data must have at least two columns (wavelengths, reflectance).")
+    data = data.reshape(-1, columns)
+
+    names = []
+    default_name = os.path.splitext(os.path.basename(file_path))[0]
+    for line in header_lines:
+        if line.lower().startswith('name:'):
+            default_name = line.split(':', 1)[1].strip()
+    if columns > 2 and header_lines:
+        # A column header row names the spectra
+        tokens = [t.strip().strip('"') for t in re.split(r'[,\t]|\s{2,}', header_lines[-1]) if t.strip()]
+        if len(tokens) == columns:
+            names = tokens[1:]
+    if not names:
+        names = [default_name] if columns == 2 else [f"{default_name} {i}" for i in range(1, columns)]
+
+    return SpectralLibrary(np.ascontiguousarray(data[:, 1:].T, dtype=np.float32), data[:, 0], names,
+                           "Unknown", {"header": header_lines}, file_path)
+
+
+def _json_safe(metadata: Dict) -> Dict:
+    safe = {}
+    for key, value in metadata.items():
+        if isinstance(value, bytes):
+            value = value.decode(errors='replace')
+        elif isinstance(value, np.ndarray):
+            value = value.tolist()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        try:
+            json.dumps(value)
+        except TypeError:
+            value = str(value)
+        safe[str(key)] = value
+    return safe
+
+
+def _decode_names(values) -> List[str]:
+    return [v.decode(errors='replace') if isinstance(v, bytes) else str(v) for v in np.atleast_1d(values)]
+
+
+def _parse_hdf5(file_path: str) -> SpectralLibrary:
+    if not H5PY_AVAILABLE:
+        raise ImportError("h5py is required to open HDF5 spectral libraries")
+    with h5py.File(file_path, 'r') as f:
+        dataset_names = [key for key in f.keys() if isinstance(f[key], h5py.Dataset) and f[key].ndim == 2]
+        if not dataset_names:
+            raise ValueError("No valid dataset found in HDF5 file")
+        spectra = f[dataset_names[0]][()].astype(np.float32)
+        metadata = dict(f.attrs)
+
+        if 'wavelengths' in f:
+            wavelengths = np.array(f['wavelengths'][()], dtype=np.float64)
+        elif 'wavelengths' in metadata:
+            wavelengths = np.array(metadata['wavelengths'], dtype=np.float64)
+        else:
+            wavelengths = np.arange(spectra.shape[1], dtype=np.float64)
+            logger.warning("No wavelengths found, using index as wavelength")
+
+        if 'spectra_names' in f:
+            names = _decode_names(f['spectra_names'][()])
+        else:
+            names = _decode_names(metadata.get('spectra_names', []))
+
+    units = metadata.pop('wavelength_units', 'Unknown')
+    metadata.pop('wavelengths', None)
+    metadata.pop('spectra_names', None)
+    return SpectralLibrary(spectra, wavelengths, names, str(units), _json_safe(metadata), file_path)
+
+
+def _parse_netcdf(file_path: str) -> SpectralLibrary:
+    if not NETCDF4_AVAILABLE:
+        raise ImportError("netCDF4 is required to open NetCDF spectral libraries")
+    with netCDF4.Dataset(file_path, 'r') as f:
+        data_vars = [var for var in f.variables if len(f.variables[var].shape) == 2]
+        if not data_vars:
+            raise ValueError("No valid 2D variable found in NetCDF file")
+        spectra = np.ma.filled(f.variables[data_vars[0]][:].astype(np.float32), np.nan)
+        metadata = {name: f.getncattr(name) for name in f.ncattrs()}
+
+        if 'wavelengths' in f.variables:
+            wavelengths = np.ma.filled(f.variables['wavelengths'][:], np.nan).astype(np.float64)
+        elif 'wavelengths' in metadata:
+            wavelengths = np.array(metadata['wavelengths'], dtype=np.float64)
+        else:
+            wavelengths = np.arange(spectra.shape[1], dtype=np.float64)
+            logger.warning("No wavelengths found, using index as wavelength")
+
+        if 'spectra_names' in f.variables:
+            names = _decode_names(f.variables['spectra_names'][:])
+        else:
+            names = _decode_names(metadata.get('spectra_names', []))
+
+    units = metadata.pop('wavelength_units', 'Unknown')
+    metadata.pop('wavelengths', None)
+    metadata.pop('spectra_names', None)
+    return SpectralLibrary(spectra, wavelengths, names, str(units), _json_safe(metadata), file_path)
+
+
+PARSERS = {
+    '.sli': _parse_sli,
+    '.txt': _parse_text,
+    '.csv': _parse_text,
+    '.h5': _parse_hdf5,
+    '.hdf': _parse_hdf5,
+    '.nc': _parse_netcdf,
+}
+
+
+def parse_spectral_library(file_path: str) -> SpectralLibrary:
+    """Parses a spectral library file (no caching)."""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    parser = PARSERS.get(file_ext)
+    if parser is None:
+        raise ValueError(f"Unsupported file format: {file_ext}")
+    return parser(file_path)
+
+
+# --- Binary store ---
+
+def _cache_entry(file_path: str, cache_dir: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, digest)
+
+
+def _source_signature(file_path: str) -> Dict:
+    """Identifies a source version: the file itself plus an ENVI header if there is one."""
+    paths = [file_path]
+    hdr = _find_envi_header(file_path) if file_path.lower().endswith('.sli') else None
+    if hdr:
+        paths.append(hdr)
+    signature = {}
+    for path in paths:
+        st = os.stat(path)
+        signature[os.path.abspath(path)] = [st.st_mtime_ns, st.st_size]
+    return signature
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    """
+    np.save to a temporary file next to `path`, then moved over it: libraries
+    still open on the old file keep a valid memory map.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npy.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_library_store(library: SpectralLibrary, store_dir: str, signature: Optional[Dict] = None) -> None:
+    """
+    Writes `library` as a binary store: `spectra.npy` and `wavelengths.npy` (raw,
+    memory-mappable) plus `library.json` with names, units, metadata and the source
+    signature. The JSON is written last, so a partly written store is never used.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    index_path = os.path.join(store_dir, 'library.json')
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    _save_array(os.path.join(store_dir, 'spectra.npy'), np.ascontiguousarray(library.spectra, dtype=np.float32))
+    _save_array(os.path.join(store_dir, 'wavelengths.npy'), library.wavelengths)
+    if library.fwhm is not None:
+        _save_array(os.path.join(store_dir, 'fwhm.npy'), library.fwhm)
+    index = {
+        'version': CACHE_VERSION,
+        'source_path': library.source_path,
+        'signature': signature or {},
+        'names': library.names,
+        'wavelength_units': library.wavelength_units,
+        'metadata': _json_safe(library.metadata),
+        'has_fwhm': library.fwhm is not None,
+    }
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+
+def load_library_store(store_dir: str, signature: Optional[Dict] = None) -> Optional[SpectralLibrary]:
+    """
+    Opens a binary store with the spectra memory-mapped (read-only). Returns None
+    if the store is missing, from another cache version or (when `signature` is
+    given) built from a different version of the source.
+    """
+    index_path = os.path.join(store_dir, 'library.json')
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != CACHE_VERSION:
+        return None
+    if signature is not None and index.get('signature') != signature:
+        return None
+
+    spectra = np.load(os.path.join(store_dir, 'spectra.npy'), mmap_mode='r')
+    wavelengths = np.load(os.path.join(store_dir, 'wavelengths.npy'))
+    fwhm = np.load(os.path.join(store_dir, 'fwhm.npy')) if index.get('has_fwhm') else None
+    return SpectralLibrary(spectra, wavelengths, index['names'], index.get('wavelength_units', 'Unknown'),
+                           index.get('metadata', {}), index.get('source_path'), fwhm)
+
+
+# --- Library registry ---
+
+_open_libraries: "OrderedDict[str, SpectralLibrary]" = OrderedDict()
+_registry_lock = threading.Lock()
+
+
+def load_spectral_library(file_path: str, use_cache: bool = True, cache_dir: str = CACHE_DIR) -> SpectralLibrary:
+    """
+    Opens a spectral library, converting it once into a memory-mapped binary store.
+
+    The store is keyed by the source path and validated against the source's mtime
+    and size, so edits to the source are picked up on the next open. Libraries opened
+    in this session are also kept in memory and shared by all callers (see
+    `open_libraries`).
+
+    Args:
+        file_path: Path to a .sli, .txt/.csv, .h5/.hdf or .nc library.
+        use_cache: Read and write the on-disk store (False always re-parses).
+        cache_dir: Root directory of the binary stores.
+
+    Returns:
+        The loaded SpectralLibrary.
+    """
+    key = os.path.abspath(file_path)
+    signature = _source_signature(file_path)
+
+    with _registry_lock:
+        library = _open_libraries.get(key)
+        if library is not None and library.signature == signature:
+            _open_libraries.move_to_end(key)
+            return library
+
+    library = None
+    store_dir = _cache_entry(file_path, cache_dir)
+    if use_cache:
+        try:
+            library = load_library_store(store_dir, signature)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable spectral library cache {store_dir}: {e}")
+        if library is not None:
+            logger.info(f"Loaded spectral library {file_path} from cache")
+
+    if library is None:
+        library = parse_spectral_library(file_path)
+        logger.info(f"Parsed spectral library {file_path}: {library.num_spectra} spectra, {library.num_bands} bands")
+        if use_cache:
+            try:
+                save_library_store(library, store_dir, signature)
+                cached = load_library_store(store_dir, signature)
+                if cached is not None:
+                    library = cached
+            except OSError as e:
+                logger.warning(f"Could not write spectral library cache {store_dir}: {e}")
+
+    library.source_path = file_path
+    library.signature = signature
+    with _registry_lock:
+        _open_libraries[key] = library
+        _open_libraries.move_to_end(key)
+        while len(_open_libraries) > MAX_OPEN_LIBRARIES:
+            _open_libraries.popitem(last=False)
+    return library
+
+
+def open_libraries() -> List[SpectralLibrary]:
+    """Spectral libraries opened in this session, most recently used last."""
+    with _registry_lock:
+        return list(_open_libraries.values())
+
+
+def clear_cache(cache_dir: str = CACHE_DIR) -> None:
+    """Removes all binary stores and forgets the open libraries."""
+    import shutil
+
+    with _registry_lock:
+        _open_libraries.clear()
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir, ignore_errors=True)
@@ -0,0 +1,263 @@
+# src/core/spectral_matching.py
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+MATCH_METHODS = {
+    'sam': "Spectral Angle Mapper (SAM)",
+    'sid': "Spectral Information Divergence (SID)",
+    'scm': "Spectral Correlation Mapper (SCM)",
+}
+# Upper bound of the per-tile (pixels x references) score matrix
+DEFAULT_TILE_BYTES = 64 * 1024 * 1024
+_SID_EPS = 1e-12
+
+
+class MatchResult:
+    """
+    Output of `SpectralMatcher.match`.
+
+    Attributes:
+        class_map: HxW int32 index of the best reference; -1 for invalid or
+            unclassified (beyond the threshold) pixels.
+        best_score: HxW float32 score of the best reference (angle in radians for
+            SAM, divergence for SID, correlation for SCM); NaN where invalid.
+        top_k: HxWxk int32 indices of the k best references (best first), or None.
+        scores: HxWxK float32 score of every reference, or None.
+    """
+
+    def __init__(self, method: str, reference_names: List[str], class_map: np.ndarray, best_score: np.ndarray,
+                 top_k: Optional[np.ndarray] = None, scores: Optional[np.ndarray] = None):
+        self.method = method
+        self.reference_names = reference_names
+        self.class_map = class_map
+        self.best_score = best_score
+        self.top_k = top_k
+        self.scores = scores
+
+    def class_counts(self) -> np.ndarray:
+        """Number of pixels assigned to each reference."""
+        labels = self.class_map[self.class_map >= 0]
+        return np.bincount(labels, minlength=len(self.reference_names))
+
+
+class SpectralMatcher:
+    """
+    Scores every pixel of a cube against a set of reference spectra.
+
+    All three measures reduce to matrix products between a tile of pixels and the
+    precomputed reference matrix, so a tile is scored with one or two BLAS GEMMs:
+
+    - SAM: cos(angle) = p_hat . r_hat, with unit-length spectra.
+    - SCM: Pearson correlation = SAM on mean-centred spectra.
+    - SID: D(p||q) + D(q||p) = H(p) + H(q) - p . log q - q . log p, with p, q the
+      spectra normalised to probability vectors and H(x) = sum x log x.
+
+    Tiles are processed on a thread pool (NumPy releases the GIL inside BLAS) and
+    written into preallocated outputs, so memory is bounded by the tile size.
+    """
+
+    def __init__(self, references: np.ndarray, method: str = 'sam', reference_names: Optional[Sequence[str]] = None):
+        references = np.asarray(references, dtype=np.float64)
+        if references.ndim == 1:
+            references = references[None, :]
+        if references.ndim != 2 or references.shape[0] == 0:
+            raise ValueError("References must be a (K, bands) array with at least one spectrum.")
+        if method not in MATCH_METHODS:
+            raise ValueError(f"Unknown matching method '{method}'. Choose from {list(MATCH_METHODS)}.")
+        if not np.isfinite(references).all():
+            raise ValueError("Reference spectra contain NaN or infinite values.")
+
+        self.method = method
+        self.num_references, self.num_bands = references.shape
+        names = list(reference_names) if reference_names is not None else []
+        self.reference_names = names + [f"Reference {i + 1}" for i in range(len(names), self.num_references)]
+
+        # Per-method reference matrices, transposed to (bands, K) for the GEMMs
+        if method == 'sam':
+            self._ref = self._unit_rows(references).T.astype(np.float32)
+        elif method == 'scm':
+            self._ref = self._unit_rows(references - references.mean(axis=1, keepdims=True)).T.astype(np.float32)
+        else:
+            q = self._probabilities(references)
+            log_q = np.log(q)
+            self._ref = q.T.astype(np.float32)
+            self._log_ref = log_q.T.astype(np.float32)
+            self._ref_entropy = (q * log_q).sum(axis=1).astype(np.float32)
+
+    @staticmethod
+    def _unit_rows(x: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(x, axis=1, keepdims=True)
+        return np.divide(x, norms, out=np.zeros_like(x), where=norms > 0)
+
+    @staticmethod
+    def _probabilities(x: np.ndarray) -> np.ndarray:
+        x = np.maximum(x, 0) + _SID_EPS
+        return x / x.sum(axis=1, keepdims=True)
+
+    def _rank_scores(self, pixels: np.ndarray, sq_norm: np.ndarray):
+        """
+        (N, K) ranking scores plus a per-pixel term converting them to reported units.
+
+        Per-pixel constants that do not change the ranking are left out of the GEMM:
+        the pixel norm for SAM, the pixel mean for SCM (the centred references sum to
+        zero) and H(p) for SID.
+        """
+        if self.method in ('sam', 'scm'):
+            scores = pixels @ self._ref
+            if self.method == 'sam':
+                norm = np.sqrt(sq_norm)
+            else:
+                # Centred explicitly: |p|^2 - B*mean^2 cancels badly in float32 for DN data
+                centred = pixels - pixels.mean(axis=1, keepdims=True)
+                norm = np.sqrt(np.einsum('ij,ij->i', centred, centred))
+            return scores, norm
+
+        p = self._probabilities(pixels)
+        log_p = np.log(p)
+        scores = p @ self._log_ref
+        scores += log_p @ self._ref
+        # H(q) - (p.log q + log p.q); adding H(p) gives the divergence
+        np.subtract(self._ref_entropy[None, :], scores, out=scores)
+        return scores, np.einsum('ij,ij->i', p, log_p)
+
+    def _to_score(self, scores: np.ndarray, term: np.ndarray) -> np.ndarray:
+        """Converts ranking scores (N,) or (N, K) to angle / divergence / correlation."""
+        term = term if scores.ndim == 1 else term[:, None]
+        if self.method == 'sid':
+            return np.maximum(scores + term, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cosine = np.clip(scores / term, -1.0, 1.0)
+        return np.arccos(cosine) if self.method == 'sam' else cosine
+
+    @property
+    def higher_is_better(self) -> bool:
+        """Whether a larger ranking score means a better match."""
+        return self.method != 'sid'
+
+    def score_pixels(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Scores (N, bands) pixels against all references.
+
+        Returns:
+            (N, K) float32: angle (radians) for SAM, divergence for SID, correlation for SCM.
+        """
+        pixels = np.ascontiguousarray(pixels, dtype=np.float32)
+        scores, term = self._rank_scores(pixels, np.einsum('ij,ij->i', pixels, pixels))
+        return self._to_score(scores, term).astype(np.float32)
+
+    def _select(self, scores: np.ndarray, top_k: int) -> np.ndarray:
+        """(N, top_k) indices of the best references, best first."""
+        pick = np.argmax if self.higher_is_better else np.argmin
+        if top_k == 1:
+            return pick(scores, axis=1)[:, None]
+        if top_k <= 8:
+            # A few arg-max passes are much cheaper than argpartition over K columns
+            rows = np.arange(scores.shape[0])
+            fill = -np.inf if self.higher_is_better else np.inf
+            ranked = np.empty((scores.shape[0], top_k), dtype=np.intp)
+            for j in range(top_k):
+                ranked[:, j] = pick(scores, axis=1)
+                scores[rows, ranked[:, j]] = fill
+            return ranked
+        order = -scores if self.higher_is_better else scores
+        part = np.argpartition(order, top_k - 1, axis=1)[:, :top_k]
+        return np.take_along_axis(part, np.argsort(np.take_along_axis(order, part, axis=1), axis=1), axis=1)
+
+    def match(self, data: np.ndarray, top_k: int = 1, threshold: Optional[float] = None,
+              return_scores: bool = False, nodata: Optional[float] = None, num_workers: Optional[int] = None,
+              tile_bytes: int = DEFAULT_TILE_BYTES,
+              progress_callback: Optional[Callable[[int, int], None]] = None) -> MatchResult:
+        """
+        Classifies an HxWxB cube against the references.
+
+        Args:
+            data: HxWxB image (any layout; tiles are gathered into contiguous blocks).
+            top_k: Number of best references to keep per pixel (1 = class map only).
+            threshold: Optional limit on the best score (maximum angle / divergence,
+                minimum correlation for SCM); pixels beyond it are unclassified (-1).
+            return_scores: Also return the full HxWxK score cube.
+            nodata: Pixels with this value in every band are treated as invalid.
+            num_workers: Worker threads (default: CPU count, at most 8).
+            tile_bytes: Approximate memory budget of a tile's score matrix.
+            progress_callback: Called as progress_callback(done_tiles, total_tiles).
+        """
+        if data.ndim != 3 or data.shape[2] != self.num_bands:
+            raise ValueError(f"Data has {data.shape[-1]} bands, references have {self.num_bands}. "
+                             "Resample the references to the image bands first.")
+        start = time.time()
+        h, w, bands = data.shape
+        k = self.num_references
+        top_k = max(1, min(int(top_k), k))
+
+        class_map = np.full((h, w), -1, dtype=np.int32)
+        best_score = np.full((h, w), np.nan, dtype=np.float32)
+        top_idx = np.full((h, w, top_k), -1, dtype=np.int32) if top_k > 1 else None
+        scores_out = np.full((h, w, k), np.nan, dtype=np.float32) if return_scores else None
+
+        # Rows per tile so that the (pixels x K) scores and the pixel block stay within budget
+        per_row = w * (k + bands) * 4
+        tile_rows = max(1, min(h, tile_bytes // max(per_row, 1)))
+        tiles = [(r0, min(r0 + tile_rows, h)) for r0 in range(0, h, tile_rows)]
+
+        def run_tile(r0: int, r1: int):
+            pixels = np.ascontiguousarray(data[r0:r1].reshape(-1, bands), dtype=np.float32)
+            # NaN/inf propagate into the squared norm; all-zero pixels have no direction
+            sq_norm = np.einsum('ij,ij->i', pixels, pixels)
+            valid = np.isfinite(sq_norm) & (sq_norm > 0)
+            if nodata is not None:
+                valid &= ~(pixels == nodata).all(axis=1)
+            idx = np.flatnonzero(valid)
+            if idx.size == 0:
+                return
+            if idx.size < valid.size:
+                pixels, sq_norm = pixels[idx], sq_norm[idx]
+
+            scores, term = self._rank_scores(pixels, sq_norm)
+            if scores_out is not None:
+                scores_out[r0:r1].reshape(-1, k)[idx] = self._to_score(scores, term)
+            best_raw = scores.max(axis=1) if self.higher_is_better else scores.min(axis=1)
+            ranked = self._select(scores, top_k)
+            best_vals = self._to_score(best_raw, term)
+            labels = ranked[:, 0].astype(np.int32)
+            if threshold is not None:
+                rejected = best_vals < threshold if self.method == 'scm' else best_vals > threshold
+                labels[rejected] = -1
+
+            class_map[r0:r1].reshape(-1)[idx] = labels
+            best_score[r0:r1].reshape(-1)[idx] = best_vals
+            if top_idx is not None:
+                top_idx[r0:r1].reshape(-1, top_k)[idx] = ranked
+
+        workers = num_workers or min(8, os.cpu_count() or 1)
+        done = 0
+        if workers <= 1 or len(tiles) == 1:
+            for r0, r1 in tiles:
+                run_tile(r0, r1)
+                done += 1
+                if progress_callback:
+                    progress_callback(done, len(tiles))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(run_tile, r0, r1) for r0, r1 in tiles]:
+                    future.result()
+                    done += 1
+                    if progress_callback:
+                        progress_callback(done, len(tiles))
+
+        logger.info(f"{self.method.upper()} matching of {h}x{w}x{bands} against {k} references "
+                    f"({len(tiles)} tiles, {workers} workers) took {time.time() - start:.2f}s")
+        return MatchResult(self.method, self.reference_names, class_map, best_score, top_idx, scores_out)
+
+
+def match_image(data: np.ndarray, references: np.ndarray, method: str = 'sam',
+                reference_names: Optional[Sequence[str]] = None, **kwargs) -> MatchResult:
+    """Convenience wrapper: `SpectralMatcher(references, method, names).match(data, **kwargs)`."""
+    return SpectralMatcher(references, method, reference_names).match(data, **kwargs)
@@ -0,0 +1,219 @@
+# src/core/spectral_reductions.py
+import logging
+import re
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# Per-pixel reductions over a band set, e.g. mean("layer@b10:b50")
+SPECTRAL_REDUCTIONS = {
+    'mean': "Mean of the bands",
+    'sum': "Sum of the bands",
+    'min': "Minimum of the bands",
+    'max': "Maximum of the bands",
+    'std': "Standard deviation of the bands",
+    'var': "Variance of the bands",
+    'argmin': "Wavelength (nm) of the lowest band, or its band number without wavelengths",
+    'argmax': "Wavelength (nm) of the highest band, or its band number without wavelengths",
+    'auc': "Area under the spectrum (trapezoidal, over nm when wavelengths are known)",
+    'depth': "Band depth: largest 1 - R / continuum, the continuum joining the first and last band",
+}
+# Native bytes of the band chunk read at a time for one tile
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+
+# A quoted band reference: "layer@b12" or a reduction over a band set, "layer@mean(b10:b50)"
+BAND_IDENTIFIER_PATTERN = r'"([^"]+@(?:b\d+|[a-z]+\([^"()]*\)))"'
+
+_BAND_SET = r'b\d+(?:\s*[:,]\s*b\d+)+'
+_CALL_RE = re.compile(r'\b(' + '|'.join(SPECTRAL_REDUCTIONS) + r')\s*\(\s*"([^"]+)@(' + _BAND_SET + r')"\s*\)')
+_IDENTIFIER_RE = re.compile(r'^(.+)@([a-z]+)\(([^"()]*)\)$')
+
+
+def parse_band_set(spec: str) -> List[int]:
+    """Zero-based bands of a band set such as "b10:b50", "b3,b5,b9" or "b60:b40,b12"."""
+    bands = []
+    for item in spec.split(','):
+        ends = [part.strip() for part in item.split(':')]
+        if len(ends) > 2 or not all(re.fullmatch(r'b\d+', end) for end in ends):
+            raise ValueError(f"Invalid band set '{spec}'. Use e.g. b10:b50 or b3,b5,b9.")
+        first, last = int(ends[0][1:]), int(ends[-1][1:])
+        step = 1 if last >= first else -1
+        bands.extend(b - 1 for b in range(first, last + step, step))
+    if any(b < 0 for b in bands):
+        raise ValueError(f"Band numbers start at 1 (in '{spec}').")
+    return list(dict.fromkeys(bands))
+
+
+def format_band_set(bands: Sequence[int]) -> str:
+    """Compact band set text for zero-based `bands`: ascending runs become bA:bB."""
+    parts = []
+    i = 0
+    while i < len(bands):
+        j = i
+        while j + 1 < len(bands) and bands[j + 1] == bands[j] + 1:
+            j += 1
+        parts.append(f"b{bands[i] + 1}:b{bands[j] + 1}" if j > i else f"b{bands[i] + 1}")
+        i = j + 1
+    return ','.join(parts)
+
+
+def reduction_identifier(layer_name: str, func: str, bands: Sequence[int]) -> str:
+    """The band identifier ("layer@func(bandset)") of a reduction, without quotes."""
+    return f"{layer_name}@{func}({format_band_set(bands)})"
+
+
+def rewrite_spectral_reductions(expression: str) -> str:
+    """
+    Rewrites reductions over band sets, e.g. mean("layer@b10:b50"), into single band
+    identifiers ("layer@mean(b10:b50)") that the calculator reads like any band.
+    A reduction of a single band (mean("layer@b5")) keeps its whole-image meaning.
+    """
+    def replace(match):
+        func, layer_name, spec = match.groups()
+        return f'"{reduction_identifier(layer_name, func, parse_band_set(spec))}"'
+    return _CALL_RE.sub(replace, expression)
+
+
+def parse_reduction_identifier(identifier: str) -> Optional[Tuple[str, str, List[int]]]:
+    """(layer name, reduction, zero-based bands) of a reduction identifier; None for a plain band."""
+    match = _IDENTIFIER_RE.match(identifier)
+    if match is None:
+        return None
+    layer_name, func, spec = match.groups()
+    if func not in SPECTRAL_REDUCTIONS:
+        raise ValueError(f"Unknown spectral reduction '{func}'. Use one of: {', '.join(SPECTRAL_REDUCTIONS)}.")
+    return layer_name, func, parse_band_set(spec)
+
+
+class SpectralReduction:
+    """
+    A per-pixel reduction over a set of bands, computed tile by tile.
+
+    For each tile the bands are read a chunk at a time (as many as fit in
+    `chunk_bytes`) and folded into running per-pixel accumulators, so the band
+    subset is never held in memory. Mean, variance and std merge chunk moments
+    (Chan et al.); argmin/argmax keep the best value and its position; auc adds
+    trapezoids, carrying the last band of each chunk over to the next; depth
+    first reads the two end bands to build the continuum line.
+
+    Bands are processed in wavelength order when `wavelengths` are given (and
+    positions are reported in nm), otherwise in band order (positions are
+    1-based band numbers).
+
+    Args:
+        func: One of SPECTRAL_REDUCTIONS.
+        read_bands: Function reading rows [y0, y1) of the given zero-based bands
+            as a (rows, cols, len(bands)) array: read_bands(bands, y0, y1).
+        bands: Zero-based bands to reduce over.
+        wavelengths: Optional band centres (nm) of all bands of the layer.
+        chunk_bytes: Approximate bytes of one band chunk.
+        nodata: Optional nodata value; pixels holding it (or NaN) in any of the
+            bands are NaN in the result.
+    """
+
+    def __init__(self, func: str, read_bands: Callable[[Sequence[int], int, int], np.ndarray],
+                 bands: Sequence[int], wavelengths: Optional[np.ndarray] = None,
+                 chunk_bytes: int = DEFAULT_CHUNK_BYTES, nodata: Optional[float] = None):
+        if func not in SPECTRAL_REDUCTIONS:
+            raise ValueError(f"Unknown spectral reduction '{func}'. Use one of: {', '.join(SPECTRAL_REDUCTIONS)}.")
+        bands = np.asarray(list(bands), dtype=np.intp)
+        if bands.size == 0:
+            raise ValueError(f"{func}() needs at least one band.")
+        if wavelengths is not None:
+            x = np.asarray(wavelengths, dtype=np.float64)[bands]
+            order = np.argsort(x, kind='stable')
+            self.bands, self.x = bands[order], x[order]
+        else:
+            self.bands, self.x = bands, bands.astype(np.float64) + 1
+        if func == 'depth' and (self.bands.size < 3 or self.x[-1] == self.x[0]):
+            raise ValueError("depth() needs at least three bands with distinct wavelengths.")
+        self.func = func
+        self.read_bands = read_bands
+        self.chunk_bytes = chunk_bytes
+        self.nodata = nodata
+
+    def _read(self, chunk: slice, y0: int, y1: int) -> np.ndarray:
+        return np.asarray(self.read_bands(self.bands[chunk].tolist(), y0, y1), dtype=np.float32)
+
+    def _blocks(self, y0: int, y1: int):
+        """Yields (band chunk, (rows, cols, n) float32 block) in processing order."""
+        start, size = 0, 1
+        while start < self.bands.size:
+            chunk = slice(start, min(start + size, self.bands.size))
+            block = self._read(chunk, y0, y1)
+            yield chunk, block
+            # The first (single band) read tells the tile size; later chunks fill chunk_bytes
+            size = max(1, self.chunk_bytes // max(block.shape[0] * block.shape[1] * 4, 1))
+            start = chunk.stop
+
+    def read(self, y0: int, y1: int) -> np.ndarray:
+        """The reduction over rows [y0, y1), as a float32 (rows, cols) array."""
+        func = self.func
+        acc = best = pos = prev = first = slope = invalid = None
+        count = 0
+        if func == 'depth':
+            ends = self._read(slice(0, self.bands.size, self.bands.size - 1), y0, y1)
+            first = ends[:, :, 0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                slope = (ends[:, :, 1] - first) / (self.x[-1] - self.x[0])
+
+        for chunk, block in self._blocks(y0, y1):
+            x = self.x[chunk]
+            n = block.shape[2]
+            if self.nodata is not None:
+                bad = ((block == self.nodata) | np.isnan(block)).any(axis=2)
+                invalid = bad if invalid is None else (invalid | bad)
+
+            if func in ('sum', 'mean'):
+                part = block.sum(axis=2, dtype=np.float64)
+                acc = part if acc is None else acc + part
+            elif func in ('min', 'max'):
+                part = block.min(axis=2) if func == 'min' else block.max(axis=2)
+                acc = part if acc is None else (np.minimum(acc, part) if func == 'min' else np.maximum(acc, part))
+            elif func in ('var', 'std'):
+                mean_b = block.mean(axis=2, dtype=np.float64)
+                m2_b = np.square(block - mean_b[:, :, None]).sum(axis=2)
+                if acc is None:
+                    acc, best = mean_b, m2_b
+                else:
+                    delta = mean_b - acc
+                    total = count + n
+                    acc = acc + delta * (n / total)
+                    best = best + m2_b + delta * delta * (count * n / total)
+            elif func in ('argmin', 'argmax'):
+                idx = block.argmin(axis=2) if func == 'argmin' else block.argmax(axis=2)
+                value = np.take_along_axis(block, idx[:, :, None], axis=2)[:, :, 0]
+                if acc is None:
+                    acc, pos = value, x[idx]
+                else:
+                    better = value < acc if func == 'argmin' else value > acc
+                    acc = np.where(better, value, acc)
+                    pos = np.where(better, x[idx], pos)
+            elif func == 'auc':
+                part = (np.diff(x) * 0.5 * (block[:, :, 1:] + block[:, :, :-1])).sum(axis=2, dtype=np.float64)
+                if prev is not None:
+                    part += (x[0] - prev[1]) * 0.5 * (block[:, :, 0] + prev[0])
+                acc = part if acc is None else acc + part
+                prev = (block[:, :, -1], x[-1])
+            else:  # depth
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    continuum = first[:, :, None] + slope[:, :, None] * (x - self.x[0])
+                    part = (1.0 - block / continuum).max(axis=2)
+                acc = part if acc is None else np.maximum(acc, part)
+            count += n
+
+        if func == 'mean':
+            acc = acc / count
+        elif func == 'var':
+            acc = best / count
+        elif func == 'std':
+            acc = np.sqrt(best / count)
+        elif func in ('argmin', 'argmax'):
+            acc = pos
+        acc = acc.astype(np.float32, copy=False)
+        if invalid is not None and invalid.any():
+            acc = np.where(invalid, np.float32(np.nan), acc)
+        return acc
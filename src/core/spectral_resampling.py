@@ -0,0 +1,264 @@
+# src/core/spectral_resampling.py
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from src.core.spectral_library import SpectralLibrary
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# Gaussian SRFs are truncated at this many standard deviations
+SRF_TRUNCATION_SIGMA = 3.0
+_FWHM_TO_SIGMA = 1.0 / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+
+# Unit factors to nanometres
+_UNIT_SCALE = {
+    'nm': 1.0, 'nanometer': 1.0, 'nanometers': 1.0, 'nanometre': 1.0, 'nanometres': 1.0,
+    'um': 1000.0, 'µm': 1000.0, 'micrometer': 1000.0, 'micrometers': 1000.0, 'micrometre': 1000.0,
+    'micrometres': 1000.0, 'micron': 1000.0, 'microns': 1000.0,
+    'mm': 1.0e6, 'millimeter': 1.0e6, 'millimeters': 1.0e6,
+}
+
+# Response matrices depend only on the two spectral grids, so they are cached at
+# module level and shared by every library / layer pair with the same grids.
+_MAX_CACHED_MATRICES = 64
+_matrix_cache: "OrderedDict[Tuple, sparse.csr_matrix]" = OrderedDict()
+_matrix_lock = threading.Lock()
+
+
+def nanometer_scale(values: Sequence[float], units: Optional[str] = None) -> float:
+    """
+    Factor converting wavelengths in `units` to nanometres. Unknown units are guessed
+    from the value range: centres below 30 are taken as micrometres, anything else
+    as nanometres.
+    """
+    key = (units or '').strip().lower()
+    if key in _UNIT_SCALE:
+        return _UNIT_SCALE[key]
+    values = np.asarray(values, dtype=np.float64)
+    if values.size and np.nanmax(values) < 30.0:
+        return 1000.0
+    return 1.0
+
+
+def to_nanometers(values: Sequence[float], units: Optional[str] = None) -> np.ndarray:
+    """Converts wavelengths to nanometres (see `nanometer_scale`)."""
+    values = np.asarray(values, dtype=np.float64)
+    return values * nanometer_scale(values, units)
+
+
+def _grid_key(wavelengths: np.ndarray, fwhm: Optional[np.ndarray]) -> Tuple:
+    return (wavelengths.tobytes(), None if fwhm is None else fwhm.tobytes())
+
+
+def _sample_widths(wavelengths: np.ndarray) -> np.ndarray:
+    """Width of each source sample (trapezoid rule) for integrating SRFs on an irregular grid."""
+    if wavelengths.size < 2:
+        return np.ones_like(wavelengths)
+    edges = np.empty(wavelengths.size + 1)
+    edges[1:-1] = (wavelengths[1:] + wavelengths[:-1]) / 2
+    edges[0] = wavelengths[0] - (edges[1] - wavelengths[0])
+    edges[-1] = wavelengths[-1] + (wavelengths[-1] - edges[-2])
+    return np.abs(np.diff(edges))
+
+
+def _interpolation_rows(src: np.ndarray, centers: np.ndarray):
+    """(rows, cols, weights) of linear interpolation from `src` (sorted) to `centers`."""
+    inside = np.flatnonzero((centers >= src[0]) & (centers <= src[-1]))
+    if inside.size == 0 or src.size < 2:
+        exact = np.flatnonzero(np.isin(centers, src))
+        return exact, np.searchsorted(src, centers[exact]), np.ones(exact.size)
+    hi = np.clip(np.searchsorted(src, centers[inside], side='right'), 1, src.size - 1)
+    lo = hi - 1
+    t = (centers[inside] - src[lo]) / (src[hi] - src[lo])
+    rows = np.concatenate([inside, inside])
+    cols = np.concatenate([lo, hi])
+    weights = np.concatenate([1.0 - t, t])
+    return rows, cols, weights
+
+
+def _build_matrix(src: np.ndarray, dst: np.ndarray, fwhm: Optional[np.ndarray]) -> sparse.csr_matrix:
+    # Work on a sorted source grid and map the columns back at the end
+    order = np.argsort(src, kind='stable')
+    src_sorted = src[order]
+    n_dst, n_src = dst.size, src.size
+
+    rows_all, cols_all, weights_all = [], [], []
+    interp_targets = np.arange(n_dst)
+    if fwhm is not None:
+        sigma = np.maximum(fwhm, 0.0) * _FWHM_TO_SIGMA
+        widths = _sample_widths(src_sorted)
+        lo = np.searchsorted(src_sorted, dst - SRF_TRUNCATION_SIGMA * sigma, side='left')
+        hi = np.searchsorted(src_sorted, dst + SRF_TRUNCATION_SIGMA * sigma, side='right')
+        counts = hi - lo
+        # SRFs sampled by fewer than two source points (source coarser than the band)
+        # would alias; those bands are interpolated instead
+        use_srf = (counts >= 2) & (sigma > 0)
+        srf_rows = np.flatnonzero(use_srf)
+        if srf_rows.size:
+            n = counts[srf_rows]
+            rows = np.repeat(srf_rows, n)
+            starts = np.repeat(lo[srf_rows] - np.cumsum(n) + n, n)
+            cols = starts + np.arange(rows.size)
+            z = (src_sorted[cols] - dst[rows]) / sigma[rows]
+            weights = np.exp(-0.5 * z * z) * widths[cols]
+            rows_all.append(rows)
+            cols_all.append(cols)
+            weights_all.append(weights)
+        interp_targets = np.flatnonzero(~use_srf)
+
+    if interp_targets.size:
+        r, c, w = _interpolation_rows(src_sorted, dst[interp_targets])
+        rows_all.append(interp_targets[r])
+        cols_all.append(c)
+        weights_all.append(w)
+
+    rows = np.concatenate(rows_all) if rows_all else np.empty(0, dtype=np.intp)
+    cols = np.concatenate(cols_all) if cols_all else np.empty(0, dtype=np.intp)
+    weights = np.concatenate(weights_all) if weights_all else np.empty(0)
+
+    matrix = sparse.csr_matrix((weights, (rows, order[cols])), shape=(n_dst, n_src))
+    # Normalise every band's response to unit area
+    row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+    scale = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)
+    matrix = sparse.diags(scale) @ matrix
+    return matrix.astype(np.float32).tocsr()
+
+
+def build_resampling_matrix(src_wavelengths: Sequence[float], dst_wavelengths: Sequence[float],
+                            dst_fwhm: Optional[Sequence[float]] = None, src_units: Optional[str] = None,
+                            dst_units: Optional[str] = None) -> sparse.csr_matrix:
+    """
+    Sparse spectral response matrix M (dst_bands x src_bands) so that
+    `resampled = spectra @ M.T`.
+
+    Each target band is a Gaussian SRF (centre and FWHM) integrated over the source
+    samples, truncated at 3 sigma and normalised to unit area. Without FWHM, or where
+    the source is too coarse to sample the SRF, target bands are linearly
+    interpolated. Target bands outside the source range get an empty row (NaN).
+    Matrices are cached per (source grid, target grid).
+
+    Args:
+        src_wavelengths: Wavelengths of the spectra to resample.
+        dst_wavelengths: Band centres of the target sensor.
+        dst_fwhm: Optional band FWHMs of the target sensor (same units as the centres).
+        src_units, dst_units: Wavelength units (guessed from the values when unknown).
+    """
+    src = to_nanometers(src_wavelengths, src_units)
+    dst_scale = nanometer_scale(dst_wavelengths, dst_units)
+    dst = np.asarray(dst_wavelengths, dtype=np.float64) * dst_scale
+    fwhm = None
+    if dst_fwhm is not None and len(dst_fwhm) == dst.size:
+        # FWHM shares the centres' units
+        fwhm = np.asarray(dst_fwhm, dtype=np.float64) * dst_scale
+
+    key = _grid_key(src, None) + _grid_key(dst, fwhm)
+    with _matrix_lock:
+        cached = _matrix_cache.get(key)
+        if cached is not None:
+            _matrix_cache.move_to_end(key)
+            return cached
+
+    matrix = _build_matrix(src, dst, fwhm)
+    logger.info(f"Built spectral response matrix {matrix.shape} ({matrix.nnz} non-zeros, "
+                f"{'Gaussian SRF' if fwhm is not None else 'linear interpolation'})")
+    with _matrix_lock:
+        _matrix_cache[key] = matrix
+        while len(_matrix_cache) > _MAX_CACHED_MATRICES:
+            _matrix_cache.popitem(last=False)
+    return matrix
+
+
+def apply_resampling_matrix(spectra: np.ndarray, matrix: sparse.csr_matrix) -> np.ndarray:
+    """
+    Resamples (N, src_bands) spectra with one sparse matrix product. NaN samples
+    are left out and the remaining weights renormalised; bands without any valid
+    sample are NaN.
+    """
+    spectra = np.asarray(spectra, dtype=np.float32)
+    single = spectra.ndim == 1
+    if single:
+        spectra = spectra[None, :]
+    matrix_t = matrix.T.tocsr()
+
+    out = np.asarray(spectra @ matrix_t, dtype=np.float32)
+    # NaN samples propagate into the product; only then is the masked path needed
+    if not np.isfinite(out).all():
+        valid = np.isfinite(spectra)
+        numerator = np.asarray(np.where(valid, spectra, 0.0).astype(np.float32) @ matrix_t)
+        weight = np.asarray(valid.astype(np.float32) @ matrix_t)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = np.where(weight > 1e-6, numerator / weight, np.nan).astype(np.float32)
+    empty = np.diff(matrix.indptr) == 0
+    if empty.any():
+        out[:, empty] = np.nan
+    return out[0] if single else out
+
+
+def resample_spectra(spectra: np.ndarray, src_wavelengths: Sequence[float], dst_wavelengths: Sequence[float],
+                     dst_fwhm: Optional[Sequence[float]] = None, src_units: Optional[str] = None,
+                     dst_units: Optional[str] = None) -> np.ndarray:
+    """Resamples (N, src_bands) or (src_bands,) spectra to the target band set."""
+    matrix = build_resampling_matrix(src_wavelengths, dst_wavelengths, dst_fwhm, src_units, dst_units)
+    return apply_resampling_matrix(spectra, matrix)
+
+
+def resample_library(library: SpectralLibrary, dst_wavelengths: Sequence[float],
+                     dst_fwhm: Optional[Sequence[float]] = None, dst_units: Optional[str] = None) -> SpectralLibrary:
+    """
+    Returns `library` resampled to a sensor band set. The result keeps the names and
+    metadata and carries the target wavelengths in nanometres.
+    """
+    src_units = None if library.wavelength_units == "Unknown" else library.wavelength_units
+    matrix = build_resampling_matrix(library.wavelengths, dst_wavelengths, dst_fwhm, src_units, dst_units)
+    resampled = apply_resampling_matrix(library.spectra, matrix)
+    scale = nanometer_scale(dst_wavelengths, dst_units)
+    target = np.asarray(dst_wavelengths, dtype=np.float64) * scale
+    fwhm = None
+    if dst_fwhm is not None and len(dst_fwhm) == target.size:
+        fwhm = np.asarray(dst_fwhm, dtype=np.float64) * scale
+    result = SpectralLibrary(resampled, target, library.names, "Nanometers", dict(library.metadata),
+                             library.source_path, fwhm)
+    result.metadata['resampled_from'] = library.display_name
+    return result
+
+
+def layer_spectral_grid(layer: dict) -> Optional[Tuple[np.ndarray, Optional[np.ndarray], Optional[str]]]:
+    """
+    (wavelengths, fwhm, units) of an image layer, read from the layer or its
+    metadata; None if the layer has no wavelength per band.
+    """
+    metadata = layer.get("metadata", {}) or {}
+    num_bands = layer["data"].shape[2]
+
+    def _values(value):
+        if isinstance(value, str):
+            value = value.strip("{} \n").replace(",", " ").split()
+        try:
+            values = np.asarray([float(v) for v in value], dtype=np.float64)
+        except (TypeError, ValueError):
+            return None
+        return values if values.size == num_bands else None
+
+    wavelengths = _values(layer.get("wavelengths") or metadata.get("Wavelengths") or metadata.get("wavelength") or [])
+    if wavelengths is None:
+        return None
+    fwhm = _values(layer.get("fwhm") or metadata.get("FWHM") or metadata.get("fwhm") or [])
+    units = layer.get("wavelength_units") or metadata.get("wavelength units")
+    if units in (None, "", "Unknown"):
+        units = None
+    return wavelengths, fwhm, units
+
+
+def resample_library_to_layer(library: SpectralLibrary, layer: dict) -> SpectralLibrary:
+    """Resamples `library` to the bands of an image layer (see `layer_spectral_grid`)."""
+    grid = layer_spectral_grid(layer)
+    if grid is None:
+        raise ValueError(f"Layer '{layer.get('name', 'Layer')}' has no wavelength for every band.")
+    wavelengths, fwhm, units = grid
+    return resample_library(library, wavelengths, fwhm, units)
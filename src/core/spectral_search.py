@@ -0,0 +1,165 @@
+# src/core/spectral_search.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from src.core.spectral_library import SpectralLibrary
+from src.core.spectral_resampling import layer_spectral_grid, resample_library_to_layer
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXPLAINED_VARIANCE = 0.999
+DEFAULT_MAX_COMPONENTS = 16
+_MAX_CACHED_INDEXES = 8
+_index_cache: "OrderedDict[Tuple, SpectralSearchIndex]" = OrderedDict()
+_index_lock = threading.Lock()
+
+
+class SearchHit:
+    """One search result: library row, spectrum name and spectral angle (radians)."""
+
+    def __init__(self, index: int, name: str, angle: float):
+        self.index = index
+        self.name = name
+        self.angle = angle
+
+    @property
+    def angle_degrees(self) -> float:
+        return float(np.degrees(self.angle))
+
+    def __repr__(self) -> str:
+        return f"SearchHit({self.name!r}, angle={self.angle_degrees:.3f} deg)"
+
+
+class SpectralSearchIndex:
+    """
+    Nearest-spectrum search by spectral angle.
+
+    Spectra are scaled to unit length, so the Euclidean distance between two of
+    them is a monotone function of their spectral angle (|a - b|^2 = 2 - 2 cos).
+    They are projected onto the leading principal components and stored in a
+    KD-tree. Projection never increases distances, so tree distances are lower
+    bounds of the true ones: candidates from the tree are re-ranked exactly on the
+    full spectra, and the candidate set is widened until no unseen spectrum can
+    beat the k-th result. The answer is therefore exact, not approximate.
+    """
+
+    def __init__(self, spectra: np.ndarray, names: Optional[Sequence[str]] = None,
+                 explained_variance: float = DEFAULT_EXPLAINED_VARIANCE,
+                 max_components: int = DEFAULT_MAX_COMPONENTS):
+        start = time.time()
+        # Kept as given (on the query bands) so hits can be displayed next to the query
+        self.spectra = spectra
+        spectra = np.asarray(spectra, dtype=np.float64)
+        if spectra.ndim != 2 or spectra.shape[0] == 0:
+            raise ValueError("The search index needs a non-empty (N, bands) array of spectra.")
+
+        # Bands missing in any spectrum (e.g. outside a resampled library's range) are not used
+        self.band_mask = np.isfinite(spectra).all(axis=0)
+        if not self.band_mask.any():
+            raise ValueError("No band is valid in every library spectrum.")
+        x = spectra[:, self.band_mask]
+        norms = np.linalg.norm(x, axis=1)
+        # Rows that can take part (non-zero); `rows` maps index positions to library rows
+        self.rows = np.flatnonzero(norms > 0)
+        x = x[self.rows] / norms[self.rows, None]
+        names = list(names) if names is not None else []
+        self.names = [names[i] if i < len(names) else f"Spectrum {i + 1}" for i in range(spectra.shape[0])]
+
+        self.mean = x.mean(axis=0)
+        centred = x - self.mean
+        eigvals, eigvecs = np.linalg.eigh(centred.T @ centred)
+        eigvals, eigvecs = eigvals[::-1], eigvecs[:, ::-1]
+        total = eigvals.sum()
+        if total > 0:
+            cumulative = np.cumsum(eigvals) / total
+            n_components = int(np.searchsorted(cumulative, explained_variance) + 1)
+        else:
+            n_components = 1
+        n_components = max(1, min(n_components, max_components, x.shape[1]))
+        self.components = np.ascontiguousarray(eigvecs[:, :n_components])
+
+        self.unit_spectra = np.ascontiguousarray(x, dtype=np.float32)
+        self.tree = cKDTree(centred @ self.components, leafsize=16)
+        logger.info(f"Spectral search index: {len(self.rows)} spectra, {x.shape[1]} bands, "
+                    f"{n_components} components, built in {time.time() - start:.2f}s")
+
+    @property
+    def size(self) -> int:
+        return len(self.rows)
+
+    def _unit_query(self, spectrum: np.ndarray) -> Optional[np.ndarray]:
+        q = np.asarray(spectrum, dtype=np.float64)[self.band_mask]
+        if not np.isfinite(q).all():
+            return None
+        norm = np.linalg.norm(q)
+        return q / norm if norm > 0 else None
+
+    def query(self, spectrum: np.ndarray, k: int = 5) -> List[SearchHit]:
+        """
+        The `k` library spectra with the smallest spectral angle to `spectrum`
+        (given on the library's bands), best first. Empty if the spectrum is
+        zero or has invalid values.
+        """
+        u = self._unit_query(spectrum)
+        if u is None or self.size == 0:
+            return []
+        k = min(k, self.size)
+        z = (u - self.mean) @ self.components
+
+        candidates = min(self.size, max(4 * k, 16))
+        while True:
+            bounds, idx = self.tree.query(z, k=candidates)
+            bounds, idx = np.atleast_1d(bounds), np.atleast_1d(idx)
+            cosines = self.unit_spectra[idx] @ u.astype(np.float32)
+            order = np.argsort(-cosines)[:k]
+            kth_distance = np.sqrt(max(2.0 - 2.0 * float(cosines[order[-1]]), 0.0))
+            # Unseen spectra are at least bounds[-1] away; stop once that cannot beat the k-th hit
+            if candidates >= self.size or kth_distance <= bounds[-1]:
+                break
+            candidates = min(self.size, candidates * 4)
+
+        angles = np.arccos(np.clip(cosines[order], -1.0, 1.0))
+        return [SearchHit(int(self.rows[idx[i]]), self.names[self.rows[idx[i]]], float(a))
+                for i, a in zip(order, angles)]
+
+
+def get_search_index(library: SpectralLibrary, layer: Optional[dict] = None) -> SpectralSearchIndex:
+    """
+    Search index over `library`, resampled to the bands of `layer` when given.
+    Indexes are cached per (library source version, layer spectral grid).
+    """
+    grid = layer_spectral_grid(layer) if layer is not None else None
+    key = (
+        library.source_path or id(library),
+        repr(sorted(library.signature.items())) if library.signature else None,
+        None if grid is None else grid[0].tobytes(),
+        None if grid is None or grid[1] is None else grid[1].tobytes(),
+        None if grid is None else grid[2],
+    )
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+
+    if grid is not None:
+        source = resample_library_to_layer(library, layer)
+    elif layer is not None and layer["data"].shape[2] != library.num_bands:
+        raise ValueError(f"Layer '{layer.get('name', 'Layer')}' has no wavelengths and a different "
+                         f"number of bands than {library.display_name}.")
+    else:
+        source = library
+    index = SpectralSearchIndex(source.spectra, source.names)
+
+    with _index_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > _MAX_CACHED_INDEXES:
+            _index_cache.popitem(last=False)
+    return index
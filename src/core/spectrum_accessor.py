@@ -0,0 +1,61 @@
+# src/core/spectrum_accessor.py
+import logging
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_BYTES = 8 * 1024 * 1024
+
+
+class SpectrumAccessor:
+    """
+    Fast repeated access to single-pixel spectra of an HxWxB cube.
+
+    Loaded cubes are usually `np.moveaxis` views of GDAL's band-sequential array,
+    so one spectrum is B scattered reads. The accessor keeps a few contiguous
+    (pixel-interleaved) copies of row blocks around the cursor; while the mouse
+    moves inside a block every spectrum is a single contiguous slice.
+    """
+
+    def __init__(self, data: np.ndarray, block_bytes: int = DEFAULT_BLOCK_BYTES, max_blocks: int = 4):
+        if data.ndim != 3:
+            raise ValueError("SpectrumAccessor expects an HxWxB array")
+        self.data = data
+        h, w, b = data.shape
+        self.height, self.width, self.num_bands = h, w, b
+        self.block_rows = max(1, min(h, block_bytes // max(w * b * data.dtype.itemsize, 1)))
+        self.max_blocks = max_blocks
+        self._blocks: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        # Already pixel-interleaved and contiguous: no caching needed
+        self._direct = data.flags['C_CONTIGUOUS']
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        return 0 <= y < self.height and 0 <= x < self.width
+
+    def _block(self, y: int) -> Tuple[np.ndarray, int]:
+        index = y // self.block_rows
+        block = self._blocks.get(index)
+        if block is None:
+            y0 = index * self.block_rows
+            block = np.ascontiguousarray(self.data[y0:y0 + self.block_rows])
+            self._blocks[index] = block
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(index)
+        return block, index * self.block_rows
+
+    def spectrum(self, x: int, y: int) -> np.ndarray:
+        """Returns the spectrum at pixel (x, y) as a 1D array (a view into the cache)."""
+        if self._direct:
+            return self.data[y, x]
+        block, y0 = self._block(y)
+        return block[y - y0, x]
+
+    def invalidate(self):
+        """Drops cached blocks (call after the underlying data was modified in place)."""
+        self._blocks.clear()
@@ -0,0 +1,126 @@
+# src/core/transform_stats.py
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from src.core.component_transform import forward_transform
+
+# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# Transform statistics files are NumPy .npz archives with this extension
+TRANSFORM_STATS_EXTENSION = '.tsta.npz'
+TRANSFORM_STATS_FORMAT = 1
+# Wavelengths (nm) of two scenes further apart than this are reported as a sensor mismatch
+_WAVELENGTH_TOLERANCE_NM = 1.0
+
+
+class TransformStatistics:
+    """
+    Everything needed to re-apply an MNF or PCA transform without re-estimating
+    it, in the spirit of ENVI's .sta files: band means, signal (and noise)
+    covariance, eigenvalues, the forward transform (components = (x - mean) @ forward)
+    and its inverse (x = components @ inverse + mean), plus provenance (source
+    scene, sampling, creation time). Saved as a NumPy .npz archive.
+
+    Args:
+        method: 'mnf' or 'pca'.
+        mean: Band means (bands,).
+        forward: (bands, bands) forward transform, components in columns.
+        eigenvalues: Eigenvalues, descending.
+        signal_cov: (bands, bands) signal covariance.
+        noise_cov: Optional (bands, bands) noise covariance (MNF).
+        inverse: Optional (bands, bands) inverse transform (default: pseudo-inverse of `forward`).
+        wavelengths: Optional band centres (nm).
+        provenance: Optional JSON-serializable description of where the statistics come from.
+    """
+
+    def __init__(self, method: str, mean: np.ndarray, forward: np.ndarray, eigenvalues: np.ndarray,
+                 signal_cov: np.ndarray, noise_cov: Optional[np.ndarray] = None,
+                 inverse: Optional[np.ndarray] = None, wavelengths: Optional[np.ndarray] = None,
+                 provenance: Optional[Dict] = None):
+        self.method = method
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.forward = np.asarray(forward, dtype=np.float64)
+        self.eigenvalues = np.asarray(eigenvalues, dtype=np.float64)
+        self.signal_cov = np.asarray(signal_cov, dtype=np.float64)
+        self.noise_cov = None if noise_cov is None else np.asarray(noise_cov, dtype=np.float64)
+        self.inverse = np.linalg.pinv(self.forward) if inverse is None else np.asarray(inverse, dtype=np.float64)
+        self.wavelengths = None if wavelengths is None else np.asarray(wavelengths, dtype=np.float64)
+        self.provenance = dict(provenance or {})
+        self.provenance.setdefault('created', datetime.now(timezone.utc).isoformat(timespec='seconds'))
+
+    @property
+    def num_bands(self) -> int:
+        return self.mean.shape[0]
+
+    def save(self, file_path: str) -> str:
+        """Writes the statistics; returns the path written (the extension is added if missing)."""
+        if not file_path.endswith('.npz'):
+            file_path += TRANSFORM_STATS_EXTENSION
+        arrays = {
+            'format': np.array(TRANSFORM_STATS_FORMAT), 'method': np.array(self.method),
+            'mean': self.mean, 'forward': self.forward, 'inverse': self.inverse,
+            'eigenvalues': self.eigenvalues, 'signal_cov': self.signal_cov,
+            'provenance': np.array(json.dumps(self.provenance)),
+        }
+        if self.noise_cov is not None:
+            arrays['noise_cov'] = self.noise_cov
+        if self.wavelengths is not None:
+            arrays['wavelengths'] = self.wavelengths
+        np.savez(file_path, **arrays)
+        logger.info(f"Saved {self.method.upper()} statistics ({self.num_bands} bands) to {file_path}")
+        return file_path
+
+    @classmethod
+    def load(cls, file_path: str) -> "TransformStatistics":
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Transform statistics file not found: {file_path}")
+        with np.load(file_path, allow_pickle=False) as archive:
+            if 'format' not in archive or 'forward' not in archive:
+                raise ValueError(f"'{file_path}' is not a transform statistics file.")
+            version = int(archive['format'])
+            if version > TRANSFORM_STATS_FORMAT:
+                raise ValueError(f"'{file_path}' has format {version}; this version reads up to "
+                                 f"{TRANSFORM_STATS_FORMAT}.")
+            stats = cls(
+                method=str(archive['method']), mean=archive['mean'], forward=archive['forward'],
+                eigenvalues=archive['eigenvalues'], signal_cov=archive['signal_cov'],
+                noise_cov=archive['noise_cov'] if 'noise_cov' in archive else None,
+                inverse=archive['inverse'],
+                wavelengths=archive['wavelengths'] if 'wavelengths' in archive else None,
+                provenance=json.loads(str(archive['provenance'])),
+            )
+        logger.info(f"Loaded {stats.method.upper()} statistics ({stats.num_bands} bands) from {file_path}")
+        return stats
+
+    def check_compatible(self, num_bands: int, wavelengths: Optional[np.ndarray] = None):
+        """Raises ValueError if a scene with these bands cannot take this transform."""
+        if num_bands != self.num_bands:
+            raise ValueError(f"The statistics are for {self.num_bands} bands, the scene has {num_bands}.")
+        if wavelengths is not None and self.wavelengths is not None:
+            offset = np.max(np.abs(np.asarray(wavelengths, dtype=np.float64) - self.wavelengths))
+            if offset > _WAVELENGTH_TOLERANCE_NM:
+                raise ValueError(f"The scene's wavelengths differ from those of the statistics by up to "
+                                 f"{offset:.1f} nm; they are probably from another sensor.")
+
+    def apply(self, data: np.ndarray, num_components: Optional[int] = None, out: Optional[np.ndarray] = None,
+              progress_callback: Optional[Callable[[int, int], None]] = None) -> np.ndarray:
+        """The leading components of a (rows, cols, bands) cube: one streaming matrix multiply."""
+        self.check_compatible(data.shape[2])
+        return forward_transform(data, self.mean, self.forward, num_components, out=out,
+                                 progress_callback=progress_callback)
+
+    def reconstruct(self, components: np.ndarray, selected=None) -> np.ndarray:
+        """
+        Data rebuilt from (rows, cols, k) leading components, keeping only the
+        `selected` component indices (default: all k), e.g. for MNF denoising.
+        """
+        rows, cols, k = components.shape
+        keep = np.arange(k) if selected is None else np.asarray(selected)
+        pixels = components.reshape(-1, k)[:, keep].astype(np.float64)
+        return (pixels @ self.inverse[keep] + self.mean).reshape(rows, cols, self.num_bands)
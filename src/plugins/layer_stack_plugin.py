@@ -12,11 +12,13 @@ from PySide6.QtGui import QAction
 from PySide6.QtCore import Qt
 from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem,
-    QPushButton, QLabel, QMessageBox, QInputDialog
+    QPushButton, QLabel, QMessageBox, QInputDialog, QComboBox
 )
 import numpy as np
 import logging
 
+from src.core.grid_alignment import ReferenceGrid, check_alignable, read_aligned_stack
+
 PLUGIN_NAME = "Layer Stacker"
 PLUGIN_DESCRIPTION = "Stack selected layers into a single multi-band layer."
 
@@ -41,6 +43,15 @@ class LayerStackDialog(QDialog):
             self.list_widget.addItem(item)
         layout.addWidget(self.list_widget)
 
+        # Layers on a different grid are resampled onto the grid of the first selected layer
+        resample_row = QHBoxLayout()
+        resample_row.addWidget(QLabel("Resampling (different grids):"))
+        self.resampling_combo = QComboBox()
+        self.resampling_combo.addItems(["nearest", "bilinear"])
+        resample_row.addWidget(self.resampling_combo)
+        resample_row.addStretch()
+        layout.addLayout(resample_row)
+
         btn_row = QHBoxLayout()
         self.btn_move_up = QPushButton("Move Up")
         self.btn_move_up.clicked.connect(self.move_up)
@@ -91,10 +102,8 @@ class LayerStackDialog(QDialog):
             return
 
         try:
-            arrays = []
+            layers = []
             band_names = []
-            shapes = None
-            dtypes = []
 
             for idx in selected_indices:
                 layer = self.window.layers[idx]
@@ -106,19 +115,9 @@ class LayerStackDialog(QDialog):
                 # Ensure HxWxB
                 if arr.ndim == 2:
                     arr = arr[:, :, None]
-                elif arr.ndim == 3:
-                    pass
-                else:
+                elif arr.ndim != 3:
                     raise ValueError(f"Unsupported layer shape: {arr.shape}")
-
-                if shapes is None:
-                    shapes = arr.shape[:2]
-                else:
-                    if arr.shape[:2] != shapes:
-                        raise ValueError(f"Layer '{layer.get('name')}' has incompatible shape {arr.shape[:2]}, expected {shapes}")
-
-                arrays.append(arr)
-                dtypes.append(arr.dtype)
+                layers.append(dict(layer, data=arr))
 
                 # collect band names (prefix with layer name for clarity)
                 ln = layer.get('name', 'Layer')
@@ -129,13 +128,13 @@ class LayerStackDialog(QDialog):
                     prefixed = [f"{ln}:Band {i+1}" for i in range(arr.shape[2])]
                 band_names.extend(prefixed)
 
-            # Use a common dtype (promote if necessary)
-            # common_dtype = np.find_common_type(dtypes, [])
-            common_dtype = np.result_type(*dtypes)
-            arrays = [a.astype(common_dtype, copy=False) for a in arrays]
+            # The first selected layer defines the output grid; the others are aligned to it
+            grid = ReferenceGrid.from_layer(layers[0])
+            ok, message = check_alignable(layers, grid)
+            if not ok:
+                raise ValueError(message)
 
-            # Concatenate along band axis
-            stacked = np.concatenate(arrays, axis=2)
+            stacked = read_aligned_stack(layers, grid, resampling=self.resampling_combo.currentText())
 
             # Ask for output layer name
             name, ok = QInputDialog.getText(self, "Stack Name", "Name for stacked layer:", text="Stacked Layer")
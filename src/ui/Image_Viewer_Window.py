@@ -7,7 +7,7 @@ from PySide6.QtCore import Qt, Signal, QTimer, QSize
 from PySide6.QtGui import QAction, QKeySequence, QIcon, QPixmap
 from PySide6.QtWidgets import (QTableWidgetItem,QHeaderView, QLineEdit, QTabWidget, QDialog, QVBoxLayout, QHBoxLayout, QWidget, QToolButton, QMenuBar, QMenu,  QSlider, QSpinBox,
     QListWidget, QListWidgetItem, QTableWidget, QRadioButton, QComboBox, QLabel, QGroupBox, QStatusBar,
-    QErrorMessage, QFileDialog, QPushButton, QAbstractItemView, QMainWindow , QFrame, QMessageBox,QSizePolicy
+    QErrorMessage, QFileDialog, QPushButton, QAbstractItemView, QMainWindow , QFrame, QMessageBox,QSizePolicy, QInputDialog
 )
 
 from datetime import datetime
@@ -17,12 +17,20 @@ from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as Navigatio
 
 from src.core.Spectral_Library_Plotter import SpectralLibraryPlotter
 from src.ui.Pixel_Info_Window import PixelInfoWindow
-from src.core.MNFProcessor import MNFProcessor
+from src.core.MNFProcessor import MNFOptionsDialog, MNFProcessor
+from src.core.transform_stats import TRANSFORM_STATS_EXTENSION, TransformStatistics
+from src.core.band_references import get_wavelength_index
 from src.core.Image_loader import HyperspectralImageLoader
 from src.ui.ppi_workflow_window import PPI_Workflow_Window
 from src.core.Export_Selected import TiffExportDialog
-from src.ui.raster_calculator import RasterCalculatorWindow
-from src.core.aoi_selector import AOISelector
+from src.ui.raster_calculator import RasterCalculatorWindow, layer_nodata
+from src.ui.spectral_matching_window import SpectralMatchingWindow
+from src.core.aoi_selector import AOISelector, PolygonAOISelector
+from src.core.roi_stats import ROI, compute_roi_statistics
+from src.ui.roi_stats_window import ROIStatsWindow
+from src.core.raster_export import create_exporter, layer_source, shift_geotransform
+from src.core.point_query import extract_point_spectra
+from src.core.band_statistics import cached_band_statistics, request_band_statistics, valid_mask
 
 # --- Constants ---
 MODE_SINGLE = "Single Band"
@@ -261,6 +269,7 @@ class ImageViewerWindow(QMainWindow):
         self.pixel_info_window = None
         self.animation_window = None
         self.raster_analysis_window = None
+        self.spectral_matching_window = None
         self.child_viewer_windows = []
         self.active_processor = None
 
@@ -434,6 +443,11 @@ class ImageViewerWindow(QMainWindow):
             act_raster_analysis.triggered.connect(self._raster_analysis)
             raster_analysis_menu.addAction(act_raster_analysis)
 
+            act_spectral_matching = QAction("Spectral Matching (SAM/SID/SCM)...", self)
+            act_spectral_matching.setStatusTip("Classify a layer against spectral library or endmember spectra")
+            act_spectral_matching.triggered.connect(self._spectral_matching)
+            raster_analysis_menu.addAction(act_spectral_matching)
+
 
             #Raster Analysis submenu
             End_Member_Menu = QMenu("End Member Extractor", self)
@@ -456,6 +470,22 @@ class ImageViewerWindow(QMainWindow):
             act_plot_spectral_profile.triggered.connect(self.plot_spectral_profile)
             spectral_plotting_menu.addAction(act_plot_spectral_profile)
 
+            act_extract_points = QAction("Extract Point Spectra (CSV)...", self)
+            act_extract_points.setStatusTip("Extract spectra of all layers at the points listed in a CSV file")
+            act_extract_points.triggered.connect(self._extract_point_spectra)
+            spectral_plotting_menu.addAction(act_extract_points)
+
+            roi_stats_menu = QMenu("ROI Statistics", self)
+            act_roi_rect = QAction("Rectangle ROI...", self)
+            act_roi_rect.setStatusTip("Draw a rectangle and compute its spectral statistics")
+            act_roi_rect.triggered.connect(lambda: self._start_roi_statistics("rectangle"))
+            roi_stats_menu.addAction(act_roi_rect)
+            act_roi_poly = QAction("Polygon ROI...", self)
+            act_roi_poly.setStatusTip("Draw a polygon and compute its spectral statistics")
+            act_roi_poly.triggered.connect(lambda: self._start_roi_statistics("polygon"))
+            roi_stats_menu.addAction(act_roi_poly)
+            spectral_plotting_menu.addMenu(roi_stats_menu)
+
              # Pre-Processing submenu
             pre_processing_menu = QMenu("Pre-Processing", self)
             pre_processing_menu.setAccessibleName("Pre-Processing Menu")
@@ -476,6 +506,11 @@ class ImageViewerWindow(QMainWindow):
             act_MNF.triggered.connect(self.MNF)
             pre_processing_menu.addAction(act_MNF)
 
+            act_saved_transform = QAction(QIcon("icons/blur.png"), "Apply Saved MNF/PCA Transform...", self)
+            act_saved_transform.setStatusTip("Apply MNF/PCA statistics saved from another scene")
+            act_saved_transform.triggered.connect(self.apply_saved_transform)
+            pre_processing_menu.addAction(act_saved_transform)
+
 
             act_ICA = QAction(QIcon("icons/blur.png"), "ICA", self)
             act_ICA.setStatusTip("Apply ICA")
@@ -808,6 +843,60 @@ class ImageViewerWindow(QMainWindow):
         self._aoi_selector.start()
 
 
+    def _start_roi_statistics(self, kind):
+        if not (0 <= self.active_layer_index < len(self.layers)):
+            QErrorMessage(self).showMessage("No layer selected.")
+            return
+
+        # Disable existing pan/zoom while the ROI is drawn
+        self._aoi_active = True
+        if kind == "polygon":
+            self.status_bar.showMessage("ROI mode: click polygon vertices; click the first vertex to finish.", 0)
+            self._roi_selector = PolygonAOISelector(self.ax, self.canvas, parent=self)
+            self._roi_selector.finished.connect(lambda verts: self._on_roi_finished("polygon", verts))
+            self._roi_selector.cancelled.connect(self._on_roi_cancelled)
+        else:
+            self.status_bar.showMessage("ROI mode: drag a rectangle on the image; release to finish.", 0)
+            self._roi_selector = AOISelector(self.ax, self.canvas, parent=self)
+            self._roi_selector.finished.connect(lambda bounds: self._on_roi_finished("rectangle", bounds))
+            self._roi_selector.cancelled.connect(self._on_roi_cancelled)
+        self._roi_selector.start()
+
+    def _on_roi_cancelled(self):
+        # Re-enable pan/zoom
+        self._aoi_active = False
+        self.status_bar.showMessage("ROI selection cancelled.", 3000)
+
+    def _on_roi_finished(self, kind, geometry):
+        self._aoi_active = False
+        self.status_bar.showMessage("ROI selection complete.", 3000)
+
+        try:
+            layer = self.layers[self.active_layer_index]
+            data = layer["data"]
+            if kind == "polygon":
+                roi = ROI.from_polygon(geometry, data.shape)
+            else:
+                roi = ROI.from_rectangle(*geometry, data.shape)
+            if roi.pixel_count == 0:
+                QErrorMessage(self).showMessage("The ROI does not cover any pixel of the active layer.")
+                return
+
+            metadata = layer.get("metadata", {})
+            nodata = metadata.get("NoData")
+            stats = compute_roi_statistics(data, roi, nodata=float(nodata) if nodata is not None else None)
+
+            wavelengths = layer.get("wavelengths") or metadata.get("Wavelengths")
+            if not isinstance(wavelengths, (list, tuple, np.ndarray)):
+                wavelengths = None
+            window = ROIStatsWindow(stats, layer.get("name", "Layer"), band_names=layer.get("band_names"),
+                                    wavelengths=wavelengths, wavelength_units=layer.get("wavelength_units", "nm"),
+                                    parent=self)
+            window.show()
+        except Exception as e:
+            logging.error(f"ROI statistics failed: {e}", exc_info=True)
+            QErrorMessage(self).showMessage(f"ROI statistics failed: {e}")
+
     def _on_aoi_finished(self, bounds):
         # Re-enable pan/zoom
         self._aoi_active = False
@@ -1034,6 +1123,13 @@ class ImageViewerWindow(QMainWindow):
                 if isinstance(data, np.ndarray):
                     data[np.isnan(data)] = nodata_value
                     layer["data"] = data
+                    # In-memory data no longer matches the file on disk, and results
+                    # cached for the old contents (band math, band statistics) are stale
+                    layer.pop("file_path", None)
+                    layer["version"] = layer.get("version", 0) + 1
+                    # The pixel inspector keeps row blocks of the data it shows
+                    if self.pixel_info_window is not None:
+                        self.pixel_info_window.accessor.invalidate()
 
             QMessageBox.information(dialog, "NoData Updated", f"NoData value set to {nodata_value}")
             self._update_display()  # Refresh display to reflect changes
@@ -1231,12 +1327,12 @@ class ImageViewerWindow(QMainWindow):
         dialog.show()
    
     def _export_layer(self, layer):
-        """Export layer to GeoTIFF format with professional options"""
+        """Export layer to GeoTIFF, ENVI or Zarr format with professional options"""
         export_dialog = TiffExportDialog(layer, parent=self)
         if export_dialog.exec():
             try:
                 export_options = export_dialog.get_export_options()
-                self._export_to_geotiff(layer, export_options)
+                self._export_to_file(layer, export_options)
                 
                 file_path = export_options['file_path']
                 self.status_bar.showMessage(f"Layer '{layer['name']}' exported to {file_path}", 5000)
@@ -1244,10 +1340,8 @@ class ImageViewerWindow(QMainWindow):
             except Exception as e:
                 QMessageBox.critical(self, "Export Error", f"Failed to export layer: {str(e)}")
 
-    def _export_to_geotiff(self, layer, options):
-        """Export hyperspectral layer to GeoTIFF with full metadata"""
-        from osgeo import gdal, osr
-        
+    def _export_to_file(self, layer, options):
+        """Export hyperspectral layer to GeoTIFF, ENVI or Zarr with full metadata"""
         # Get export parameters
         file_path = options['file_path']
         compression = options['compression']
@@ -1255,105 +1349,55 @@ class ImageViewerWindow(QMainWindow):
         bands = options['selected_bands']
         data_type = options['data_type']
         
-        # Prepare data
         data = layer['data']
         
-        # Handle extent selection
+        # Handle extent selection: export a pixel window instead of cropping a copy
+        window = None
         if extent == 'current_view' and hasattr(self, 'ax'):
-            data = self._crop_to_current_view(data)
+            window = self._current_view_window(data)
         
-        # Handle band selection
-        if bands != 'all':
-            data = data[:, :, bands]
+        # Handle band selection; file-backed layers are read window by window from disk
+        band_indices = None if bands == 'all' else list(bands)
+        source = layer_source(layer, window=window, bands=band_indices)
         
-        rows, cols, num_bands = data.shape
-        
-        # Set up GDAL driver and creation options
-        driver = gdal.GetDriverByName('GTiff')
-        creation_options = ['TILED=YES', 'BIGTIFF=IF_SAFER']
-        
-        # Add compression
-        if compression == 'LZW':
-            creation_options.append('COMPRESS=LZW')
-            creation_options.append('PREDICTOR=2')  # Better compression for continuous data
-        elif compression == 'DEFLATE':
-            creation_options.append('COMPRESS=DEFLATE')
-            creation_options.append('PREDICTOR=2')
-        elif compression == 'JPEG':
-            creation_options.append('COMPRESS=JPEG')
-            creation_options.append('JPEG_QUALITY=95')
-        
-        # Determine GDAL data type
-        gdal_dtype_map = {
-            'Float32': gdal.GDT_Float32,
-            'Float64': gdal.GDT_Float64,
-            'UInt16': gdal.GDT_UInt16,
-            'Int16': gdal.GDT_Int16,
-            'UInt32': gdal.GDT_UInt32,
-            'Int32': gdal.GDT_Int32
-        }
-        gdal_dtype = gdal_dtype_map.get(data_type, gdal.GDT_Float32)
-        
-        # Create the dataset
-        dataset = driver.Create(file_path, cols, rows, num_bands, gdal_dtype, creation_options)
-        
-        if dataset is None:
-            raise Exception("Could not create output file")
-        
-        # Set geospatial information
         geotransform = layer.get('geotransform')
-        projection = layer.get('projection')
-        
-        if geotransform:
-            dataset.SetGeoTransform(geotransform)
-            
-        if projection:
-            dataset.SetProjection(projection)
+        if geotransform and window:
+            geotransform = shift_geotransform(geotransform, window[0], window[1])
         
-        # Write bands with metadata
         wavelengths = layer.get('wavelengths', [])
         band_names = layer.get('band_names', [])
+        if band_indices is not None:
+            wavelengths = [wavelengths[i] for i in band_indices if i < len(wavelengths)]
+            band_names = [band_names[i] for i in band_indices if i < len(band_names)]
         
-        for i in range(num_bands):
-            band = dataset.GetRasterBand(i + 1)
-            
-            # Convert and write data
-            band_data = data[:, :, i].astype(self._get_numpy_dtype(data_type))
-            band.WriteArray(band_data)
-            
-            # Set band description
-            if i < len(band_names):
-                band.SetDescription(band_names[i])
-            
-            # Set wavelength metadata
-            if i < len(wavelengths):
-                band.SetMetadataItem('wavelength', str(wavelengths[i]))
-                band.SetMetadataItem('wavelength_units', layer.get('wavelength_units', 'nm'))
-            
-            # Calculate and set statistics
-            band.ComputeStatistics(False)
-        
-        # Set dataset-level metadata
-        metadata = layer.get('metadata', {})
-        dataset.SetMetadataItem('HYPERSPECTRAL_BANDS', str(num_bands))
-        dataset.SetMetadataItem('SOURCE_FILE', layer.get('name', 'Unknown'))
-        dataset.SetMetadataItem('EXPORT_TOOL', 'HYPRIL')
-        dataset.SetMetadataItem('EXPORT_DATE', str(datetime.now()))
-        
-        # Add original metadata
-        for key, value in metadata.items():
+        # Dataset-level metadata
+        metadata = {
+            'HYPERSPECTRAL_BANDS': str(source.num_bands),
+            'SOURCE_FILE': layer.get('name', 'Unknown'),
+            'EXPORT_TOOL': 'HYPRIL',
+            'EXPORT_DATE': str(datetime.now()),
+        }
+        for key, value in layer.get('metadata', {}).items():
             if isinstance(value, (str, int, float)):
-                dataset.SetMetadataItem(str(key), str(value))
+                metadata[str(key)] = value
         
-        # Flush and close
-        dataset.FlushCache()
-        dataset = None
+        exporter = create_exporter(file_path, data_type=data_type, compression=compression,
+                                   cog=options.get('cog', False), interleave=options.get('interleave', 'bsq'))
+        try:
+            exporter.export(
+                source,
+                geotransform=geotransform,
+                projection=layer.get('projection'),
+                band_names=band_names,
+                wavelengths=wavelengths,
+                wavelength_units=layer.get('wavelength_units', 'nm'),
+                metadata=metadata,
+            )
+        finally:
+            source.close()
         
-    def _crop_to_current_view(self, data):
-        """Crop data to current viewport"""
-        if not hasattr(self, 'ax'):
-            return data
-            
+    def _current_view_window(self, data):
+        """Pixel window (xoff, yoff, xsize, ysize) of the current viewport"""
         xlim = self.ax.get_xlim()
         ylim = self.ax.get_ylim()
         
@@ -1362,19 +1406,7 @@ class ImageViewerWindow(QMainWindow):
         y1 = max(0, int(ylim[1]))  # Y axis is inverted
         y2 = min(data.shape[0], int(ylim[0]) + 1)
         
-        return data[y1:y2, x1:x2, :]
-
-    def _get_numpy_dtype(self, data_type_str):
-        """Convert data type string to numpy dtype"""
-        dtype_map = {
-            'Float32': np.float32,
-            'Float64': np.float64,
-            'UInt16': np.uint16,
-            'Int16': np.int16,
-            'UInt32': np.uint32,
-            'Int32': np.int32
-        }
-        return dtype_map.get(data_type_str, np.float32)
+        return x1, y1, x2 - x1, y2 - y1
 
     def _remove_layer_by_index(self, row):
         self.layer_list.setCurrentRow(row)
@@ -1441,6 +1473,10 @@ class ImageViewerWindow(QMainWindow):
                         "metadata": self.metadata,
                         "geotransform": self.geotransform,
                         "projection": self.projection,
+                        "file_path": loader.file_path,
+                        "wavelengths": loader.wavelengths,
+                        "wavelength_units": loader.wavelength_units,
+                        "fwhm": loader.fwhm,
                         "visible": True
                     }
                     # Add the complete dictionary to the layers list
@@ -1665,10 +1701,18 @@ class ImageViewerWindow(QMainWindow):
         self.single_band_group.setVisible(is_single)
         self.rgb_group.setVisible(not is_single)
 
-    def _normalize_for_display(self, band_data: np.ndarray) -> np.ndarray:
+    def _normalize_for_display(self, band_data: np.ndarray, limits=None, nodata=None) -> np.ndarray:
         logging.info(f"Normalizing {band_data.shape} and {band_data.dtype} band data for display.")
         band_float = band_data.astype(np.float32)
-        p_low, p_high = np.percentile(band_float, (2, 98))
+        # 2-98% stretch limits from the shared band statistics when available, otherwise
+        # of the same values they are computed from: NaN, infinities and NoData excluded
+        if limits is None:
+            valid = valid_mask(band_float, nodata)
+            values = band_float if valid is None else band_float[valid]
+            if values.size == 0:
+                return np.zeros_like(band_float)
+            limits = np.percentile(values, (2, 98))
+        p_low, p_high = limits
         if p_high == p_low:
             return np.zeros_like(band_float)
         clipped = np.clip(band_float, p_low, p_high)
@@ -1680,22 +1724,35 @@ class ImageViewerWindow(QMainWindow):
 
         h, w, b = data.shape
 
+        stats = cached_band_statistics(layer)
+        if stats is None:
+            # Later renders of this layer use the cached percentiles
+            request_band_statistics(layer)
+
+        def limits(band_index):
+            if stats is None:
+                return None
+            p_low, p_high = stats.percentiles((2, 98), [band_index])[0]
+            return None if np.isnan(p_low) else (p_low, p_high)
+
+        nodata = layer_nodata(layer)
+
         if self.current_mode == MODE_RGB and b >= 3:
             # Use the active layer's index choices only if this layer has enough bands
             r_idx = min(self.r_combo.currentIndex(), b - 1) if self.r_combo.count() else 0
             g_idx = min(self.g_combo.currentIndex(), b - 1) if self.g_combo.count() else min(1, b - 1)
             b_idx = min(self.b_combo.currentIndex(), b - 1) if self.b_combo.count() else min(2, b - 1)
 
-            r = self._normalize_for_display(data[:, :, r_idx])
-            g = self._normalize_for_display(data[:, :, g_idx])
-            b = self._normalize_for_display(data[:, :, b_idx])
+            r = self._normalize_for_display(data[:, :, r_idx], limits(r_idx), nodata)
+            g = self._normalize_for_display(data[:, :, g_idx], limits(g_idx), nodata)
+            b = self._normalize_for_display(data[:, :, b_idx], limits(b_idx), nodata)
             logging.info(f"Rendering RGB with bands R:{r_idx}, G:{g_idx}, B:{b_idx}")
 
             return np.stack([r, g, b], axis=-1)
 
         # Single-band (or fallback if fewer than 3 bands)
         sb_idx = min(self.single_band_combo.currentIndex(), b - 1) if self.single_band_combo.count() else 0
-        return self._normalize_for_display(data[:, :, sb_idx])
+        return self._normalize_for_display(data[:, :, sb_idx], limits(sb_idx), nodata)
 
     def _subsample_for_display(self, image_data: np.ndarray, max_display_size: int = 2048) -> np.ndarray:
         """Subsample large images for faster display"""
@@ -1842,11 +1899,39 @@ class ImageViewerWindow(QMainWindow):
                     x=x, y=y
                 )
                 self.pixel_info_window.activateWindow()
+            self.pixel_info_window.set_query_layers(self.layers, reference_layer=top_layer)
 
         except Exception as e:
             QErrorMessage(self).showMessage(f"Error retrieving pixel info: {e}")
 
 
+    def _extract_point_spectra(self):
+        """Extract spectra from all layers at the points of a CSV point list."""
+        if not self.layers:
+            QMessageBox.warning(self, "No Layers", "Load at least one layer first.")
+            return
+
+        csv_path, _ = QFileDialog.getOpenFileName(
+            self, "Open Point List", "", "CSV Files (*.csv);;All Files (*)"
+        )
+        if not csv_path:
+            return
+        output_path, _ = QFileDialog.getSaveFileName(
+            self, "Save Extracted Spectra", os.path.splitext(csv_path)[0] + "_spectra.csv", "CSV Files (*.csv)"
+        )
+        if not output_path:
+            return
+
+        # Pixel coordinates in the list refer to the active layer
+        idx = self.layer_list.currentRow()
+        reference_layer = self.layers[idx] if 0 <= idx < len(self.layers) else self.layers[0]
+        try:
+            count = extract_point_spectra(self.layers, csv_path, output_path, reference_layer=reference_layer)
+            self.status_bar.showMessage(f"Extracted {count} point(s) to {output_path}", 5000)
+        except Exception as e:
+            logging.error(f"Point extraction failed: {e}", exc_info=True)
+            QMessageBox.critical(self, "Extraction Error", f"Failed to extract point spectra: {e}")
+
     def _on_scroll_zoom(self, event) -> None:
         if self._aoi_active or event.xdata is None or event.ydata is None:
             return
@@ -1877,7 +1962,13 @@ class ImageViewerWindow(QMainWindow):
         self._is_panning = False
 
     def _on_mouse_move(self, event):
-        if not self._is_panning or event.xdata is None or event.ydata is None:
+        if event.xdata is None or event.ydata is None:
+            return
+        if not self._is_panning:
+            # Live hover: the inspector throttles updates to the display refresh rate
+            if (self.pixel_info_window is not None and event.inaxes == self.ax
+                    and self.pixel_info_window.is_hover_enabled()):
+                self.pixel_info_window.hover_to(int(event.xdata), int(event.ydata))
             return
         dx = event.xdata - self._pan_start[0]
         dy = event.ydata - self._pan_start[1]
@@ -1943,18 +2034,24 @@ class ImageViewerWindow(QMainWindow):
         print("Bad Band Removal clicked")
 
     def PCA(self):
-        print("PCA clicked")
+        self._component_transform('pca')
 
     def ICA(self):
         print("ICA clicked")
 
     def MNF(self):
+        self._component_transform('mnf')
+
+    def _component_transform(self, method):
+        """MNF or PCA of the active layer, shown in the interactive component viewer"""
+        label = method.upper()
         logging.info("="*80)
-        logging.info("START: MNF (Minimum Noise Fraction) processing initiated")
+        logging.info("START: MNF (Minimum Noise Fraction) processing initiated" if method == 'mnf'
+                     else "START: PCA (Principal Component Analysis) processing initiated")
         
         try:
             if not (0 <= self.active_layer_index < len(self.layers)):
-                logging.warning("MNF requested but no layer is active")
+                logging.warning(f"{label} requested but no layer is active")
                 QErrorMessage(self).showMessage("No layer selected. Please select a layer first.")
                 return
             
@@ -1963,23 +2060,78 @@ class ImageViewerWindow(QMainWindow):
             logging.info(f"Active layer: '{active_layer_name}'")
             logging.info(f"Layer shape: {active_layer_data.shape}")
             
+            # All pixels, or a sample of them for the statistics (much faster on large scenes)
+            options_dialog = MNFOptionsDialog(label, num_pixels=active_layer_data.shape[0] * active_layer_data.shape[1],
+                                              num_bands=active_layer_data.shape[2], parent=self)
+            if options_dialog.exec() != QDialog.Accepted:
+                logging.info(f"{label} cancelled in the options dialog")
+                return
+            options = options_dialog.options()
+            logging.info(f"{label} options: {options}")
+
             # Pass the data and a reference to the viewer window itself
-            processor = MNFProcessor(active_layer_data, active_layer_name)
+            processor = MNFProcessor(active_layer_data, active_layer_name, method=method,
+                                     **self._transform_source(self.layers[self.active_layer_index]), **options)
             logging.info("MNFProcessor created successfully")
             
             processor.display_interactive_mnf(parent_viewer=self)
-            logging.info("Interactive MNF window displayed")
+            logging.info(f"Interactive {label} window displayed")
 
             # Note: We keep the processor in memory to keep the window alive
             # A more advanced solution might store it in a list of active processors
             self.active_processor = processor
-            logging.info("COMPLETED: MNF processing window opened")
+            logging.info(f"COMPLETED: {label} processing window opened")
             logging.info("="*80)
 
         except Exception as e:
-            logging.error(f"ERROR in MNF processing: {str(e)}", exc_info=True)
+            logging.error(f"ERROR in {label} processing: {str(e)}", exc_info=True)
             logging.error("="*80)
-            QErrorMessage(self).showMessage(f"MNF error: {e}")
+            QErrorMessage(self).showMessage(f"{label} error: {e}")
+
+    @staticmethod
+    def _transform_source(layer):
+        """Wavelengths (nm) and file of a layer, recorded with or checked against transform statistics."""
+        index = get_wavelength_index(layer)
+        return {'wavelengths': index.wavelengths if index is not None else None,
+                'file_path': layer.get('file_path')}
+
+    def apply_saved_transform(self):
+        """Applies MNF/PCA statistics saved from another scene to the active layer, without re-estimating them."""
+        logging.info("="*80)
+        logging.info("START: Apply saved MNF/PCA transform initiated")
+        try:
+            if not (0 <= self.active_layer_index < len(self.layers)):
+                logging.warning("Saved transform requested but no layer is active")
+                QErrorMessage(self).showMessage("No layer selected. Please select a layer first.")
+                return
+            file_path, _ = QFileDialog.getOpenFileName(
+                self, "Open Transform Statistics", "", f"Transform statistics (*{TRANSFORM_STATS_EXTENSION});;All files (*)"
+            )
+            if not file_path:
+                return
+            stats = TransformStatistics.load(file_path)
+            label = stats.method.upper()
+            layer = self.layers[self.active_layer_index]
+            logging.info(f"{label} statistics of '{stats.provenance.get('layer_name')}' "
+                         f"({stats.provenance.get('created')}) applied to '{layer['name']}'")
+
+            num_components, ok = QInputDialog.getInt(
+                self, f"Apply Saved {label} Transform", "Components:",
+                min(MNFProcessor.DEFAULT_COMPONENTS, stats.num_bands), 1, stats.num_bands
+            )
+            if not ok:
+                return
+            processor = MNFProcessor(layer["data"], layer["name"], method=stats.method, statistics=stats,
+                                     num_components=num_components, **self._transform_source(layer))
+            processor.display_interactive_mnf(parent_viewer=self)
+            self.active_processor = processor
+            logging.info(f"COMPLETED: Saved {label} transform applied")
+            logging.info("="*80)
+
+        except Exception as e:
+            logging.error(f"ERROR applying saved transform: {str(e)}", exc_info=True)
+            logging.error("="*80)
+            QErrorMessage(self).showMessage(f"Saved transform error: {e}")
 
     def _raster_analysis(self):
         logging.info("="*80)
@@ -2012,6 +2164,7 @@ class ImageViewerWindow(QMainWindow):
             
             # The signal/slot connection remains the same
             self.raster_analysis_window.calculation_complete.connect(self._add_new_layer_from_analysis)
+            self.raster_analysis_window.batch_complete.connect(self._add_new_layer_from_analysis)
             logging.info("Raster Calculator window created and connected")
             
             self.raster_analysis_window.show()
@@ -2023,8 +2176,27 @@ class ImageViewerWindow(QMainWindow):
             logging.error("="*80)
             QErrorMessage(self).showMessage(f"Raster Analysis error: {e}")
             
+    def _spectral_matching(self):
+        try:
+            if not self.layers:
+                QErrorMessage(self).showMessage("No layers loaded. Please load an image first.")
+                return
+            if self.spectral_matching_window and self.spectral_matching_window.isVisible():
+                self.spectral_matching_window.activateWindow()
+                return
+
+            # Offer the endmembers of an open PPI workflow as references
+            processor = getattr(getattr(self, "PPI_window", None), "processor", None)
+            endmembers = getattr(processor, "endmembers", None)
+            self.spectral_matching_window = SpectralMatchingWindow(self.layers, endmembers=endmembers, parent=self)
+            self.spectral_matching_window.matching_complete.connect(self._add_new_layer_from_analysis)
+            self.spectral_matching_window.show()
+        except Exception as e:
+            logging.error(f"ERROR in Spectral Matching: {str(e)}", exc_info=True)
+            QErrorMessage(self).showMessage(f"Spectral Matching error: {e}")
+
 # --- ADD THIS ENTIRE FUNCTION ---
-    def _add_new_layer_from_analysis(self, result_array, layer_name, parent_layer_name):
+    def _add_new_layer_from_analysis(self, result_array, layer_name, parent_layer_name, band_names=None):
             """
             This slot receives the data from the RasterCalculatorWindow and adds it
             as a new layer to the application.
@@ -2089,7 +2261,7 @@ class ImageViewerWindow(QMainWindow):
                 new_layer = {
                     "name": layer_name,
                     "data": result_array,
-                    "band_names": (
+                    "band_names": band_names or (
                             ["Band 1"] if result_array.ndim == 2 
                             else [f"Band {i+1}" for i in range(result_array.shape[2])]
                         ),  # The result is a single-band raster
@@ -7,11 +7,10 @@ import matplotlib.pyplot as plt
 # --- PySide6 Imports ---
 from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QFormLayout, 
                                QLineEdit, QTableWidget, QTableWidgetItem, QHeaderView,
-                               QWidget, QComboBox, QFileDialog, QMessageBox)
-from PySide6.QtCore import Qt
+                               QWidget, QComboBox, QFileDialog, QMessageBox, QCheckBox, QApplication)
+from PySide6.QtCore import Qt, QTimer
 
 # --- Geospatial and Plotting Imports ---
-from osgeo import gdal, osr
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 
@@ -23,6 +22,18 @@ except ImportError:
     MPLCURSORS_AVAILABLE = False
     print("Warning: 'mplcursors' not found. Interactive plot annotations will be disabled.")
 
+from src.core.geo_transforms import get_coordinate_transform, pixel_to_map
+from src.core.point_query import PointQueryService
+from src.core.spectrum_accessor import SpectrumAccessor
+from src.core.spectral_library import FILE_FILTER, load_spectral_library, open_libraries
+from src.core.spectral_search import get_search_index
+
+# Number of library matches listed for the current pixel
+NUM_MATCHES = 5
+
+# Fallback hover update interval (ms) when the screen refresh rate is unknown (~30 Hz)
+HOVER_INTERVAL_MS = 33
+
 
 class PixelInfoWindow(QDialog):
     def __init__(self, file_name, image_data, band_names, metadata, geotransform, projection, x, y, parent=None):
@@ -41,13 +52,25 @@ class PixelInfoWindow(QDialog):
         self.geotransform = geotransform
         self.projection = projection
         self.wavelengths = self._parse_wavelengths(self.metadata)
-        print("Parsed wavelengths:", self.wavelengths)
-
         self.wavelength_units = self.metadata.get("wavelength_units", "")
         self.x = x
         self.y = y
         self.cursor = None # For mplcursors
-        print(f"Pixel Inspector initialized for {file_name} at ({x}, {y}) with projection {self.projection}")
+        self.accessor = SpectrumAccessor(image_data)
+        self.spectrum_line = None  # Persistent plot line, updated in place with set_ydata
+        self.point_query = None  # Multi-layer lookups for the "All Layers" view
+        self.reference_layer = None
+        self.search_index = None  # Nearest-spectrum index of the selected library
+        self.search_hits = []
+        self.match_line = None
+        self.match_legend_text = None  # Legend entry of match_line
+        self._libraries = []
+
+        # Hover updates are coalesced and applied at most once per display frame
+        self._pending_hover = None
+        self._hover_timer = QTimer(self)
+        self._hover_timer.setSingleShot(True)
+        self._hover_timer.timeout.connect(self._apply_pending_hover)
 
 
         # --- Initialize UI Elements ---
@@ -61,13 +84,29 @@ class PixelInfoWindow(QDialog):
     def _init_ui_elements(self):
         """Initializes all QWidget members."""
         self.view_mode_combo = QComboBox()
-        self.view_mode_combo.addItems(["Spectral Plot", "Pixel Values"])
+        self.view_mode_combo.addItems(["Spectral Plot", "Pixel Values", "All Layers"])
         self.view_mode_combo.currentIndexChanged.connect(self.update_view_mode)
         
+        self.hover_check = QCheckBox("Live hover")
+        self.hover_check.setToolTip("Update the spectrum while the mouse moves over the image")
+        
         self.coords_edit = QLineEdit(readOnly=True)
         self.map_coords_edit = QLineEdit(readOnly=True)
         self.geo_coords_edit = QLineEdit(readOnly=True)
         
+        self.library_combo = QComboBox()
+        self.library_combo.setToolTip("Spectral library searched for the materials closest to the pixel")
+        self.library_combo.activated.connect(self._on_library_changed)
+        self.open_library_btn = QPushButton("Open Library...")
+        self.open_library_btn.clicked.connect(self._open_library)
+        self.match_table = QTableWidget(0, 2)
+        self.match_table.setHorizontalHeaderLabels(["Closest Material", "Spectral Angle (°)"])
+        self.match_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.match_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.match_table.setMaximumHeight(160)
+        self.match_table.setVisible(False)
+        self._refresh_library_combo()
+
         self.value_table = QTableWidget()
         self.figure, self.ax = plt.subplots()
         self.canvas = FigureCanvas(self.figure)
@@ -83,6 +122,10 @@ class PixelInfoWindow(QDialog):
         form_layout.addRow("Pixel (X, Y):", self.coords_edit)
         # form_layout.addRow("Map Coords (Native):", self.map_coords_edit)
         form_layout.addRow("Geographic (Lon, Lat):", self.geo_coords_edit)
+        library_layout = QHBoxLayout()
+        library_layout.addWidget(self.library_combo, 1)
+        library_layout.addWidget(self.open_library_btn)
+        form_layout.addRow("Identify with:", library_layout)
 
         # --- Table for Pixel Values ---
         self.value_table.setColumnCount(3)
@@ -106,8 +149,12 @@ class PixelInfoWindow(QDialog):
         button_layout.addWidget(ok_btn)
 
         # --- Assemble Layout ---
-        main_layout.addWidget(self.view_mode_combo)
+        mode_layout = QHBoxLayout()
+        mode_layout.addWidget(self.view_mode_combo, 1)
+        mode_layout.addWidget(self.hover_check)
+        main_layout.addLayout(mode_layout)
         main_layout.addWidget(info_panel)
+        main_layout.addWidget(self.match_table)
         main_layout.addWidget(self.value_table)
         main_layout.addWidget(self.canvas)
         main_layout.addWidget(self.toolbar)
@@ -139,80 +186,206 @@ class PixelInfoWindow(QDialog):
 
         if is_plot_mode:
             self.plot_spectral_profile()
+        else:
+            self._refresh_table()
+
+    def _refresh_table(self):
+        if self.view_mode_combo.currentText() == "All Layers":
+            self.populate_all_layers_table()
         else:
             self.populate_value_table()
     def update_pixel_info(self, x: int, y: int):
         """The main entry point to update all information in the window."""
         self.x = x
         self.y = y
+        self._update_coordinates()
+        self._update_matches()
+        
+        # Refresh the active view (plot or table)
+        self.update_view_mode()
+
+    def _update_coordinates(self):
+        """Updates the pixel/map/geographic coordinate fields for the current (x, y)."""
+        x, y = self.x, self.y
         self.coords_edit.setText(f"({x}, {y})")
 
         if self.geotransform and self.projection:
-            print(f" \n \n \n Updating pixel info for ({x}, {y}) with geotransform {self.geotransform} \n \n \n \n \n and projection {self.projection} \n\n\n\n\n")
             try:
-                # 1. Get map coordinates (e.g., UTM easting, northing) from pixel coordinates
-                # This returns (map_x, map_y)
-                map_y, map_x = gdal.ApplyGeoTransform(self.geotransform, x + 0.5, y + 0.5)
+                # Map coordinates of the pixel centre, then WGS84 through the cached transformation
+                map_x, map_y = pixel_to_map(self.geotransform, x + 0.5, y + 0.5)
+                map_x, map_y = float(map_x), float(map_y)
                 self.map_coords_edit.setText(f"{map_x:.3f}, {map_y:.3f}")
 
-                # 2. Set up the spatial reference systems
-                source_srs = osr.SpatialReference()
-                source_srs.ImportFromWkt(self.projection)
-
-                print(f"Source SRS: {source_srs} \n\n\n\n\n") 
-                target_srs = osr.SpatialReference()
-                target_srs.ImportFromEPSG(4326) # WGS84 (lat/lon)
-                print(f"Target SRS: {target_srs} \n\n\n\n\n")
-
-                # 3. Handle axis mapping for modern GDAL/PROJ versions
-                # This ensures the transformation expects (easting, northing) or (lon, lat)
-                source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
-                target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
-
-                # 4. Transform if the source is not already WGS84
-                if not source_srs.IsSame(target_srs):
-                    transform = osr.CoordinateTransformation(source_srs, target_srs)
-                    # print(f"Transform: {transform} \n\n\n\n\n")
-
-                    # CORRECT ORDER: Pass (map_x, map_y)
-                    # The result is (longitude, latitude, altitude)
-                    lat, lon, _ = transform.TransformPoint(map_y, map_x)
-                    # print(f"Transformed map coords ({map_x}, {map_y}) to geographic coords ({lon}, {lat}) \n\n\n\n\n")
-                    # Display in conventional Lon, Lat order
+                transform = get_coordinate_transform(self.projection, 4326)
+                if transform is not None:
+                    lon, lat, _ = transform.TransformPoint(map_x, map_y)
                     self.geo_coords_edit.setText(f"{lon:.6f}, {lat:.6f}")
-                else: 
+                else:
                     # The data is already in WGS84, so map coords are lon/lat
-                    # Display in conventional Lon, Lat order
                     self.geo_coords_edit.setText(f"{map_x:.6f}, {map_y:.6f}")
 
-            except Exception as e:
-                # Better error handling: Log the error for debugging
-                print(f"Coordinate transformation error: {e}")
+            except Exception:
                 self.map_coords_edit.setText("Transform Error")
                 self.geo_coords_edit.setText("Transform Error")
         else:
             # No georeferencing info available
             self.map_coords_edit.setText("N/A")
             self.geo_coords_edit.setText("N/A")
-        
-        # Refresh the active view (plot or table)
+
+    # ---------------- HOVER MODE ----------------
+    def is_hover_enabled(self) -> bool:
+        return self.isVisible() and self.hover_check.isChecked()
+
+    def hover_to(self, x: int, y: int):
+        """Queues a hover update; only the latest position is drawn, once per display frame."""
+        if (x, y) == (self.x, self.y) and self._pending_hover is None:
+            return
+        self._pending_hover = (x, y)
+        if not self._hover_timer.isActive():
+            self._hover_timer.start(self._hover_interval_ms())
+
+    def _hover_interval_ms(self) -> int:
+        screen = self.screen()
+        rate = screen.refreshRate() if screen is not None else 0
+        return max(1, int(1000 / rate)) if rate and rate > 0 else HOVER_INTERVAL_MS
+
+    def _apply_pending_hover(self):
+        if self._pending_hover is None:
+            return
+        self.x, self.y = self._pending_hover
+        self._pending_hover = None
+        self._update_coordinates()
+        self._update_matches()
+        if self.view_mode_combo.currentText() == "Spectral Plot":
+            self._update_spectrum_line()
+        else:
+            self._refresh_table()
+
+    # ---------------- LIBRARY IDENTIFICATION ----------------
+    def _refresh_library_combo(self, selected=None):
+        self._libraries = open_libraries()
+        self.library_combo.clear()
+        self.library_combo.addItem("None")
+        for library in self._libraries:
+            self.library_combo.addItem(f"{library.display_name} ({library.num_spectra} spectra)")
+        if selected is not None and selected in self._libraries:
+            self.library_combo.setCurrentIndex(self._libraries.index(selected) + 1)
+
+    def _open_library(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Spectral Library", "", FILE_FILTER)
+        if not file_path:
+            return
+        try:
+            library = load_spectral_library(file_path)
+        except Exception as e:
+            QMessageBox.critical(self, "Spectral Library", f"Could not open {os.path.basename(file_path)}:\n{e}")
+            return
+        self._refresh_library_combo(selected=library)
+        self._on_library_changed()
+
+    def _on_library_changed(self):
+        """(Re)builds the search index of the selected library on this layer's bands."""
+        index = self.library_combo.currentIndex()
+        self.search_index = None
+        if index > 0 and index - 1 < len(self._libraries):
+            library = self._libraries[index - 1]
+            layer = {"name": self.file_name, "data": self.image_data, "metadata": self.metadata}
+            QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+            try:
+                self.search_index = get_search_index(library, layer)
+            except Exception as e:
+                self.library_combo.setCurrentIndex(0)
+                QMessageBox.warning(self, "Spectral Library", f"Cannot search {library.display_name}:\n{e}")
+            finally:
+                QApplication.restoreOverrideCursor()
+        self.match_table.setVisible(self.search_index is not None)
+        self._update_matches()
         self.update_view_mode()
 
+    def _update_matches(self):
+        """Looks up the library spectra closest to the current pixel (exact, sub-millisecond)."""
+        if self.search_index is None or not self._is_cursor_in_bounds():
+            self.search_hits = []
+        else:
+            self.search_hits = self.search_index.query(self.accessor.spectrum(self.x, self.y), k=NUM_MATCHES)
+
+        self.match_table.setUpdatesEnabled(False)
+        try:
+            self.match_table.setRowCount(len(self.search_hits))
+            for i, hit in enumerate(self.search_hits):
+                for j, text in enumerate((hit.name, f"{hit.angle_degrees:.3f}")):
+                    item = self.match_table.item(i, j)
+                    if item is None:
+                        self.match_table.setItem(i, j, QTableWidgetItem(text))
+                    else:
+                        item.setText(text)
+        finally:
+            self.match_table.setUpdatesEnabled(True)
+
+    def _best_match_curve(self, pixel_values):
+        """Best library match scaled (least squares) to the pixel, for plotting next to it."""
+        if not self.search_hits:
+            return None
+        match = np.asarray(self.search_index.spectra[self.search_hits[0].index], dtype=float)
+        valid = np.isfinite(match) & np.isfinite(pixel_values)
+        denominator = np.dot(match[valid], match[valid])
+        if denominator <= 0:
+            return None
+        return match * (np.dot(pixel_values[valid], match[valid]) / denominator)
+
+    def _fill_table(self, headers, rows):
+        """Fills the table, reusing existing items so repeated updates only change text."""
+        if [self.value_table.horizontalHeaderItem(i).text() if self.value_table.horizontalHeaderItem(i) else None
+                for i in range(self.value_table.columnCount())] != headers:
+            self.value_table.setColumnCount(len(headers))
+            self.value_table.setHorizontalHeaderLabels(headers)
+        self.value_table.setUpdatesEnabled(False)
+        try:
+            self.value_table.setRowCount(len(rows))
+            for i, row in enumerate(rows):
+                for j, text in enumerate(row):
+                    item = self.value_table.item(i, j)
+                    if item is None:
+                        self.value_table.setItem(i, j, QTableWidgetItem(text))
+                    elif item.text() != text:
+                        item.setText(text)
+        finally:
+            self.value_table.setUpdatesEnabled(True)
 
     def populate_value_table(self):
         """Fills the QTableWidget with pixel values."""
-        self.value_table.setRowCount(0)
+        headers = ["Wavelength", "Band Name", "Value"]
         if not self._is_cursor_in_bounds():
+            self._fill_table(headers, [])
             return
 
-        pixel_values = self.image_data[self.y, self.x, :]
-        self.value_table.setRowCount(len(pixel_values))
-
+        pixel_values = self.accessor.spectrum(self.x, self.y)
+        rows = []
         for i, (value, band_name) in enumerate(zip(pixel_values, self.band_names)):
             wl_text = f"{self.wavelengths[i]:.2f}" if i < len(self.wavelengths) else "N/A"
-            self.value_table.setItem(i, 0, QTableWidgetItem(wl_text))
-            self.value_table.setItem(i, 1, QTableWidgetItem(band_name))
-            self.value_table.setItem(i, 2, QTableWidgetItem(f"{value:.4f}"))
+            rows.append((wl_text, band_name, f"{value:.4f}"))
+        self._fill_table(headers, rows)
+
+    def set_query_layers(self, layers, reference_layer=None):
+        """Registers the layers sampled by the "All Layers" view (pixel coordinates refer to `reference_layer`)."""
+        self.point_query = PointQueryService(layers) if layers else None
+        self.reference_layer = reference_layer
+        if self.view_mode_combo.currentText() == "All Layers":
+            self.populate_all_layers_table()
+
+    def populate_all_layers_table(self):
+        """Fills the table with the current pixel's values in every layer (one batched query)."""
+        headers = ["Layer", "Band Name", "Value"]
+        if self.point_query is None:
+            self._fill_table(headers, [])
+            return
+
+        results = self.point_query.query_pixels([self.x], [self.y], reference_layer=self.reference_layer)
+        rows = []
+        for name, values in results.items():
+            for label, value in zip(self.point_query.band_labels(name), values[0]):
+                rows.append((name, label, "N/A" if np.isnan(value) else f"{value:.4f}"))
+        self._fill_table(headers, rows)
     # Add this new method to the PixelInfoWindow class
     def update_data(self, file_name, image_data, band_names, metadata, geotransform, projection, x, y):
         """
@@ -227,24 +400,40 @@ class PixelInfoWindow(QDialog):
         self.projection = projection
         self.wavelengths = self._parse_wavelengths(metadata)
         self.wavelength_units = metadata.get("wavelength_units", " ")
+        if self.accessor.data is not image_data:
+            self.accessor = SpectrumAccessor(image_data)
+            if self.search_index is not None:
+                # The library is searched on the bands of the layer: rebuild for the new one
+                self._on_library_changed()
+        self.spectrum_line = None  # Band axis may differ: rebuild the plot
         
         # Now, call the existing update function to refresh the display
         self.update_pixel_info(x, y)
     def plot_spectral_profile(self):
         """Plots the spectral profile for the current pixel."""
         self.ax.clear()
+        self.spectrum_line = None
         if not self._is_cursor_in_bounds():
             self.ax.set_title("Cursor is outside image bounds", color="red")
             self.canvas.draw()
             return
 
-        pixel_values = self.image_data[self.y, self.x, :].astype(float)
+        pixel_values = self.accessor.spectrum(self.x, self.y).astype(float)
         
         has_wavelengths = self.wavelengths and len(self.wavelengths) == len(pixel_values)
         x_data = self.wavelengths if has_wavelengths else range(1, len(pixel_values) + 1)
         xlabel = f"Wavelength ({self.wavelength_units})" if has_wavelengths else "Band Number"
 
-        self.ax.plot(x_data, pixel_values, marker='.', linestyle='-', markersize=4)
+        self.spectrum_line, = self.ax.plot(x_data, pixel_values, marker='.', linestyle='-', markersize=4)
+        self.match_line = None
+        match_curve = self._best_match_curve(pixel_values)
+        if match_curve is not None:
+            self.match_line, = self.ax.plot(x_data, match_curve, linestyle='--', color='tab:red',
+                                            label=f"Best match: {self.search_hits[0].name}")
+            self.spectrum_line.set_label("Pixel")
+            # Built once per set of lines; hover only edits the match entry's text
+            legend = self.ax.legend(loc="best", fontsize="small")
+            self.match_legend_text = legend.get_texts()[-1]
         self.ax.set_xlabel(xlabel)
         self.ax.set_ylabel("Pixel Value")
         self.ax.set_title(f"{self.file_name}\nSpectral Profile at ({self.x}, {self.y})")
@@ -256,6 +445,29 @@ class PixelInfoWindow(QDialog):
         if MPLCURSORS_AVAILABLE:
             self._setup_plot_cursor()
 
+    def _update_spectrum_line(self):
+        """Fast path for hover: updates the existing line's y data instead of replotting."""
+        if self.spectrum_line is None or not self._is_cursor_in_bounds():
+            self.plot_spectral_profile()
+            return
+
+        pixel_values = self.accessor.spectrum(self.x, self.y)
+        match_curve = self._best_match_curve(pixel_values.astype(float))
+        if (match_curve is None) != (self.match_line is None):
+            self.plot_spectral_profile()
+            return
+        self.spectrum_line.set_ydata(pixel_values)
+        if match_curve is not None:
+            self.match_line.set_ydata(match_curve)
+            label = f"Best match: {self.search_hits[0].name}"
+            if self.match_legend_text.get_text() != label:
+                self.match_line.set_label(label)
+                self.match_legend_text.set_text(label)
+        self.ax.relim()
+        self.ax.autoscale_view(scalex=False)
+        self.ax.set_title(f"{self.file_name}\nSpectral Profile at ({self.x}, {self.y})")
+        self.canvas.draw_idle()
+
     def _setup_plot_cursor(self):
         """Initializes mplcursors for interactive annotations on the plot."""
         # if hasattr(self, "cursor"): self.cursor.remove() # Remove old cursor
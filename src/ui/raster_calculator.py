@@ -2,6 +2,7 @@
 import re
 import os
 import ast
+from functools import partial
 import numpy as np
 from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLineEdit, QListWidget, QGridLayout,
@@ -12,6 +13,14 @@ from PySide6.QtWidgets import (
 from PySide6.QtCore import Signal, Qt, QThread, Signal
 from PySide6.QtGui import QFont
 
+from src.core.band_math import BatchBandMath
+from src.core.band_references import get_wavelength_index, resolve_band_references
+from src.core.band_statistics import cached_band_statistics, get_band_statistics, request_band_statistics
+from src.core.expression_cache import CachedBandMath, band_key, layer_version
+from src.core.grid_alignment import ReferenceGrid, check_alignable, get_aligned_layer
+from src.core.raster_export import ArraySource, create_exporter
+from src.core.spectral_reductions import BAND_IDENTIFIER_PATTERN, SpectralReduction, parse_reduction_identifier
+
 PRESET_WAVELENGTHS = {
     'NDVI': {'Red': 650, 'NIR': 840},
     'NDWI': {'Green': 550, 'NIR': 840},
@@ -21,6 +30,24 @@ PRESET_WAVELENGTHS = {
     'Normalized Difference': {}
 }
 
+# Indices offered in the Batch tab, written with wavelength references so they resolve to the
+# nearest bands of any sensor; a preset is only offered if the layer has a band near every wavelength
+BATCH_INDEX_PRESETS = {
+    'NDVI': '(R(840nm) - R(650nm)) / (R(840nm) + R(650nm))',
+    'NDWI': '(R(550nm) - R(840nm)) / (R(550nm) + R(840nm))',
+    'EVI': '2.5 * ((R(840nm) - R(650nm)) / (R(840nm) + 6 * R(650nm) - 7.5 * R(450nm) + 1))',
+    'GNDVI': '(R(840nm) - R(550nm)) / (R(840nm) + R(550nm))',
+    'SAVI': '1.5 * (R(840nm) - R(650nm)) / (R(840nm) + R(650nm) + 0.5)',
+    'SR': 'R(840nm) / R(650nm)',
+    'NDRE': '(R(840nm) - R(715nm)) / (R(840nm) + R(715nm))',
+    'NDMI': '(R(840nm) - R(1610nm)) / (R(840nm) + R(1610nm))',
+    'MNDWI': '(R(550nm) - R(1610nm)) / (R(550nm) + R(1610nm))',
+    'NBR': '(R(840nm) - R(2200nm)) / (R(840nm) + R(2200nm))',
+    'PRI': '(R(531nm) - R(570nm)) / (R(531nm) + R(570nm))',
+    'MTCI': '(R(754nm) - R(709nm)) / (R(709nm) - R(681nm))',
+    'Red Edge Band Depth': '1 - CR(670nm, 550nm, 760nm)',
+}
+
 class BandSelectionDialog(QDialog):
     """Dialog for selecting bands for preset calculations"""
     
@@ -309,29 +336,18 @@ class BandSelectionDialog(QDialog):
         """
         selected = {}
         target_wavelengths = PRESET_WAVELENGTHS.get(self.preset_name, {})
-        wavelengths = layer.get("metadata", {}).get("Wavelengths", [])
         band_names = layer.get("band_names", [])
-        if wavelengths:
-            if type(wavelengths) is not list:
-                wavelengths = [float(x)*1000 if float(x)<100 else float(x) for x in layer.get("metadata", {}).get("Wavelengths", "").replace("{","").replace("}","").split(",") if x.strip()]
-            for band_key, target_wl in target_wavelengths.items():
-                closest_idx = None
-                min_diff = float('inf')
-                for i, wl in enumerate(wavelengths):
-                    if wl is None:
-                        continue
-                    diff = abs(wl - target_wl)
-                    if diff < min_diff:
-                        min_diff = diff
-                        closest_idx = i
-                if closest_idx is not None:
-                    selected[band_key] = {
-                        "id": f"b{closest_idx+1}",
-                        "name": band_names[closest_idx],
-                        "wavelength": wavelengths[closest_idx]
-                    }
-            return selected
-        return {}
+        index = get_wavelength_index(layer)
+        if index is None:
+            return {}
+        for band_key, target_wl in target_wavelengths.items():
+            closest_idx = index.nearest(target_wl)
+            selected[band_key] = {
+                "id": f"b{closest_idx+1}",
+                "name": band_names[closest_idx],
+                "wavelength": float(index.wavelengths[closest_idx])
+            }
+        return selected
 
 
     def _validate_and_accept(self):
@@ -397,7 +413,7 @@ class ExpressionValidator:
         """Validate Python syntax of expression"""
         try:
             # Replace band identifiers with dummy variables for syntax checking
-            test_expr = re.sub(r'"[^"]+@b\d+"', 'x', expression)
+            test_expr = re.sub(BAND_IDENTIFIER_PATTERN, 'x', expression)
             ast.parse(test_expr, mode='eval')
             return True, "Valid syntax"
         except SyntaxError as e:
@@ -406,27 +422,43 @@ class ExpressionValidator:
     @staticmethod
     def validate_band_references(expression, layer_map):
         """Validate that all band references exist"""
-        band_identifiers = set(re.findall(r'"([^"]+@b\d+)"', expression))
+        band_identifiers = set(re.findall(BAND_IDENTIFIER_PATTERN, expression))
         
         for identifier in band_identifiers:
             try:
-                layer_name, band_id = identifier.split('@')
-                band_index = int(band_id[1:]) - 1
+                reduction = parse_reduction_identifier(identifier)
+                if reduction is not None:
+                    # Per-pixel reduction over a band set, e.g. "layer@mean(b10:b50)"
+                    layer_name, _, band_indices = reduction
+                else:
+                    layer_name, band_id = identifier.rsplit('@', 1)
+                    band_indices = [int(band_id[1:]) - 1]
                 
                 if layer_name not in layer_map:
                     return False, f"Layer '{layer_name}' not found"
                 
                 layer_data = layer_map[layer_name]['data']
-                if not (0 <= band_index < layer_data.shape[2]):
-                    return False, f"Band index {band_index+1} is out of bounds for layer '{layer_name}'"
+                for band_index in band_indices:
+                    if not (0 <= band_index < layer_data.shape[2]):
+                        return False, f"Band index {band_index+1} is out of bounds for layer '{layer_name}'"
                     
-            except (ValueError, IndexError):
-                return False, f"Invalid band identifier: {identifier}"
+            except (ValueError, IndexError) as e:
+                return False, f"Invalid band identifier: {identifier} ({e})"
         
         if not band_identifiers:
             return False, "No valid band identifiers found"
         
         return True, "All band references are valid"
+
+    @staticmethod
+    def validate_grids(expression, layer_map):
+        """Validate that every referenced layer can be aligned to the grid of the first one"""
+        identifiers = list(dict.fromkeys(re.findall(BAND_IDENTIFIER_PATTERN, expression)))
+        layer_names = list(dict.fromkeys(identifier_layer(identifier) for identifier in identifiers))
+        if len(layer_names) < 2:
+            return True, "Single layer expression"
+        layers = [layer_map[name] for name in layer_names]
+        return check_alignable(layers, ReferenceGrid.from_layer(layers[0]))
     
     @staticmethod
     def validate_complete(expression, layer_map):
@@ -440,15 +472,72 @@ class ExpressionValidator:
         bands_valid, bands_msg = ExpressionValidator.validate_band_references(expression, layer_map)
         if not bands_valid:
             return False, bands_msg
+
+        # Check that layers on different grids can be resampled onto the reference grid
+        grids_valid, grids_msg = ExpressionValidator.validate_grids(expression, layer_map)
+        if not grids_valid:
+            return False, grids_msg
         
         return True, "Expression is valid"
 
+def identifier_layer(identifier):
+    """Layer name of a band or reduction identifier"""
+    reduction = parse_reduction_identifier(identifier)
+    return reduction[0] if reduction is not None else identifier.rsplit('@', 1)[0]
+
+def layer_nodata(layer):
+    """The layer's NoData value as a float, or None"""
+    try:
+        value = layer.get('metadata', {}).get('NoData')
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def build_band_readers(variable_map, layer_map, grid, resampling):
+    """
+    Tile readers for every identifier of `variable_map`, on `grid`: a single band
+    ("layer@b4") or a per-pixel reduction over a band set ("layer@mean(b10:b50)"),
+    which streams its bands chunk by chunk. Returns (readers, source arrays, cache keys,
+    nodata) keyed by variable name; variables of layers with a NoData value are masked
+    (reductions mark pixels with NoData in any band as NaN).
+    """
+    readers, sources, band_keys, nodata = {}, {}, {}, {}
+    for identifier, var_name in variable_map.items():
+        reduction = parse_reduction_identifier(identifier)
+        if reduction is not None:
+            layer_name, func, band_indices = reduction
+        else:
+            layer_name, band_id = identifier.rsplit('@', 1)
+            band_index = int(band_id[1:]) - 1
+        layer = layer_map[layer_name]
+        aligned = get_aligned_layer(layer, grid, resampling)
+        sources[var_name] = layer['data']
+        layer_nodata_value = layer_nodata(layer)
+        if reduction is None:
+            readers[var_name] = partial(aligned.read_band, band_index)
+            band_keys[var_name] = band_key(layer, band_index, grid.key, resampling)
+            if layer_nodata_value is not None:
+                nodata[var_name] = layer_nodata_value
+            continue
+        index = get_wavelength_index(layer)
+        spectral = SpectralReduction(
+            func, lambda bands, y0, y1, aligned=aligned: aligned.read(0, y0, grid.width, y1 - y0, bands=bands),
+            band_indices, index.wavelengths if index is not None else None, nodata=layer_nodata_value
+        )
+        readers[var_name] = spectral.read
+        band_keys[var_name] = ('reduction', func, layer_version(layer), tuple(band_indices), grid.key, resampling,
+                               layer_nodata_value)
+        if layer_nodata_value is not None:
+            nodata[var_name] = None
+    return readers, sources, band_keys, nodata
+
 class CalculationWorker(QThread):
     calculation_finished = Signal(np.ndarray, str, str, str)  # Added save_path parameter
     calculation_error = Signal(str)
     progress_updated = Signal(int)
 
-    def __init__(self, expression, layer_map, variable_map, output_name, parent_layer, save_path=None):
+    def __init__(self, expression, layer_map, variable_map, output_name, parent_layer, save_path=None,
+                 resampling='nearest'):
         super().__init__()
         self.expression = expression
         self.layer_map = layer_map
@@ -456,51 +545,95 @@ class CalculationWorker(QThread):
         self.output_name = output_name
         self.parent_layer = parent_layer
         self.save_path = save_path
+        self.resampling = resampling
 
     def run(self):
         try:
-            local_namespace = {'np': np}
-            # Add mathematical functions
-            math_functions = {
-                'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'asin': np.arcsin,
-                'acos': np.arccos, 'atan': np.arctan, 'sqrt': np.sqrt,
-                'exp': np.exp, 'log': np.log, 'log10': np.log10, 'abs': np.abs,
-                'ceil': np.ceil, 'floor': np.floor, 'round': np.round,
-                'min': np.minimum, 'max': np.maximum, 'mean': np.mean,
-                'median': np.median, 'std': np.std, 'var': np.var
-            }
-            local_namespace.update(math_functions)
-            self.progress_updated.emit(20)
-
-            for identifier, var_name in self.variable_map.items():
-                layer_name, band_id = identifier.split('@')
-                band_index = int(band_id[1:]) - 1
-                layer_data = self.layer_map[layer_name]['data']
-                local_namespace[var_name] = layer_data[:, :, band_index].astype(np.float64)
-
-            self.progress_updated.emit(50)
             processed_expression = self.expression
             for identifier, var_name in self.variable_map.items():
                 processed_expression = processed_expression.replace(f'"{identifier}"', var_name)
 
-            self.progress_updated.emit(70)
-            with np.errstate(divide='ignore', invalid='ignore'):
-                result_array = eval(processed_expression, {"__builtins__": {}}, local_namespace)
-
-            if np.isscalar(result_array):
-                result_array = np.full_like(list(local_namespace.values())[0], result_array)
-
-            result_array = np.nan_to_num(result_array, nan=0.0, posinf=0.0, neginf=0.0)
-            if result_array.ndim == 2:
-                result_array = result_array[:, :, np.newaxis]
+            # Every band is read on the parent layer's grid, tile by tile and in its native
+            # dtype; layers on other grids are resampled onto it as the tiles are read
+            grid = ReferenceGrid.from_layer(self.layer_map[self.parent_layer])
+            readers, sources, band_keys, nodata = build_band_readers(
+                self.variable_map, self.layer_map, grid, self.resampling)
+
+            # Re-runs reuse cached band loads, subterms and results of earlier expressions.
+            # NoData pixels of the inputs are masked: they are not computed and come out as 0
+            compiled = CachedBandMath(processed_expression, band_keys, nodata=nodata)
+            self.progress_updated.emit(10)
+
+            # One float32 output; everything else is tile-sized scratch, plus cached
+            # copies of the bands, subterms and result when they fit the cache budget
+            result_array = np.empty((grid.height, grid.width, 1), dtype=np.float32)
+            compiled.evaluate(
+                readers, sources, grid.height, grid.width, out=result_array[:, :, 0],
+                progress_callback=lambda done, total: self.progress_updated.emit(10 + int(90 * done / total))
+            )
 
             self.progress_updated.emit(100)
             self.calculation_finished.emit(result_array, self.output_name, self.parent_layer, self.save_path)
         except Exception as e:
             self.calculation_error.emit(str(e))
 
+class BatchCalculationWorker(QThread):
+    """Evaluates several expressions in one pass over their bands (see `BatchBandMath`)."""
+    batch_finished = Signal(np.ndarray, list, str, str, str)  # result, band names, output name, parent, save path
+    batch_error = Signal(str)
+    progress_updated = Signal(int)
+
+    def __init__(self, entries, layer_map, variable_map, output_name, parent_layer, save_path=None,
+                 resampling='nearest'):
+        super().__init__()
+        self.entries = entries  # (index name, expression)
+        self.layer_map = layer_map
+        self.variable_map = variable_map
+        self.output_name = output_name
+        self.parent_layer = parent_layer
+        self.save_path = save_path
+        self.resampling = resampling
+
+    def run(self):
+        try:
+            expressions = []
+            for _, expression in self.entries:
+                for identifier, var_name in self.variable_map.items():
+                    expression = expression.replace(f'"{identifier}"', var_name)
+                expressions.append(expression)
+            batch = BatchBandMath(expressions, list(self.variable_map.values()))
+
+            grid = ReferenceGrid.from_layer(self.layer_map[self.parent_layer])
+            readers, _, _, nodata = build_band_readers(self.variable_map, self.layer_map, grid, self.resampling)
+
+            # Band-sequential output, exposed as HxWxN like layers loaded through GDAL
+            result = batch.evaluate(
+                readers, grid.height, grid.width, nodata=nodata,
+                progress_callback=lambda done, total: self.progress_updated.emit(int(100 * done / total))
+            )
+            self.batch_finished.emit(np.moveaxis(result, 0, 2), [name for name, _ in self.entries],
+                                     self.output_name, self.parent_layer, self.save_path)
+        except Exception as e:
+            self.batch_error.emit(str(e))
+
+class BandStatisticsWorker(QThread):
+    """Waits for the shared band statistics of a layer (see `band_statistics`) off the UI thread."""
+    statistics_ready = Signal(str, object)  # layer name, BandStatistics
+    statistics_error = Signal(str)
+
+    def __init__(self, layer):
+        super().__init__()
+        self.layer = layer
+
+    def run(self):
+        try:
+            self.statistics_ready.emit(self.layer['name'], get_band_statistics(self.layer))
+        except Exception as e:
+            self.statistics_error.emit(str(e))
+
 class RasterCalculatorWindow(QDialog):
     calculation_complete = Signal(np.ndarray, str, str)
+    batch_complete = Signal(np.ndarray, str, str, list)  # result, layer name, parent layer, band names
 
     def __init__(self, all_layers: list, parent=None):
         super().__init__(parent)
@@ -509,6 +642,9 @@ class RasterCalculatorWindow(QDialog):
         self.all_layers = all_layers if all_layers is not None else []
         self.layer_map = {layer['name']: layer for layer in self.all_layers}
         self.calculation_worker = None
+        self.statistics_worker = None
+        # Superseded workers still running: kept referenced until they finish
+        self._retired_statistics_workers = []
         self.save_path = None  # Store save path
         
         self._setup_ui()
@@ -517,6 +653,8 @@ class RasterCalculatorWindow(QDialog):
         if self.all_layers:
             self._update_band_list(0)
             self._update_layer_info()
+            self._update_batch_presets()
+            self._on_layer_changed_for_statistics(0)
 
     def _setup_ui(self):
         main_layout = QVBoxLayout(self)
@@ -534,9 +672,14 @@ class RasterCalculatorWindow(QDialog):
         self._setup_functions_tab(func_tab)
         
         # Statistics Tab
-        stats_tab = QWidget()
-        self.tab_widget.addTab(stats_tab, "Statistics")
-        self._setup_statistics_tab(stats_tab)
+        self.stats_tab = QWidget()
+        self.tab_widget.addTab(self.stats_tab, "Statistics")
+        self._setup_statistics_tab(self.stats_tab)
+
+        # Batch Tab
+        self.batch_tab = QWidget()
+        self.tab_widget.addTab(self.batch_tab, "Batch Indices")
+        self._setup_batch_tab(self.batch_tab)
         
         # Progress bar and Buttons
         self.progress_bar = QProgressBar()
@@ -577,7 +720,10 @@ class RasterCalculatorWindow(QDialog):
         expr_layout = QVBoxLayout(expr_group)
         self.expression_edit = QTextEdit()
         self.expression_edit.setMaximumHeight(100)
-        self.expression_edit.setPlaceholderText('Enter your raster calculation expression...')
+        self.expression_edit.setPlaceholderText('Enter your raster calculation expression, e.g. '
+                                                '("layer@b4" - "layer@b3") or R(860nm) / R(670nm), '
+                                                'mean(R(700nm:750nm)), argmax("layer@b10:b50"), depth(R(2120nm:2250nm)), '
+                                                'CR(680nm, 550nm, 750nm)...')
         expr_layout.addWidget(self.expression_edit)
         
         # Expression validation
@@ -633,6 +779,14 @@ class RasterCalculatorWindow(QDialog):
         self.add_to_project_cb.setChecked(True)
         options_layout.addWidget(self.add_to_project_cb)
         output_layout.addLayout(options_layout)
+
+        # Layers on another grid are resampled onto the grid of the first referenced layer
+        resample_layout = QHBoxLayout()
+        resample_layout.addWidget(QLabel("Resampling (different grids):"))
+        self.resampling_combo = QComboBox()
+        self.resampling_combo.addItems(["nearest", "bilinear"])
+        resample_layout.addWidget(self.resampling_combo)
+        output_layout.addLayout(resample_layout)
         right_panel.addWidget(output_group)
         
         layout.addLayout(left_panel, 1)
@@ -653,6 +807,46 @@ class RasterCalculatorWindow(QDialog):
             math_layout.addWidget(btn, i // 3, i % 3)
         layout.addWidget(math_group)
 
+    def _setup_batch_tab(self, parent):
+        layout = QVBoxLayout(parent)
+        info = QLabel("All selected indices are computed in a single pass over the image "
+                      "and written as one multi-band layer.")
+        info.setWordWrap(True)
+        layout.addWidget(info)
+
+        preset_group = QGroupBox("Index Presets")
+        preset_layout = QVBoxLayout(preset_group)
+        self.batch_layer_combo = QComboBox()
+        self.batch_layer_combo.addItems([layer['name'] for layer in self.all_layers])
+        preset_layout.addWidget(QLabel("Layer (bands are picked by wavelength):"))
+        preset_layout.addWidget(self.batch_layer_combo)
+        self.batch_preset_list = QListWidget()
+        preset_layout.addWidget(self.batch_preset_list)
+        layout.addWidget(preset_group)
+
+        custom_group = QGroupBox("Custom Expressions")
+        custom_layout = QVBoxLayout(custom_group)
+        self.batch_custom_edit = QTextEdit()
+        self.batch_custom_edit.setMaximumHeight(100)
+        self.batch_custom_edit.setPlaceholderText('One per line, e.g.  Ratio = "layer@b4" / "layer@b3"')
+        custom_layout.addWidget(self.batch_custom_edit)
+        layout.addWidget(custom_group)
+
+        output_layout = QHBoxLayout()
+        output_layout.addWidget(QLabel("Output Layer Name:"))
+        self.batch_output_name_edit = QLineEdit()
+        self.batch_output_name_edit.setPlaceholderText("Spectral_Indices")
+        output_layout.addWidget(self.batch_output_name_edit)
+        self.batch_save_cb = QCheckBox("Save to file")
+        self.batch_choose_location_btn = QPushButton("Choose Location")
+        self.batch_choose_location_btn.setEnabled(False)
+        output_layout.addWidget(self.batch_save_cb)
+        output_layout.addWidget(self.batch_choose_location_btn)
+        layout.addLayout(output_layout)
+        self.batch_save_location_label = QLabel("No location selected")
+        layout.addWidget(self.batch_save_location_label)
+        self.batch_save_path = None
+
     def _setup_statistics_tab(self, parent):
         layout = QVBoxLayout(parent)
         stats_group = QGroupBox("Statistical Functions")
@@ -670,9 +864,11 @@ class RasterCalculatorWindow(QDialog):
         # Band statistics
         band_stats_group = QGroupBox("Band Statistics")
         band_stats_layout = QVBoxLayout(band_stats_group)
-        self.stats_table = QTableWidget(0, 4)
-        self.stats_table.setHorizontalHeaderLabels(['Band', 'Min', 'Max', 'Mean'])
+        self.stats_table = QTableWidget(0, 6)
+        self.stats_table.setHorizontalHeaderLabels(['Band', 'Min', 'Max', 'Mean', 'Std', 'Valid'])
         band_stats_layout.addWidget(self.stats_table)
+        self.stats_status_label = QLabel()
+        band_stats_layout.addWidget(self.stats_status_label)
         refresh_stats_btn = QPushButton("Refresh Statistics")
         refresh_stats_btn.clicked.connect(self._refresh_band_statistics)
         band_stats_layout.addWidget(refresh_stats_btn)
@@ -681,12 +877,17 @@ class RasterCalculatorWindow(QDialog):
     def _connect_signals(self):
         self.layer_selector.currentIndexChanged.connect(self._update_band_list)
         self.layer_selector.currentIndexChanged.connect(self._update_layer_info)
+        self.layer_selector.currentIndexChanged.connect(self._on_layer_changed_for_statistics)
+        self.tab_widget.currentChanged.connect(self._on_tab_changed)
         self.bands_list.itemDoubleClicked.connect(self._add_band_to_expression)
         self.apply_preset_btn.clicked.connect(self._apply_preset)
         self.validate_btn.clicked.connect(self._validate_expression)
         self.save_to_file_cb.toggled.connect(self._on_save_to_file_toggled)
         self.choose_location_btn.clicked.connect(self._choose_save_location)
-        self.button_box.accepted.connect(self._execute_calculation)
+        self.button_box.accepted.connect(self._execute)
+        self.batch_layer_combo.currentIndexChanged.connect(self._update_batch_presets)
+        self.batch_save_cb.toggled.connect(self._on_batch_save_toggled)
+        self.batch_choose_location_btn.clicked.connect(self._choose_batch_save_location)
         self.button_box.rejected.connect(self.reject)
 
     def _populate_presets(self):
@@ -783,7 +984,11 @@ class RasterCalculatorWindow(QDialog):
             self.validation_status.setStyleSheet("color: orange;")
             return
         
-        is_valid, message = ExpressionValidator.validate_complete(expression, self.layer_map)
+        try:
+            expression = resolve_band_references(expression, self.layer_map, self.layer_selector.currentText())
+            is_valid, message = ExpressionValidator.validate_complete(expression, self.layer_map)
+        except ValueError as e:
+            is_valid, message = False, str(e)
         
         if is_valid:
             self.validation_status.setText("✓ Valid expression")
@@ -805,31 +1010,216 @@ class RasterCalculatorWindow(QDialog):
             self,
             "Save Calculation Result",
             "",
-            "NumPy Arrays (*.npy);;TIFF Images (*.tif);;All Files (*)"
+            "GeoTIFF (*.tif);;ENVI (*.hdr);;Zarr (*.zarr);;NumPy Arrays (*.npy);;All Files (*)"
         )
         
         if file_path:
             self.save_path = file_path
             self.save_location_label.setText(f"Save to: {os.path.basename(file_path)}")
 
+    def _on_tab_changed(self, index):
+        if self.tab_widget.widget(index) is self.stats_tab:
+            self._refresh_band_statistics()
+
+    def _on_layer_changed_for_statistics(self, index):
+        """Start computing the new layer's statistics in the background, so the tab opens instantly"""
+        if not self.all_layers:
+            return
+        request_band_statistics(self.all_layers[index])
+        if self.tab_widget.currentWidget() is self.stats_tab:
+            self._refresh_band_statistics()
+
     def _refresh_band_statistics(self):
         if not self.all_layers:
             return
-        index = self.layer_selector.currentIndex()
-        layer = self.all_layers[index]
-        data = layer['data']
-        self.stats_table.setRowCount(data.shape[2])
-        for i in range(data.shape[2]):
-            band_data = data[:, :, i]
-            band_data = band_data[~np.isnan(band_data)]
-            if len(band_data) > 0:
-                min_val = np.min(band_data)
-                max_val = np.max(band_data)
-                mean_val = np.mean(band_data)
-                self.stats_table.setItem(i, 0, QTableWidgetItem(f"Band {i+1}"))
-                self.stats_table.setItem(i, 1, QTableWidgetItem(f"{min_val:.4f}"))
-                self.stats_table.setItem(i, 2, QTableWidgetItem(f"{max_val:.4f}"))
-                self.stats_table.setItem(i, 3, QTableWidgetItem(f"{mean_val:.4f}"))
+        layer = self.all_layers[self.layer_selector.currentIndex()]
+        stats = cached_band_statistics(layer)
+        if stats is not None:
+            self._fill_statistics_table(stats)
+            return
+        self.stats_table.setRowCount(0)
+        self.stats_status_label.setText(f"Computing statistics of '{layer['name']}'...")
+        if self.statistics_worker is not None and self.statistics_worker.isRunning():
+            # The running worker's result is shown if it is still the selected layer
+            if self.statistics_worker.layer is layer:
+                return
+            self._retire_statistics_worker(self.statistics_worker)
+        self.statistics_worker = BandStatisticsWorker(layer)
+        self.statistics_worker.statistics_ready.connect(self._on_statistics_ready)
+        self.statistics_worker.statistics_error.connect(
+            lambda message: self.stats_status_label.setText(f"Statistics failed: {message}")
+        )
+        self.statistics_worker.start()
+
+    def _retire_statistics_worker(self, worker):
+        # A QThread destroyed while running aborts the application
+        worker.statistics_ready.disconnect()
+        self._retired_statistics_workers.append(worker)
+        worker.finished.connect(lambda: self._retired_statistics_workers.remove(worker))
+
+    def _on_statistics_ready(self, layer_name, stats):
+        if self.all_layers and self.layer_selector.currentText() == layer_name:
+            self._fill_statistics_table(stats)
+
+    def _fill_statistics_table(self, stats):
+        self.stats_table.setRowCount(stats.num_bands)
+        for i in range(stats.num_bands):
+            self.stats_table.setItem(i, 0, QTableWidgetItem(f"Band {i+1}"))
+            if stats.count[i] > 0:
+                self.stats_table.setItem(i, 1, QTableWidgetItem(f"{stats.min[i]:.4f}"))
+                self.stats_table.setItem(i, 2, QTableWidgetItem(f"{stats.max[i]:.4f}"))
+                self.stats_table.setItem(i, 3, QTableWidgetItem(f"{stats.mean[i]:.4f}"))
+                self.stats_table.setItem(i, 4, QTableWidgetItem(f"{stats.std[i]:.4f}"))
+            self.stats_table.setItem(i, 5, QTableWidgetItem(str(int(stats.count[i]))))
+        self.stats_status_label.setText(f"{stats.num_pixels} pixels per band")
+
+    def _update_batch_presets(self, *args):
+        """List the index presets; only those the layer has bands for can be checked"""
+        self.batch_preset_list.clear()
+        self.batch_preset_expressions = {}
+        if not self.all_layers:
+            return
+        layer_name = self.batch_layer_combo.currentText()
+        for name, preset in BATCH_INDEX_PRESETS.items():
+            item = QListWidgetItem(name)
+            try:
+                expression = resolve_band_references(preset, self.layer_map, layer_name)
+            except ValueError as e:
+                item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsEnabled)
+                item.setToolTip(f"{preset}\n{e}")
+            else:
+                item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+                item.setCheckState(Qt.CheckState.Unchecked)
+                item.setToolTip(f"{preset}\n= {expression}")
+                self.batch_preset_expressions[name] = expression
+            self.batch_preset_list.addItem(item)
+
+    def _on_batch_save_toggled(self, checked):
+        self.batch_choose_location_btn.setEnabled(checked)
+        if not checked:
+            self.batch_save_path = None
+            self.batch_save_location_label.setText("No location selected")
+
+    def _choose_batch_save_location(self):
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Save Index Layer",
+            "",
+            "GeoTIFF (*.tif);;ENVI (*.hdr);;Zarr (*.zarr);;NumPy Arrays (*.npy);;All Files (*)"
+        )
+        if file_path:
+            self.batch_save_path = file_path
+            self.batch_save_location_label.setText(f"Save to: {os.path.basename(file_path)}")
+
+    def _batch_entries(self):
+        """(index name, expression) for the checked presets followed by the custom expressions"""
+        entries = []
+        for row in range(self.batch_preset_list.count()):
+            item = self.batch_preset_list.item(row)
+            if item.checkState() == Qt.CheckState.Checked:
+                entries.append((item.text(), self.batch_preset_expressions[item.text()]))
+
+        for line in self.batch_custom_edit.toPlainText().splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            name, sep, expression = line.partition('=')
+            # Unnamed lines (or a comparison such as "==" / ">=") keep the whole line as expression
+            if not sep or expression.startswith('=') or '"' in name or not name.strip():
+                name, expression = f"Index {len(entries) + 1}", line
+            entries.append((name.strip(), expression.strip()))
+        return entries
+
+    def _execute(self):
+        """Run the calculation of the current tab"""
+        if self.tab_widget.currentWidget() is self.batch_tab:
+            self._execute_batch()
+        else:
+            self._execute_calculation()
+
+    def _execute_batch(self):
+        """Execute all selected indices in a single pass over the bands they use"""
+        entries = self._batch_entries()
+        if not entries:
+            QMessageBox.warning(self, "Input Error", "Select at least one index or enter a custom expression.")
+            return
+        for i, (name, expression) in enumerate(entries):
+            try:
+                expression = resolve_band_references(expression, self.layer_map, self.batch_layer_combo.currentText())
+            except ValueError as e:
+                QMessageBox.critical(self, "Expression Error", f"Invalid expression for '{name}': {e}")
+                return
+            is_valid, message = ExpressionValidator.validate_complete(expression, self.layer_map)
+            if not is_valid:
+                QMessageBox.critical(self, "Expression Error", f"Invalid expression for '{name}': {message}")
+                return
+            entries[i] = (name, expression)
+
+        if self.batch_save_cb.isChecked() and not self.batch_save_path:
+            QMessageBox.warning(self, "Save Location", "Please choose a save location.")
+            return
+
+        # The first referenced layer defines the output grid for all indices
+        band_identifiers = list(dict.fromkeys(
+            identifier for _, expression in entries for identifier in re.findall(BAND_IDENTIFIER_PATTERN, expression)))
+        layers = [self.layer_map[name] for name in dict.fromkeys(identifier_layer(i) for i in band_identifiers)]
+        grids_valid, grids_msg = check_alignable(layers, ReferenceGrid.from_layer(layers[0]))
+        if not grids_valid:
+            QMessageBox.critical(self, "Expression Error", grids_msg)
+            return
+
+        variable_map = {identifier: f'var_{i}' for i, identifier in enumerate(band_identifiers)}
+        output_name = self.batch_output_name_edit.text().strip() or "Spectral_Indices"
+        self.calculation_worker = BatchCalculationWorker(
+            entries, self.layer_map, variable_map, output_name, layers[0]['name'],
+            self.batch_save_path if self.batch_save_cb.isChecked() else None,
+            resampling=self.resampling_combo.currentText()
+        )
+        self.calculation_worker.batch_finished.connect(self._on_batch_finished)
+        self.calculation_worker.batch_error.connect(self._on_calculation_error)
+        self.calculation_worker.progress_updated.connect(self._on_progress_updated)
+
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setValue(0)
+        self.button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(False)
+        self.calculation_worker.start()
+
+    def _on_batch_finished(self, result_array, band_names, output_name, parent_layer, save_path):
+        """Handle completion of a batch index calculation"""
+        self.progress_bar.setVisible(False)
+        self.button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(True)
+
+        if save_path:
+            expressions = "; ".join(f"{name} = {expression}" for name, expression in self.calculation_worker.entries)
+            self._save_result(save_path, result_array, parent_layer, band_names, {'INDICES': expressions})
+
+        self.batch_complete.emit(result_array, output_name, parent_layer, band_names)
+
+        if self.add_to_project_cb.isChecked():
+            QMessageBox.information(self, "Success", f"Computed {len(band_names)} indices in one pass.\nOutput: {output_name}")
+
+        self.accept()
+
+    def _save_result(self, save_path, result_array, parent_layer, band_names, metadata):
+        """Save a result, georeferenced like its parent layer"""
+        try:
+            if save_path.endswith('.npy'):
+                np.save(save_path, result_array)
+            else:
+                # GeoTIFF / ENVI / Zarr, georeferenced like the parent layer
+                parent = self.layer_map.get(parent_layer, {})
+                exporter = create_exporter(save_path, data_type='Float32')
+                save_path = exporter.export(
+                    ArraySource(result_array),
+                    geotransform=parent.get('geotransform'),
+                    projection=parent.get('projection'),
+                    band_names=band_names,
+                    metadata={'SOURCE_FILE': parent_layer, **metadata},
+                )
+
+            QMessageBox.information(self, "File Saved", f"Result saved to {save_path}")
+        except Exception as e:
+            QMessageBox.warning(self, "Save Error", f"Could not save file: {str(e)}")
 
     def _execute_calculation(self):
         """Execute the raster calculation with validation"""
@@ -838,6 +1228,13 @@ class RasterCalculatorWindow(QDialog):
             QMessageBox.warning(self, "Input Error", "Expression cannot be empty.")
             return
 
+        # Wavelength references (R(860nm), "layer@860nm", ...) resolve to "layer@bN" bands
+        try:
+            expression = resolve_band_references(expression, self.layer_map, self.layer_selector.currentText())
+        except ValueError as e:
+            QMessageBox.critical(self, "Expression Error", f"Invalid expression: {e}")
+            return
+
         # Validate expression first
         is_valid, message = ExpressionValidator.validate_complete(expression, self.layer_map)
         if not is_valid:
@@ -851,7 +1248,8 @@ class RasterCalculatorWindow(QDialog):
 
         try:
             # Find band identifiers and create variable mapping
-            band_identifiers = set(re.findall(r'"([^"]+@b\d+)"', expression))
+            # Keep order of appearance: the first referenced layer defines the output grid
+            band_identifiers = list(dict.fromkeys(re.findall(BAND_IDENTIFIER_PATTERN, expression)))
             variable_map = {}
             for i, identifier in enumerate(band_identifiers):
                 variable_map[identifier] = f'var_{i}'
@@ -860,11 +1258,12 @@ class RasterCalculatorWindow(QDialog):
             if not output_name:
                 output_name = "Calculated_Raster"
 
-            parent_layer = list(band_identifiers)[0].split('@')[0]
+            parent_layer = identifier_layer(band_identifiers[0])
 
             # Start calculation
             self.calculation_worker = CalculationWorker(
-                expression, self.layer_map, variable_map, output_name, parent_layer, self.save_path
+                expression, self.layer_map, variable_map, output_name, parent_layer, self.save_path,
+                resampling=self.resampling_combo.currentText()
             )
             self.calculation_worker.calculation_finished.connect(self._on_calculation_finished)
             self.calculation_worker.calculation_error.connect(self._on_calculation_error)
@@ -886,25 +1285,8 @@ class RasterCalculatorWindow(QDialog):
         
         # Save to file if requested
         if save_path:
-            try:
-                if save_path.endswith('.npy'):
-                    np.save(save_path, result_array)
-                elif save_path.endswith('.tif') or save_path.endswith('.tiff'):
-                    # Basic TIFF save (you might want to use rasterio for more advanced features)
-                    try:
-                        from PIL import Image
-                        # Normalize for display
-                        normalized = ((result_array[:,:,0] - result_array[:,:,0].min()) / 
-                                    (result_array[:,:,0].max() - result_array[:,:,0].min()) * 255).astype(np.uint8)
-                        Image.fromarray(normalized).save(save_path)
-                    except ImportError:
-                        # Fallback to numpy save if PIL not available
-                        np.save(save_path.replace('.tif', '.npy'), result_array)
-                        QMessageBox.information(self, "Format Note", "PIL not available. Saved as .npy format instead.")
-                
-                QMessageBox.information(self, "File Saved", f"Result saved to {save_path}")
-            except Exception as e:
-                QMessageBox.warning(self, "Save Error", f"Could not save file: {str(e)}")
+            self._save_result(save_path, result_array, parent_layer, [output_name],
+                              {'EXPRESSION': self.expression_edit.toPlainText().strip()})
         
         # Emit signal for adding to project
         self.calculation_complete.emit(result_array, output_name, parent_layer)
@@ -924,6 +1306,12 @@ class RasterCalculatorWindow(QDialog):
         """Update progress bar"""
         self.progress_bar.setValue(value)
 
+    def closeEvent(self, event):
+        for worker in [self.statistics_worker] + self._retired_statistics_workers:
+            if worker is not None and worker.isRunning():
+                worker.wait()
+        super().closeEvent(event)
+
 
 
 
@@ -0,0 +1,166 @@
+#src/ui/roi_stats_window.py
+import os
+import numpy as np
+import pandas as pd
+
+from PySide6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QTabWidget, QWidget, QLabel,
+    QTableWidget, QTableWidgetItem, QHeaderView, QFileDialog, QMessageBox
+)
+from matplotlib.figure import Figure
+from matplotlib.colors import LogNorm
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+
+from src.core.roi_stats import ROIStatistics, spectral_density
+
+
+class ROIStatsWindow(QDialog):
+    """Shows the spectral statistics of an ROI: density plot, statistics table and band correlation."""
+
+    def __init__(self, stats: ROIStatistics, layer_name: str, band_names=None, wavelengths=None,
+                 wavelength_units="nm", parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"ROI Statistics: {stats.roi_name} ({layer_name})")
+        self.setMinimumSize(900, 700)
+
+        self.stats = stats
+        self.layer_name = layer_name
+        bands = stats.mean.shape[0]
+        self.band_names = band_names if band_names and len(band_names) == bands else [f"Band {i+1}" for i in range(bands)]
+        self.has_wavelengths = wavelengths is not None and len(wavelengths) == bands
+        self.x_values = np.asarray(wavelengths, dtype=float) if self.has_wavelengths else np.arange(1, bands + 1)
+        self.x_label = f"Wavelength ({wavelength_units})" if self.has_wavelengths else "Band Number"
+
+        self._setup_ui()
+        self._plot_density()
+        self._plot_correlation()
+        self._populate_table()
+
+    def _setup_ui(self):
+        layout = QVBoxLayout(self)
+        summary = QLabel(
+            f"Layer: {self.layer_name}    ROI pixels: {self.stats.total_pixels}    "
+            f"Valid pixels: {self.stats.count}    Bands: {self.stats.mean.shape[0]}"
+        )
+        layout.addWidget(summary)
+
+        self.tabs = QTabWidget()
+        layout.addWidget(self.tabs)
+
+        # Spectral density tab
+        plot_tab = QWidget()
+        plot_layout = QVBoxLayout(plot_tab)
+        self.figure = Figure(figsize=(8, 5))
+        self.canvas = FigureCanvas(self.figure)
+        plot_layout.addWidget(NavigationToolbar(self.canvas, self))
+        plot_layout.addWidget(self.canvas)
+        self.tabs.addTab(plot_tab, "Spectra")
+
+        # Statistics table tab
+        self.table = QTableWidget()
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.tabs.addTab(self.table, "Statistics")
+
+        # Correlation tab
+        corr_tab = QWidget()
+        corr_layout = QVBoxLayout(corr_tab)
+        self.corr_figure = Figure(figsize=(6, 5))
+        self.corr_canvas = FigureCanvas(self.corr_figure)
+        corr_layout.addWidget(NavigationToolbar(self.corr_canvas, self))
+        corr_layout.addWidget(self.corr_canvas)
+        self.tabs.addTab(corr_tab, "Band Correlation")
+
+        # Buttons
+        button_layout = QHBoxLayout()
+        export_btn = QPushButton("Export Statistics (CSV)")
+        export_btn.clicked.connect(self.export_statistics)
+        close_btn = QPushButton("Close")
+        close_btn.clicked.connect(self.accept)
+        button_layout.addWidget(export_btn)
+        button_layout.addStretch()
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+
+    def _plot_density(self):
+        """Draws the pixel sample as a (band, value) density image with the summary spectra on top."""
+        ax = self.figure.add_subplot(111)
+        stats = self.stats
+        if stats.sample.shape[0]:
+            counts, lo, hi = spectral_density(stats.sample)
+            x = self.x_values
+            # Band edges half way between centres so irregular wavelength grids render correctly
+            if len(x) > 1:
+                mid = (x[1:] + x[:-1]) / 2
+                edges = np.concatenate([[x[0] - (mid[0] - x[0])], mid, [x[-1] + (x[-1] - mid[-1])]])
+            else:
+                edges = np.array([x[0] - 0.5, x[0] + 0.5])
+            value_edges = np.linspace(lo, hi, counts.shape[0] + 1)
+            masked = np.ma.masked_equal(counts, 0)
+            mesh = ax.pcolormesh(edges, value_edges, masked, cmap='viridis', norm=LogNorm(), shading='flat')
+            self.figure.colorbar(mesh, ax=ax, label="Pixel count")
+
+        ax.plot(self.x_values, stats.mean, color='red', linewidth=1.5, label='Mean')
+        ax.plot(self.x_values, stats.mean + stats.std, color='orange', linewidth=1, linestyle='--', label='Mean ± Std')
+        ax.plot(self.x_values, stats.mean - stats.std, color='orange', linewidth=1, linestyle='--')
+        ax.plot(self.x_values, stats.min, color='white', linewidth=0.8, linestyle=':', label='Min / Max')
+        ax.plot(self.x_values, stats.max, color='white', linewidth=0.8, linestyle=':')
+        if 50 in stats.percentiles:
+            ax.plot(self.x_values, stats.percentiles[50], color='cyan', linewidth=1, label='Median')
+
+        ax.set_xlabel(self.x_label)
+        ax.set_ylabel("Pixel Value")
+        ax.set_title(f"{stats.roi_name}: {stats.count} pixels")
+        ax.legend(loc='upper right', fontsize='small')
+        self.figure.tight_layout()
+        self.canvas.draw()
+
+    def _plot_correlation(self):
+        ax = self.corr_figure.add_subplot(111)
+        image = ax.imshow(self.stats.correlation(), cmap='RdBu_r', vmin=-1, vmax=1, interpolation='nearest')
+        ax.set_title("Band-to-band correlation")
+        ax.set_xlabel("Band")
+        ax.set_ylabel("Band")
+        self.corr_figure.colorbar(image, ax=ax)
+        self.corr_figure.tight_layout()
+        self.corr_canvas.draw()
+
+    def _statistics_frame(self) -> pd.DataFrame:
+        data = {
+            "Band_Name": self.band_names,
+            self.x_label: self.x_values,
+            "Mean": self.stats.mean,
+            "Std": self.stats.std,
+            "Min": self.stats.min,
+            "Max": self.stats.max,
+        }
+        for p, values in self.stats.percentiles.items():
+            data[f"P{p:g}"] = values
+        return pd.DataFrame(data)
+
+    def _populate_table(self):
+        frame = self._statistics_frame()
+        self.table.setColumnCount(len(frame.columns))
+        self.table.setHorizontalHeaderLabels([str(c) for c in frame.columns])
+        self.table.setRowCount(len(frame))
+        self.table.setUpdatesEnabled(False)
+        for j, column in enumerate(frame.columns):
+            values = frame[column].to_numpy()
+            for i, value in enumerate(values):
+                text = f"{value:.4f}" if isinstance(value, (float, np.floating)) else str(value)
+                self.table.setItem(i, j, QTableWidgetItem(text))
+        self.table.setUpdatesEnabled(True)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+
+    def export_statistics(self):
+        default_name = f"{os.path.splitext(self.layer_name)[0]}_{self.stats.roi_name.replace(' ', '_')}_stats.csv"
+        path, _ = QFileDialog.getSaveFileName(self, "Save ROI Statistics", default_name, "CSV Files (*.csv)")
+        if not path:
+            return
+        try:
+            self._statistics_frame().to_csv(path, index=False)
+            cov_path = os.path.splitext(path)[0] + "_covariance.csv"
+            pd.DataFrame(self.stats.covariance, index=self.band_names, columns=self.band_names).to_csv(cov_path)
+            QMessageBox.information(self, "Success", f"Statistics exported to {path}\nCovariance exported to {cov_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Export Error", str(e))
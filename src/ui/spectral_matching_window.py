@@ -0,0 +1,239 @@
+#src/ui/spectral_matching_window.py
+import os
+import logging
+import numpy as np
+from PySide6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, QComboBox, QPushButton, QGroupBox,
+    QSpinBox, QDoubleSpinBox, QCheckBox, QProgressBar, QTableWidget, QTableWidgetItem,
+    QHeaderView, QFileDialog, QMessageBox
+)
+from PySide6.QtCore import QThread, Signal
+
+from src.core.spectral_library import FILE_FILTER, SpectralLibrary, load_spectral_library, open_libraries
+from src.core.spectral_matching import MATCH_METHODS, SpectralMatcher
+from src.core.spectral_resampling import layer_spectral_grid, resample_library_to_layer
+
+logger = logging.getLogger(__name__)
+
+
+class MatchingWorker(QThread):
+    """Runs `SpectralMatcher.match` off the UI thread."""
+    matching_finished = Signal(object)
+    matching_error = Signal(str)
+    progress_updated = Signal(int)
+
+    def __init__(self, matcher, data, options):
+        super().__init__()
+        self.matcher = matcher
+        self.data = data
+        self.options = options
+
+    def run(self):
+        try:
+            result = self.matcher.match(
+                self.data,
+                progress_callback=lambda done, total: self.progress_updated.emit(int(100 * done / total)),
+                **self.options
+            )
+            self.matching_finished.emit(result)
+        except Exception as e:
+            logger.error(f"Spectral matching failed: {e}", exc_info=True)
+            self.matching_error.emit(str(e))
+
+
+class SpectralMatchingWindow(QDialog):
+    """
+    Classifies a layer against spectral library or endmember spectra with SAM, SID or SCM.
+    The result is emitted as a layer with bands: class (1..K, 0 = unclassified),
+    best score and, for top-k > 1, the class of each further rank.
+    """
+    matching_complete = Signal(np.ndarray, str, str)
+
+    def __init__(self, all_layers, endmembers=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Spectral Matching")
+        self.setMinimumSize(520, 600)
+        self.all_layers = all_layers
+        self.endmembers = endmembers
+        self.references = []  # (label, SpectralLibrary or ndarray)
+        self.worker = None
+        self._matcher = None
+        self._setup_ui()
+        self._refresh_references()
+
+    def _setup_ui(self):
+        layout = QVBoxLayout(self)
+
+        input_group = QGroupBox("Input")
+        input_layout = QFormLayout(input_group)
+        self.layer_combo = QComboBox()
+        self.layer_combo.addItems([layer['name'] for layer in self.all_layers])
+        input_layout.addRow("Image layer:", self.layer_combo)
+
+        ref_layout = QHBoxLayout()
+        self.reference_combo = QComboBox()
+        browse_btn = QPushButton("Open Library...")
+        browse_btn.clicked.connect(self._browse_library)
+        ref_layout.addWidget(self.reference_combo, 1)
+        ref_layout.addWidget(browse_btn)
+        input_layout.addRow("References:", ref_layout)
+        layout.addWidget(input_group)
+
+        options_group = QGroupBox("Options")
+        options_layout = QFormLayout(options_group)
+        self.method_combo = QComboBox()
+        for key, label in MATCH_METHODS.items():
+            self.method_combo.addItem(label, key)
+        self.method_combo.currentIndexChanged.connect(self._on_method_changed)
+        options_layout.addRow("Method:", self.method_combo)
+
+        self.top_k_spin = QSpinBox()
+        self.top_k_spin.setRange(1, 20)
+        self.top_k_spin.setValue(1)
+        self.top_k_spin.setToolTip("Number of best-matching references kept per pixel")
+        options_layout.addRow("Top-k matches:", self.top_k_spin)
+
+        self.threshold_check = QCheckBox("Leave pixels unclassified beyond:")
+        self.threshold_spin = QDoubleSpinBox()
+        self.threshold_spin.setDecimals(4)
+        self.threshold_spin.setEnabled(False)
+        self.threshold_check.toggled.connect(self.threshold_spin.setEnabled)
+        threshold_layout = QHBoxLayout()
+        threshold_layout.addWidget(self.threshold_check)
+        threshold_layout.addWidget(self.threshold_spin)
+        options_layout.addRow(threshold_layout)
+        self._on_method_changed()
+        layout.addWidget(options_group)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+
+        self.results_table = QTableWidget(0, 2)
+        self.results_table.setHorizontalHeaderLabels(["Class", "Pixels"])
+        self.results_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.results_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.results_table)
+
+        button_layout = QHBoxLayout()
+        self.run_btn = QPushButton("Run Matching")
+        self.run_btn.clicked.connect(self._run_matching)
+        close_btn = QPushButton("Close")
+        close_btn.clicked.connect(self.close)
+        button_layout.addStretch()
+        button_layout.addWidget(self.run_btn)
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+
+    def _on_method_changed(self):
+        method = self.method_combo.currentData()
+        if method == 'sam':
+            self.threshold_check.setText("Maximum angle (radians):")
+            self.threshold_spin.setRange(0.0, np.pi)
+            self.threshold_spin.setValue(0.1)
+        elif method == 'sid':
+            self.threshold_check.setText("Maximum divergence:")
+            self.threshold_spin.setRange(0.0, 100.0)
+            self.threshold_spin.setValue(0.05)
+        else:
+            self.threshold_check.setText("Minimum correlation:")
+            self.threshold_spin.setRange(-1.0, 1.0)
+            self.threshold_spin.setValue(0.9)
+
+    def _refresh_references(self):
+        self.references = []
+        if self.endmembers is not None and len(self.endmembers):
+            self.references.append((f"PPI endmembers ({len(self.endmembers)})", np.asarray(self.endmembers)))
+        for library in open_libraries():
+            self.references.append((f"{library.display_name} ({library.num_spectra} spectra)", library))
+        self.reference_combo.clear()
+        self.reference_combo.addItems([label for label, _ in self.references])
+
+    def _browse_library(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Spectral Library", "", FILE_FILTER)
+        if not file_path:
+            return
+        try:
+            library = load_spectral_library(file_path)
+        except Exception as e:
+            QMessageBox.critical(self, "Spectral Library", f"Could not open {os.path.basename(file_path)}:\n{e}")
+            return
+        self._refresh_references()
+        index = next((i for i, (_, ref) in enumerate(self.references) if ref is library), 0)
+        self.reference_combo.setCurrentIndex(index)
+
+    def _reference_spectra(self, layer):
+        """(spectra, names) on the layer's bands, resampling libraries when needed."""
+        label, reference = self.references[self.reference_combo.currentIndex()]
+        num_bands = layer['data'].shape[2]
+        if not isinstance(reference, SpectralLibrary):
+            return reference, [f"Endmember {i + 1}" for i in range(reference.shape[0])]
+        if layer_spectral_grid(layer) is not None:
+            library = resample_library_to_layer(reference, layer)
+            # Bands the library does not cover come back as NaN
+            if np.isnan(library.spectra).any():
+                raise ValueError(f"{reference.display_name} does not cover the wavelength range of the layer.")
+            return library.spectra, library.names
+        if reference.num_bands == num_bands:
+            return np.asarray(reference.spectra), reference.names
+        raise ValueError(f"Layer '{layer['name']}' has no wavelengths and {num_bands} bands, "
+                         f"the library has {reference.num_bands}; cannot match them.")
+
+    def _run_matching(self):
+        if not self.references:
+            QMessageBox.warning(self, "Spectral Matching", "Open a spectral library first.")
+            return
+        layer = self.all_layers[self.layer_combo.currentIndex()]
+        try:
+            spectra, names = self._reference_spectra(layer)
+            self._matcher = SpectralMatcher(spectra, self.method_combo.currentData(), names)
+        except Exception as e:
+            QMessageBox.critical(self, "Spectral Matching", str(e))
+            return
+
+        metadata = layer.get('metadata', {}) or {}
+        nodata = metadata.get('NoData')
+        options = {
+            'top_k': self.top_k_spin.value(),
+            'threshold': self.threshold_spin.value() if self.threshold_check.isChecked() else None,
+            'nodata': float(nodata) if nodata is not None else None,
+        }
+        self._layer_name = layer['name']
+        self.run_btn.setEnabled(False)
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setValue(0)
+
+        self.worker = MatchingWorker(self._matcher, layer['data'], options)
+        self.worker.progress_updated.connect(self.progress_bar.setValue)
+        self.worker.matching_finished.connect(self._on_matching_finished)
+        self.worker.matching_error.connect(self._on_matching_error)
+        self.worker.start()
+
+    def _on_matching_finished(self, result):
+        self.run_btn.setEnabled(True)
+        self.progress_bar.setVisible(False)
+
+        counts = result.class_counts()
+        unclassified = int(np.count_nonzero(result.class_map < 0))
+        self.results_table.setRowCount(len(result.reference_names) + 1)
+        for i, (name, count) in enumerate(zip(result.reference_names, counts)):
+            self.results_table.setItem(i, 0, QTableWidgetItem(f"{i + 1}: {name}"))
+            self.results_table.setItem(i, 1, QTableWidgetItem(str(int(count))))
+        self.results_table.setItem(len(counts), 0, QTableWidgetItem("0: Unclassified"))
+        self.results_table.setItem(len(counts), 1, QTableWidgetItem(str(unclassified)))
+
+        bands = [result.class_map + 1, result.best_score]
+        if result.top_k is not None:
+            bands.extend(result.top_k[:, :, j] + 1 for j in range(1, result.top_k.shape[2]))
+        output = np.stack([b.astype(np.float32) for b in bands], axis=2)
+        self.matching_complete.emit(output, f"{self._layer_name}_{result.method.upper()}", self._layer_name)
+
+    def _on_matching_error(self, message):
+        self.run_btn.setEnabled(True)
+        self.progress_bar.setVisible(False)
+        QMessageBox.critical(self, "Spectral Matching", f"Matching failed:\n{message}")
+
+    def closeEvent(self, event):
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.wait()
+        super().closeEvent(event)